@@ -24,6 +24,7 @@ from tools.project import (
     calculate_progress,
     generate_build,
     is_windows,
+    verify_build,
 )
 
 # Game versions
@@ -35,7 +36,7 @@ VERSIONS = [
 parser = argparse.ArgumentParser()
 parser.add_argument(
     "mode",
-    choices=["configure", "progress"],
+    choices=["configure", "progress", "verify"],
     default="configure",
     help="script mode (default: configure)",
     nargs="?",
@@ -102,6 +103,68 @@ parser.add_argument(
     type=Path,
     help="path to sjiswrap.exe (optional)",
 )
+parser.add_argument(
+    "--compile-cache",
+    metavar="DIR",
+    type=Path,
+    help="cache compiled objects in DIR (optional)",
+)
+parser.add_argument(
+    "--compile-cache-size",
+    metavar="SIZE",
+    default="2G",
+    help="maximum compile cache size (default: 2G)",
+)
+parser.add_argument(
+    "--compile-jobs",
+    metavar="N",
+    type=int,
+    help="maximum parallel compiles (default: from --jobs and memory)",
+)
+parser.add_argument(
+    "--compile-memory",
+    metavar="MIB",
+    type=int,
+    help="estimated memory per compiler process in MiB (default: by wrapper)",
+)
+parser.add_argument(
+    "--heavy-jobs",
+    metavar="N",
+    type=int,
+    help="maximum parallel compiles of large units (default: a quarter of jobs)",
+)
+parser.add_argument(
+    "--heavy-unit-size",
+    metavar="BYTES",
+    type=int,
+    help="compile units with larger sources in a separate pool (default: off)",
+)
+parser.add_argument(
+    "--pools",
+    action="store_true",
+    help="limit compiles and links with ninja pools",
+)
+parser.add_argument(
+    "--jobs",
+    metavar="N",
+    type=int,
+    help="parallel jobs the build runs with, for sizing pools (default: ninja's)",
+)
+parser.add_argument(
+    "--ctx-batch",
+    action="store_true",
+    help="generate all context files from a single decompctx process",
+)
+parser.add_argument(
+    "--ctx-conditionals",
+    action="store_true",
+    help="leave conditional code the unit doesn't compile out of context files",
+)
+parser.add_argument(
+    "--check-splits",
+    action="store_true",
+    help="check splits.txt for overlaps and misalignment",
+)
 parser.add_argument(
     "--verbose",
     action="store_true",
@@ -135,6 +198,17 @@ config.generate_map = args.map
 config.non_matching = args.non_matching
 config.sjiswrap_path = args.sjiswrap
 config.progress = args.progress
+config.compile_cache_dir = args.compile_cache
+config.compile_cache_size = args.compile_cache_size
+config.use_pools = args.pools
+config.build_jobs = args.jobs
+config.compile_pool_depth = args.compile_jobs
+config.compile_memory = args.compile_memory
+config.heavy_pool_depth = args.heavy_jobs
+config.heavy_unit_size = args.heavy_unit_size or None
+config.ctx_batch = args.ctx_batch
+config.ctx_conditionals = args.ctx_conditionals
+config.check_splits = args.check_splits
 if not is_windows():
     config.wrapper = args.wrapper
 # Don't build asm unless we're --non-matching
@@ -1035,6 +1109,7 @@ config.progress_categories = [
     ProgressCategory("FMOD", "FMOD SDK"),
 ]
 config.progress_each_module = args.verbose
+config.print_makespan = args.verbose
 
 if args.mode == "configure":
     # Write build.ninja and objdiff.json
@@ -1042,5 +1117,8 @@ if args.mode == "configure":
 elif args.mode == "progress":
     # Print progress and write progress.json
     calculate_progress(config)
+elif args.mode == "verify":
+    # Compare the built DOL with the original section by section
+    verify_build(config)
 else:
     sys.exit("Unknown mode: " + args.mode)
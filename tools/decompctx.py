@@ -5,93 +5,978 @@
 #
 # Usage:
 #   python3 tools/decompctx.py src/file.cpp
+#   python3 tools/decompctx.py src/SB/Core/x/xEnt.cpp -I include --benchmark 20
+#
+# With -f, only the declarations needed by the named functions are kept
+# (see tools/minimal_ctx.py):
+#   python3 tools/decompctx.py src/SB/Game/zWadNME.cpp -I include \
+#     -f zNMEDennis::RenderHud
+#
+# With --conditionals, conditionals are evaluated against the -D/-U defines
+# and code the unit doesn't compile is left out. The lines after it move up,
+# so __LINE__ (as in the OSPanic asserts of dvd.c, dvdfs.c and vi.c) expands
+# to other numbers than in the full context. __FILE__ names the context file
+# in both modes, not the original source:
+#   python3 tools/decompctx.py src/dolphin/src/vi/vi.c -I include \
+#     -I src/dolphin/include --conditionals -D NDEBUG=1 --lang c
+#
+# Batch mode generates the context of every unit listed in a JSON file
+# (as written by configure.py) in one process, expanding each header once:
+#   python3 tools/decompctx.py --batch build/GGVE78/ctx.json -d build/GGVE78/ctx.d
 #
 # If changes are made, please submit a PR to
 # https://github.com/encounter/dtk-template
 ###
 
 import argparse
+import functools
+import json
 import os
 import re
-from typing import List
+import sys
+import time
+from typing import (
+    Any,
+    Dict,
+    Iterator,
+    List,
+    Optional,
+    Sequence,
+    Set,
+    Tuple,
+    Union,
+)
+
+try:
+    from .minimal_ctx import minimize_text
+except ImportError:
+    from minimal_ctx import minimize_text  # type: ignore
 
 script_dir = os.path.dirname(os.path.realpath(__file__))
 root_dir = os.path.abspath(os.path.join(script_dir, ".."))
 src_dir = os.path.join(root_dir, "src")
-include_dirs: List[str] = []  # Set with -I flag
 
-include_pattern = re.compile(r'^#\s*include\s*[<"](.+?)[>"]')
+include_pattern = re.compile(r'^#\s*include\s*([<"])(.+?)[>"]')
 guard_pattern = re.compile(r"^#\s*ifndef\s+(.*)$")
 once_pattern = re.compile(r"^#\s*pragma\s+once$")
+directive_pattern = re.compile(r"^\s*#\s*(\w*)(.*)$", re.S)
+define_pattern = re.compile(r"\s*([A-Za-z_]\w*)(\()?(.*)$", re.S)
+comment_pattern = re.compile(r"/[*/]|[\"']")
+literal_patterns = {
+    '"': re.compile(r'"(?:\\.|[^"\\])*"?'),
+    "'": re.compile(r"'(?:\\.|[^'\\])*'?"),
+}
 
-defines = set()
-deps = []
 
+# A source file split at its #include lines. Files are read in one go and
+# parsed once, independent of the unit being generated.
+class SourceFile:
+    def __init__(self, path: str, text: str) -> None:
+        self.path = path
+        self.empty = not text
+        self.guard: Optional[str] = None
+        self.once = False
+        # Text before each include, the included name, its line index,
+        # and whether the name is in angle brackets
+        self.segments: List[Tuple[str, str, int, bool]] = []
+        self.tail = ""
 
-def import_h_file(in_file: str, r_path: str) -> str:
-    rel_path = os.path.join(root_dir, r_path, in_file)
-    if os.path.exists(rel_path):
-        return import_c_file(rel_path)
-    for include_dir in include_dirs:
-        inc_path = os.path.join(include_dir, in_file)
-        if os.path.exists(inc_path):
-            return import_c_file(inc_path)
-    else:
-        print("Failed to locate", in_file)
-        return ""
+        lines = text.split("\n")
+        if lines[-1] == "":
+            lines.pop()
+            lines = [line + "\n" for line in lines]
+        else:
+            lines = [line + "\n" for line in lines[:-1]] + [lines[-1]]
+
+        if lines:
+            first = lines[0].strip()
+            guard_match = guard_pattern.match(first)
+            if guard_match:
+                self.guard = guard_match[1]
+            elif once_pattern.match(first):
+                self.once = True
+
+        start = 0
+        for idx, line in enumerate(lines):
+            if "#" not in line:
+                continue
+            include_match = include_pattern.match(line.strip())
+            if include_match and not include_match[2].endswith(".s"):
+                text = "".join(lines[start:idx])
+                angled = include_match[1] == "<"
+                self.segments.append((text, include_match[2], idx, angled))
+                start = idx + 1
+        self.tail = "".join(lines[start:])
+        self.lines = lines
+        self._items: Optional[List[Tuple[str, Optional[str], str, int]]] = None
 
+    # The file as runs of plain lines and single preprocessor directives,
+    # with continuation lines joined and comments skipped. Each item is its
+    # original text, the directive name (None for plain lines), the directive
+    # argument without comments, and its line index.
+    def items(self) -> List[Tuple[str, Optional[str], str, int]]:
+        if self._items is not None:
+            return self._items
+        items: List[Tuple[str, Optional[str], str, int]] = []
+        lines = self.lines
+        # Only lines that can start a directive or a comment need a look
+        marked = [i for i, line in enumerate(lines) if "#" in line or "/*" in line]
+        start = 0  # First line not in an item yet
+        end = 0  # First line not scanned yet
+        for idx in marked:
+            if idx < end:
+                continue
+            line = lines[idx]
+            match = directive_pattern.match(line) if "#" in line else None
+            if match is None:
+                in_comment = "/*" in line and strip_comments(line, False)[1]
+                end = idx + 1
+            else:
+                if start < idx:
+                    items.append(("".join(lines[start:idx]), None, "", start))
+                end = idx + 1
+                while lines[end - 1].rstrip("\r\n").endswith("\\") and end < len(lines):
+                    end += 1
+                text = "".join(lines[idx:end])
+                if end > idx + 1:
+                    match = directive_pattern.match(re.sub(r"\\\r?\n", "", text))
+                    assert match is not None
+                arg, in_comment = match[2], False
+                if "/" in arg:
+                    arg, in_comment = strip_comments(arg, False)
+                items.append((text, match[1], arg.strip(), idx))
+                start = end
+            # Skip to the end of a block comment
+            while in_comment and end < len(lines):
+                if "*/" in lines[end]:
+                    in_comment = strip_comments(lines[end], True)[1]
+                end += 1
+        if start < len(lines):
+            items.append(("".join(lines[start:]), None, "", start))
+        self._items = items
+        return items
+
+
+# Removes comments from a line, given whether it starts inside a block comment.
+# Returns the remaining code, and whether the line ends inside a block comment.
+def strip_comments(line: str, in_comment: bool) -> Tuple[str, bool]:
+    code: List[str] = []
+    pos = 0
+    while pos < len(line):
+        if in_comment:
+            end = line.find("*/", pos)
+            if end < 0:
+                break
+            code.append(" ")
+            pos = end + 2
+            in_comment = False
+            continue
+        match = comment_pattern.search(line, pos)
+        if match is None:
+            code.append(line[pos:])
+            break
+        code.append(line[pos : match.start()])
+        token = match[0]
+        if token == "//":
+            break
+        if token == "/*":
+            in_comment = True
+            pos = match.end()
+            continue
+        literal = literal_patterns[token].match(line, match.start())
+        assert literal is not None
+        code.append(literal[0])
+        pos = literal.end()
+    return "".join(code), in_comment
 
-def import_c_file(in_file: str) -> str:
-    in_file = os.path.relpath(in_file, root_dir)
-    deps.append(in_file)
-    out_text = ""
 
+def read_text(path: str) -> str:
     try:
-        with open(in_file, encoding="utf-8") as file:
-            out_text += process_file(in_file, list(file))
+        with open(path, encoding="utf-8") as file:
+            return file.read()
     except Exception:
-        with open(in_file) as file:
-            out_text += process_file(in_file, list(file))
-    return out_text
+        with open(path) as file:
+            return file.read()
 
 
-def process_file(in_file: str, lines: List[str]) -> str:
-    out_text = ""
-    for idx, line in enumerate(lines):
-        if idx == 0:
-            guard_match = guard_pattern.match(line.strip())
-            if guard_match:
-                if guard_match[1] in defines:
-                    break
-                defines.add(guard_match[1])
+# Macro states, besides a definition's replacement text
+MAYBE = object()  # May or may not be defined
+OPAQUE = object()  # Defined, but not usable in expressions (function-like)
+
+# Macros the compiler defines, as far as conditionals are concerned. Values
+# aren't assumed, so that conditionals on them are kept in the output.
+compiler_macros: Dict[str, object] = {
+    "__MWERKS__": OPAQUE,
+    "__STDC__": MAYBE,
+    "__STDC_VERSION__": MAYBE,
+    "__embedded_cplusplus": MAYBE,
+    "__POWERPC__": MAYBE,
+    "__PPC__": MAYBE,
+    "__PPCGEKKO__": MAYBE,
+    "__PPCBROADWAY__": MAYBE,
+    "__GEKKO__": MAYBE,
+}
+
+token_pattern = re.compile(
+    r"\s*(?:(0[xX][0-9a-fA-F]+|\d+)[uUlL]*|'(\\?.)'|([A-Za-z_]\w*)"
+    r"|(&&|\|\||==|!=|<=|>=|<<|>>|[-+*/%<>!~&|^?:(),]))"
+)
+char_escapes = {"\\n": 10, "\\t": 9, "\\r": 13, "\\0": 0}
+
+# Tokens of an expression: numbers, identifiers and operators,
+# and None for a value that isn't known
+Token = Union[int, str, None]
+
+
+# Splits a conditional expression into tokens, raising ValueError if it
+# contains anything not understood
+@functools.lru_cache(maxsize=None)
+def tokenize(text: str) -> Tuple[Token, ...]:
+    tokens: List[Token] = []
+    pos = 0
+    text = text.rstrip()
+    while pos < len(text):
+        match = token_pattern.match(text, pos)
+        if match is None:
+            raise ValueError(text)
+        number, char, name, op = match.groups()
+        if number is not None:
+            if len(number) > 1 and number[0] == "0" and number[1] not in "xX":
+                tokens.append(int(number, 8))
             else:
-                once_match = once_pattern.match(line.strip())
-                if once_match:
-                    if in_file in defines:
-                        break
-                    defines.add(in_file)
-            print("Processing file", in_file)
-        include_match = include_pattern.match(line.strip())
-        if include_match and not include_match[1].endswith(".s"):
-            out_text += f'/* "{in_file}" line {idx} "{include_match[1]}" */\n'
-            out_text += import_h_file(include_match[1], os.path.dirname(in_file))
-            out_text += f'/* end "{include_match[1]}" */\n'
+                tokens.append(int(number, 0))
+        elif char is not None:
+            if len(char) == 1:
+                tokens.append(ord(char))
+            elif char in char_escapes:
+                tokens.append(char_escapes[char])
+            else:
+                raise ValueError(text)
+        else:
+            tokens.append(name or op)
+        pos = match.end()
+    return tuple(tokens)
+
+
+def is_identifier(token: Token) -> bool:
+    return isinstance(token, str) and (token[0].isalpha() or token[0] == "_")
+
+
+# Binary operators by precedence, from lowest
+binary_precedence = {
+    "||": 1,
+    "&&": 2,
+    "|": 3,
+    "^": 4,
+    "&": 5,
+    "==": 6,
+    "!=": 6,
+    "<": 7,
+    ">": 7,
+    "<=": 7,
+    ">=": 7,
+    "<<": 8,
+    ">>": 8,
+    "+": 9,
+    "-": 9,
+    "*": 10,
+    "/": 10,
+    "%": 10,
+}
+
+
+def apply_binary(op: str, left: Optional[int], right: Optional[int]) -> Optional[int]:
+    # Logical operators are known when either side decides them
+    if op == "&&":
+        if left == 0 or right == 0:
+            return 0
+        return None if left is None or right is None else 1
+    if op == "||":
+        if left or right:
+            return 1
+        return None if left is None or right is None else 0
+    if left is None or right is None:
+        return None
+    if op in ("/", "%"):
+        if right == 0:
+            return None
+        quotient = abs(left) // abs(right)
+        if (left < 0) != (right < 0):
+            quotient = -quotient
+        return quotient if op == "/" else left - quotient * right
+    if op in ("<<", ">>") and right < 0:
+        return None
+    return {
+        "|": lambda: left | right,
+        "^": lambda: left ^ right,
+        "&": lambda: left & right,
+        "==": lambda: int(left == right),
+        "!=": lambda: int(left != right),
+        "<": lambda: int(left < right),
+        ">": lambda: int(left > right),
+        "<=": lambda: int(left <= right),
+        ">=": lambda: int(left >= right),
+        "<<": lambda: left << right,
+        ">>": lambda: left >> right,
+        "+": lambda: left + right,
+        "-": lambda: left - right,
+        "*": lambda: left * right,
+    }[op]()
+
+
+# Evaluates a macro-expanded conditional expression, returning None if the
+# result depends on unknown values. Raises ValueError on invalid expressions.
+class ExpressionParser:
+    def __init__(self, tokens: List[Token]) -> None:
+        self.tokens = tokens
+        self.pos = 0
+
+    def evaluate(self) -> Optional[int]:
+        value = self.conditional()
+        if self.pos != len(self.tokens):
+            raise ValueError("unexpected token")
+        return value
+
+    def next(self) -> Token:
+        if self.pos >= len(self.tokens):
+            raise ValueError("unexpected end of expression")
+        self.pos += 1
+        return self.tokens[self.pos - 1]
+
+    def peek(self) -> Token:
+        return self.tokens[self.pos] if self.pos < len(self.tokens) else ""
+
+    def expect(self, token: str) -> None:
+        if self.next() != token:
+            raise ValueError(f"expected {token}")
+
+    def conditional(self) -> Optional[int]:
+        condition = self.binary(1)
+        if self.peek() != "?":
+            return condition
+        self.pos += 1
+        left = self.conditional()
+        self.expect(":")
+        right = self.conditional()
+        if condition is None:
+            return left if left == right else None
+        return left if condition else right
+
+    def binary(self, min_precedence: int) -> Optional[int]:
+        left = self.unary()
+        while True:
+            op = self.peek()
+            precedence = binary_precedence.get(op) if isinstance(op, str) else None
+            if precedence is None or precedence < min_precedence:
+                return left
+            self.pos += 1
+            right = self.binary(precedence + 1)
+            assert isinstance(op, str)
+            left = apply_binary(op, left, right)
+
+    def unary(self) -> Optional[int]:
+        token = self.next()
+        if token == "(":
+            value = self.conditional()
+            self.expect(")")
+            return value
+        if token in ("!", "~", "-", "+"):
+            value = self.unary()
+            if value is None:
+                return None
+            if token == "!":
+                return int(not value)
+            if token == "~":
+                return ~value
+            return -value if token == "-" else value
+        if token is None or isinstance(token, int):
+            return token
+        raise ValueError(f"unexpected {token}")
+
+
+# Output of a context, as a tree of strings and (shared) fragments
+Parts = List[Union[str, "Fragment"]]
+
+
+def iter_parts(parts: Parts) -> Iterator[str]:
+    stack = [iter(parts)]
+    while stack:
+        for part in stack[-1]:
+            if isinstance(part, str):
+                yield part
+            else:
+                stack.append(iter(part.parts))
+                break
+        else:
+            stack.pop()
+
+
+# Expanded text of a header, along with the include guards the expansion
+# depends on. A fragment can be reused by any unit where the guards it found
+# defined are defined, and the guards it found undefined are undefined.
+class Fragment:
+    def __init__(self) -> None:
+        self.parts: Parts = []
+        self.deps: List[str] = []
+        self.missing: List[str] = []
+        self.absent: Set[str] = set()  # Checked and not yet defined
+        self.present: Set[str] = set()  # Checked and already defined
+        self.added: Set[str] = set()  # Defined by the expansion
+        # With conditionals evaluated, the macro states read before being
+        # written by the expansion, and the final state of those it wrote
+        self.reads: Dict[str, object] = {}
+        self.writes: Dict[str, object] = {}
+
+
+# Names in a directory listing are compared case-insensitively where the
+# file system usually is
+if sys.platform in ("win32", "cygwin", "darwin"):
+    fold_case = str.lower
+else:
+
+    def fold_case(name: str) -> str:
+        return name
+
+
+# Directory listings, each read once. Paths are relative to the root directory.
+class DirectoryCache:
+    def __init__(self) -> None:
+        self.listings: Dict[str, Set[str]] = {}
+
+    def listing(self, path: str) -> Set[str]:
+        names = self.listings.get(path)
+        if names is None:
+            try:
+                with os.scandir(os.path.join(root_dir, path)) as entries:
+                    names = {fold_case(entry.name) for entry in entries}
+            except OSError:
+                names = set()
+            self.listings[path] = names
+        return names
+
+    def exists(self, path: str) -> bool:
+        head, tail = os.path.split(path)
+        return bool(tail) and fold_case(tail) in self.listing(head)
+
+
+# Resolves include names to paths (relative to the root directory), caching
+# each result. Follows MWCC's search order: by default, the directory of the
+# including file and then every -I path are searched for both kinds of
+# include. After -I- (given as "-" in the include list), earlier paths are
+# user paths, searched only for quoted includes, later paths are system paths,
+# and the including file's directory is no longer searched.
+class IncludeResolver:
+    def __init__(self, include_dirs: Sequence[str], directories: DirectoryCache):
+        self.directories = directories
+        dirs = [normalize_dir(d) if d != "-" else d for d in include_dirs]
+        self.explicit = "-" in dirs
+        if self.explicit:
+            split = dirs.index("-")
+            self.user_dirs = dirs[:split]
+            self.system_dirs = [d for d in dirs[split + 1 :] if d != "-"]
+        else:
+            self.user_dirs = []
+            self.system_dirs = dirs
+        self.results: Dict[Tuple[str, str, bool], Optional[str]] = {}
+
+    def resolve(self, includer_dir: str, name: str, angled: bool) -> Optional[str]:
+        key = ("" if self.explicit else includer_dir, name, angled)
+        if key in self.results:
+            return self.results[key]
+
+        search: List[str] = []
+        if not self.explicit:
+            search.append(includer_dir)
+        if not (self.explicit and angled):
+            search.extend(self.user_dirs)
+        search.extend(self.system_dirs)
+
+        result = None
+        for directory in search:
+            candidate = os.path.normpath(os.path.join(directory, name))
+            if self.directories.exists(candidate):
+                result = candidate
+                break
+        self.results[key] = result
+        return result
+
+
+# Makes an include directory relative to the root directory
+def normalize_dir(path: str) -> str:
+    if os.path.isabs(path):
+        path = os.path.relpath(path, root_dir)
+    return os.path.normpath(path)
+
+
+# Parsed files, include resolution and header fragments, shared between units
+class HeaderCache:
+    def __init__(self) -> None:
+        self.files: Dict[str, SourceFile] = {}
+        self.fragments: Dict[Tuple[Any, ...], List[Fragment]] = {}
+        self.directories = DirectoryCache()
+        self.resolvers: Dict[Tuple[str, ...], IncludeResolver] = {}
+
+    def resolver(self, include_dirs: Tuple[str, ...]) -> IncludeResolver:
+        resolver = self.resolvers.get(include_dirs)
+        if resolver is None:
+            resolver = IncludeResolver(include_dirs, self.directories)
+            self.resolvers[include_dirs] = resolver
+        return resolver
+
+    def source_file(self, path: str) -> SourceFile:
+        source = self.files.get(path)
+        if source is None:
+            source = self.files[path] = SourceFile(path, read_text(path))
+        return source
+
+
+# Context of a single unit. Text is appended to a list of parts, with
+# cached headers referenced instead of copied, and only joined when written.
+class Context:
+    def __init__(
+        self,
+        include_dirs: Sequence[str],
+        cache: Optional[HeaderCache] = None,
+        verbose: bool = True,
+    ) -> None:
+        self.include_dirs = tuple(include_dirs)
+        self.cache = cache or HeaderCache()
+        self.resolver = self.cache.resolver(self.include_dirs)
+        self.verbose = verbose
+        self.defines: Set[str] = set()
+        self.deps: List[str] = []
+        self.missing: List[str] = []
+        self.parts: Parts = []
+        # Fragments being expanded, innermost last
+        self.recording: List[Fragment] = []
+        self.sink = self.parts
+
+    def text(self) -> str:
+        return "".join(iter_parts(self.parts))
+
+    def write(self, path: str) -> None:
+        with open(path, "w", encoding="utf-8") as f:
+            f.writelines(iter_parts(self.parts))
+
+    def import_h_file(self, in_file: str, r_path: str, angled: bool = False) -> None:
+        path = self.resolver.resolve(r_path, in_file, angled)
+        if path is not None:
+            self.import_header(path)
+        else:
+            if self.verbose:
+                print("Failed to locate", in_file)
+            self.missing.append(in_file)
+            for fragment in self.recording:
+                fragment.missing.append(in_file)
+
+    # Imports a header, given its path relative to the root directory
+    def import_header(self, path: str) -> None:
+        key = self.fragment_key(path)
+        for fragment in self.cache.fragments.get(key, []):
+            if self.matches(fragment):
+                self.apply(fragment)
+                return
+
+        fragment = Fragment()
+        deps_start = len(self.deps)
+        parent_sink = self.sink
+        self.recording.append(fragment)
+        self.sink = fragment.parts
+        try:
+            self.import_file(path)
+        finally:
+            self.recording.pop()
+            self.sink = parent_sink
+        fragment.deps = self.deps[deps_start:]
+        self.cache.fragments.setdefault(key, []).append(fragment)
+        self.sink.append(fragment)
+
+    def fragment_key(self, path: str) -> Tuple[Any, ...]:
+        return (path, self.include_dirs)
+
+    # Whether a cached fragment expands the same way in this unit
+    def matches(self, fragment: Fragment) -> bool:
+        return fragment.present <= self.defines and not (fragment.absent & self.defines)
+
+    # Replays a cached fragment's effects on this unit
+    def apply(self, fragment: Fragment) -> None:
+        for outer in self.recording:
+            outer.present |= fragment.present - outer.added
+            outer.absent |= fragment.absent
+            outer.added |= fragment.added
+            outer.missing.extend(fragment.missing)
+        self.defines |= fragment.added
+        self.deps.extend(fragment.deps)
+        self.missing.extend(fragment.missing)
+        self.sink.append(fragment)
+
+    # Marks a guard as defined, returning whether it already was
+    def check_guard(self, guard: str) -> bool:
+        if guard in self.defines:
+            for fragment in self.recording:
+                if guard not in fragment.added:
+                    fragment.present.add(guard)
+            return True
+        for fragment in self.recording:
+            fragment.absent.add(guard)
+            fragment.added.add(guard)
+        self.defines.add(guard)
+        return False
+
+    def import_c_file(self, in_file: str) -> None:
+        self.import_file(os.path.relpath(in_file, root_dir))
+
+    def import_file(self, path: str) -> None:
+        self.deps.append(path)
+        self.process_file(self.cache.source_file(path))
+
+    def process_file(self, source: SourceFile) -> None:
+        in_file = source.path
+        if not source.empty:
+            if source.guard is not None:
+                if self.check_guard(source.guard):
+                    return
+            elif source.once:
+                if self.check_guard(in_file):
+                    return
+            if self.verbose:
+                print("Processing file", in_file)
+
+        in_dir = os.path.dirname(in_file)
+        sink = self.sink
+        for text, name, idx, angled in source.segments:
+            if text:
+                sink.append(text)
+            sink.append(f'/* "{in_file}" line {idx} "{name}" */\n')
+            self.import_h_file(name, in_dir, angled)
+            sink.append(f'/* end "{name}" */\n')
+        if source.tail:
+            sink.append(source.tail)
+
+
+# Context of a unit with conditionals evaluated against its defines, leaving
+# out dead branches and the headers they include. Conditionals that can't be
+# decided are kept as they are, along with their possibly live branches.
+class ConditionalContext(Context):
+    def __init__(
+        self,
+        include_dirs: Sequence[str],
+        defines: Sequence[str],
+        undefines: Sequence[str],
+        cplusplus: bool,
+        cache: Optional[HeaderCache] = None,
+        verbose: bool = True,
+    ) -> None:
+        super().__init__(include_dirs, cache, verbose)
+        self.cplusplus = cplusplus
+        self.macros: Dict[str, object] = dict(compiler_macros)
+        if cplusplus:
+            self.macros["__cplusplus"] = OPAQUE
+        for define in defines:
+            name, equals, value = define.partition("=")
+            self.macros[name] = value if equals else "1"
+        for name in undefines:
+            self.macros.pop(name, None)
+        # Whether the current line is certainly compiled, as opposed to being
+        # in a branch of a conditional that was kept
+        self.certain = True
+
+    def fragment_key(self, path: str) -> Tuple[Any, ...]:
+        return (path, self.include_dirs, "conditional", self.certain)
+
+    def matches(self, fragment: Fragment) -> bool:
+        macros = self.macros
+        return all(macros.get(name) == value for name, value in fragment.reads.items())
+
+    def apply(self, fragment: Fragment) -> None:
+        for outer in self.recording:
+            for name, value in fragment.reads.items():
+                if name not in outer.reads and name not in outer.writes:
+                    outer.reads[name] = value
+            outer.writes.update(fragment.writes)
+            outer.missing.extend(fragment.missing)
+        for name, value in fragment.writes.items():
+            self.set_macro(name, value)
+        self.deps.extend(fragment.deps)
+        self.missing.extend(fragment.missing)
+        self.sink.append(fragment)
+
+    def set_macro(self, name: str, value: object) -> None:
+        if value is None:
+            self.macros.pop(name, None)
         else:
-            out_text += line
+            self.macros[name] = value
+
+    # Returns the state of a macro (None if undefined), recording it as an
+    # input of the fragments being expanded
+    def read_macro(self, name: str) -> object:
+        value = self.macros.get(name)
+        for fragment in self.recording:
+            if name not in fragment.reads and name not in fragment.writes:
+                fragment.reads[name] = value
+        return value
+
+    def write_macro(self, name: str, value: object) -> None:
+        if not self.certain:
+            value = MAYBE
+        self.set_macro(name, value)
+        for fragment in self.recording:
+            fragment.writes[name] = value
+
+    # Replaces the identifiers of an expression with their values
+    def expand(self, tokens: Sequence[Token], hidden: Set[str]) -> List[Token]:
+        expanded: List[Token] = []
+        idx = 0
+        while idx < len(tokens):
+            token = tokens[idx]
+            idx += 1
+            if not isinstance(token, str) or not is_identifier(token):
+                expanded.append(token)
+                continue
+            if token == "defined":
+                parens = 1 if idx < len(tokens) and tokens[idx] == "(" else 0
+                end = idx + parens * 2
+                if end >= len(tokens) or (parens and tokens[end] != ")"):
+                    raise ValueError("invalid defined")
+                name = tokens[idx + parens]
+                if not isinstance(name, str) or not is_identifier(name):
+                    raise ValueError("invalid defined")
+                idx = end + 1
+                value = self.read_macro(name)
+                expanded.append(None if value is MAYBE else int(value is not None))
+                continue
+            if token in hidden:
+                expanded.append(0)
+                continue
+            value = self.read_macro(token)
+            if isinstance(value, str):
+                expanded.extend(self.expand(tokenize(value), hidden | {token}))
+            elif value is None:
+                expanded.append(int(self.cplusplus and token == "true"))
+            else:
+                expanded.append(None)
+        return expanded
+
+    # Evaluates a conditional directive to 0 or 1, or None if it can't be
+    # decided
+    def condition(self, kind: str, arg: str) -> Optional[int]:
+        """
+        >>> context = ConditionalContext([], ["FOO"], [], False, verbose=False)
+        >>> [context.condition("if", f"{op}defined{name} && 1")
+        ...  for op in ("", "!") for name in (" FOO", "(FOO)", " BAR", "(BAR)")]
+        [1, 1, 0, 0, 0, 0, 1, 1]
+        """
+        if kind in ("ifdef", "ifndef"):
+            names = arg.split()
+            if not names or not is_identifier(names[0]):
+                return None
+            value = self.read_macro(names[0])
+            if value is MAYBE:
+                return None
+            return int((value is not None) == (kind == "ifdef"))
+        try:
+            value = ExpressionParser(self.expand(tokenize(arg), set())).evaluate()
+        except ValueError:
+            return None
+        return None if value is None else int(value != 0)
 
-    return out_text
+    # Enters a branch of a conditional, returning whether it's live. The
+    # directive is kept when it can't be decided, and an #else is kept when
+    # the branch is taken after such a directive.
+    def branch(
+        self, frame: List[bool], value: Optional[int], kept: str, taken: str
+    ) -> bool:
+        if value == 0:
+            return False
+        if value is None:
+            self.sink.append(kept)
+            frame[3] = True
+            self.certain = False
+            return True
+        frame[2] = True
+        if frame[3]:
+            self.sink.append(taken)
+            self.certain = False
+        return True
+
+    def process_file(self, source: SourceFile) -> None:
+        in_file = source.path
+        if source.once:
+            # Not a valid macro name, so it can't clash with one
+            once = f"#once {in_file}"
+            if self.read_macro(once) not in (None, MAYBE):
+                return
+            self.write_macro(once, "")
+        if self.verbose and not source.empty:
+            print("Processing file", in_file)
+
+        in_dir = os.path.dirname(in_file)
+        sink = self.sink
+        certain = self.certain
+        live = True
+        # Enclosing conditionals: whether the line before was live, and
+        # certain, whether a branch is known to be taken, and whether the
+        # conditional is kept in the output
+        stack: List[List[bool]] = []
+        for text, kind, arg, idx in source.items():
+            if kind is None:
+                if live:
+                    sink.append(text)
+            elif kind in ("if", "ifdef", "ifndef"):
+                frame = [live, self.certain, False, False]
+                stack.append(frame)
+                if live:
+                    live = self.branch(frame, self.condition(kind, arg), text, "")
+            elif kind in ("elif", "else", "endif") and stack:
+                frame = stack[-1]
+                live = False
+                self.certain = frame[1]
+                if kind == "endif":
+                    stack.pop()
+                    live = frame[0]
+                    if frame[3]:
+                        sink.append(text)
+                elif frame[0] and not frame[2]:
+                    if kind == "else":
+                        live = self.branch(frame, 1, text, text)
+                    else:
+                        kept = text if frame[3] else f"#if {arg}\n"
+                        value = self.condition("if", arg)
+                        live = self.branch(frame, value, kept, "#else\n")
+            elif not live:
+                continue
+            elif kind == "include":
+                match = include_pattern.match(text.strip())
+                if match is None or match[2].endswith(".s"):
+                    sink.append(text)
+                    continue
+                name = match[2]
+                sink.append(f'/* "{in_file}" line {idx} "{name}" */\n')
+                self.import_h_file(name, in_dir, match[1] == "<")
+                sink.append(f'/* end "{name}" */\n')
+            else:
+                sink.append(text)
+                match = define_pattern.match(arg)
+                if kind == "undef" and match is not None:
+                    self.write_macro(match[1], None)
+                elif kind == "define" and match is not None:
+                    self.write_macro(match[1], OPAQUE if match[2] else match[3].strip())
+        self.certain = certain
 
 
 def sanitize_path(path: str) -> str:
     return path.replace("\\", "/").replace(" ", "\\ ")
 
 
+def write_depfile(path: str, output: str, deps: List[str]) -> None:
+    with open(os.path.join(root_dir, path), "w", encoding="utf-8") as f:
+        f.write(sanitize_path(output) + ":")
+        for dep in deps:
+            path = sanitize_path(dep)
+            f.write(f" \\\n\t{path}")
+
+
+cpp_extensions = (".cc", ".cp", ".cpp", ".cxx")
+
+
+# Creates the context of a unit, evaluating conditionals if it asks to
+def create_context(
+    unit: Dict[str, Any], cache: Optional[HeaderCache] = None, verbose: bool = True
+) -> Context:
+    if not unit.get("conditionals"):
+        return Context(unit["includes"], cache, verbose)
+    lang = unit.get("lang")
+    if lang is None:
+        lang = "c++" if unit["source"].lower().endswith(cpp_extensions) else "c"
+    return ConditionalContext(
+        unit["includes"],
+        unit.get("defines", []),
+        unit.get("undefines", []),
+        lang == "c++",
+        cache,
+        verbose,
+    )
+
+
+# Dependencies, number of includes not found, output size and generation time
+UnitResult = Tuple[List[str], int, int, float]
+
+
+# Generates the context (and depfile) of a batch unit
+def generate_unit(unit: Dict[str, Any], cache: HeaderCache) -> UnitResult:
+    start = time.perf_counter()
+    context = create_context(unit, cache, verbose=False)
+    context.import_c_file(unit["source"])
+    output = os.path.join(root_dir, unit["output"])
+    os.makedirs(os.path.dirname(output), exist_ok=True)
+    context.write(output)
+    if unit.get("depfile"):
+        depfile = os.path.join(root_dir, unit["depfile"])
+        os.makedirs(os.path.dirname(depfile), exist_ok=True)
+        write_depfile(depfile, unit["output"], context.deps)
+    elapsed = time.perf_counter() - start
+    missing = sorted(set(context.missing))
+    if unit.get("verbose"):
+        for name in missing:
+            print(f"{unit['source']}: failed to locate {name}", file=sys.stderr)
+    return context.deps, len(missing), os.path.getsize(output), elapsed
+
+
+def print_stats(source: str, result: UnitResult) -> None:
+    deps, _, size, elapsed = result
+    print(f"{source}: {size} bytes, {len(deps)} files, {elapsed * 1000:.1f} ms")
+
+
+# Each worker process keeps its own cache across the chunks it's given
+_worker_cache: Optional[HeaderCache] = None
+
+
+def generate_chunk(units: List[Dict[str, Any]]) -> List[UnitResult]:
+    global _worker_cache
+    if _worker_cache is None:
+        _worker_cache = HeaderCache()
+    return [generate_unit(unit, _worker_cache) for unit in units]
+
+
+def generate_batch(units: List[Dict[str, Any]], jobs: int) -> List[UnitResult]:
+    if jobs <= 1 or len(units) <= 1:
+        cache = HeaderCache()
+        return [generate_unit(unit, cache) for unit in units]
+
+    from multiprocessing import Pool
+
+    # Contiguous chunks keep units with the same includes in the same worker
+    chunk_size = max(1, -(-len(units) // (jobs * 4)))
+    chunks = [units[i : i + chunk_size] for i in range(0, len(units), chunk_size)]
+    with Pool(jobs) as pool:
+        results = pool.map(generate_chunk, chunks, chunksize=1)
+    return [result for chunk in results for result in chunk]
+
+
+# Times context generation from a cold cache, as done for a single unit
+def benchmark(unit: Dict[str, Any], count: int) -> None:
+    times: List[float] = []
+    size = 0
+    for _ in range(count):
+        start = time.perf_counter()
+        context = create_context(unit, verbose=False)
+        context.import_c_file(unit["source"])
+        size = len(context.text())
+        times.append(time.perf_counter() - start)
+    times.sort()
+    print(
+        f"{unit['source']}: {size} bytes, {len(context.deps)} files,"
+        f" min {times[0] * 1000:.1f} ms, median {times[len(times) // 2] * 1000:.1f} ms"
+    )
+
+
 def main():
     parser = argparse.ArgumentParser(
         description="""Create a context file which can be used for decomp.me"""
     )
     parser.add_argument(
         "c_file",
+        nargs="?",
         help="""File from which to create context""",
     )
     parser.add_argument(
@@ -108,26 +993,123 @@ def main():
     parser.add_argument(
         "-I",
         "--include",
-        help="""Include directory""",
+        help="""Include directory ("-" to split user and system paths, as -I-)""",
+        action="append",
+    )
+    parser.add_argument(
+        "-D",
+        "--define",
+        metavar="NAME[=VALUE]",
+        help="""Define a macro for --conditionals""",
+        action="append",
+    )
+    parser.add_argument(
+        "-U",
+        "--undefine",
+        metavar="NAME",
+        help="""Undefine a macro for --conditionals""",
+        action="append",
+    )
+    parser.add_argument(
+        "--lang",
+        choices=["c", "c++"],
+        help="""Source language for --conditionals (default: from the file name)""",
+    )
+    parser.add_argument(
+        "--conditionals",
+        action="store_true",
+        help="""Evaluate conditionals against the defines, leaving out dead code""",
+    )
+    parser.add_argument(
+        "-f",
+        "--function",
+        help="""Only keep what this function needs (may be repeated)""",
         action="append",
     )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="""Print the size and generation time of each context""",
+    )
+    parser.add_argument(
+        "--batch",
+        metavar="JSON",
+        help="""Generate the context of every unit in a JSON list""",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=1,
+        help="""Worker processes for batch mode""",
+    )
+    parser.add_argument(
+        "--benchmark",
+        metavar="N",
+        type=int,
+        help="""Time N generations of the context without writing it""",
+    )
+    parser.add_argument(
+        "-v",
+        "--verbose",
+        action="store_true",
+        help="""List includes that couldn't be located in batch mode""",
+    )
     args = parser.parse_args()
 
+    if args.batch:
+        with open(args.batch, encoding="utf-8") as f:
+            units: List[Dict[str, Any]] = json.load(f)
+        for unit in units:
+            unit["verbose"] = args.verbose
+            unit["conditionals"] = args.conditionals
+        results = generate_batch(units, args.jobs)
+        if args.depfile and units:
+            # Combined depfile for the batch edge, named after its first output
+            all_deps = sorted({dep for result in results for dep in result[0]})
+            write_depfile(args.depfile, units[0]["output"], all_deps)
+        if args.stats:
+            for unit, result in zip(units, results):
+                print_stats(unit["source"], result)
+        missing = sum(result[1] for result in results)
+        if missing and not args.verbose:
+            print(f"{missing} include(s) couldn't be located, use -v to list them")
+        return
+
+    if args.c_file is None:
+        exit("No input file specified")
     if args.include is None:
         exit("No include directories specified")
-    global include_dirs
-    include_dirs = args.include
-    output = import_c_file(args.c_file)
-
-    with open(os.path.join(root_dir, args.output), "w", encoding="utf-8") as f:
-        f.write(output)
+    unit = {
+        "source": args.c_file,
+        "includes": args.include,
+        "conditionals": args.conditionals,
+        "defines": args.define or [],
+        "undefines": args.undefine or [],
+        "lang": args.lang,
+    }
+    if args.benchmark:
+        benchmark(unit, args.benchmark)
+        return
+    start = time.perf_counter()
+    context = create_context(unit)
+    context.import_c_file(args.c_file)
+    output = os.path.join(root_dir, args.output)
+    if args.function:
+        text, missing = minimize_text("".join(iter_parts(context.parts)), args.function)
+        if missing:
+            sys.exit(f"Function(s) not found in {args.c_file}: {', '.join(missing)}")
+        with open(output, "w", encoding="utf-8") as f:
+            f.write(text)
+    else:
+        context.write(output)
 
     if args.depfile:
-        with open(os.path.join(root_dir, args.depfile), "w", encoding="utf-8") as f:
-            f.write(sanitize_path(args.output) + ":")
-            for dep in deps:
-                path = sanitize_path(dep)
-                f.write(f" \\\n\t{path}")
+        write_depfile(args.depfile, args.output, context.deps)
+    if args.stats:
+        elapsed = time.perf_counter() - start
+        result = (context.deps, len(context.missing), os.path.getsize(output), elapsed)
+        print_stats(args.c_file, result)
 
 
 if __name__ == "__main__":
@@ -0,0 +1,434 @@
+#!/usr/bin/env python3
+
+###
+# Demangler for names mangled by CodeWarrior (MWCC), such as
+# zMusicGetCurrentVolume__FUi or update__6zCamSBFR6xScenef.
+#
+# demangle() parses a single name and is memoized, so the same name is only
+# parsed once per process. demangle_all() demangles many names at once,
+# skipping names that can't be mangled without parsing them and parsing
+# each distinct name once.
+#
+# Usage:
+#   python3 tools/demangle.py update__6zCamSBFR6xScenef
+#   python3 tools/demangle.py --symbols config/GGVE78/symbols.txt
+#   python3 tools/demangle.py --check
+#
+# From Python:
+#   from tools.demangle import demangle, demangle_all
+#   demangle("__ct__6zCamSBFv")  # "zCamSB::zCamSB()"
+###
+
+import argparse
+import functools
+import os
+import re
+import sys
+from typing import Dict, Iterable, List, Optional, Tuple
+
+try:
+    from .dwarf_index import DEFAULT_ROOT, DwarfIndex
+except ImportError:
+    from dwarf_index import DEFAULT_ROOT, DwarfIndex  # type: ignore
+
+BASE_TYPES = {
+    "v": "void",
+    "b": "bool",
+    "c": "char",
+    "s": "short",
+    "i": "int",
+    "l": "long",
+    "x": "long long",
+    "f": "float",
+    "d": "double",
+    "r": "long double",
+    "w": "wchar_t",
+    "e": "...",
+}
+
+OPERATORS = {
+    "nw": "operator new",
+    "nwa": "operator new[]",
+    "dl": "operator delete",
+    "dla": "operator delete[]",
+    "pl": "operator+",
+    "mi": "operator-",
+    "ml": "operator*",
+    "dv": "operator/",
+    "md": "operator%",
+    "er": "operator^",
+    "ad": "operator&",
+    "or": "operator|",
+    "co": "operator~",
+    "nt": "operator!",
+    "as": "operator=",
+    "lt": "operator<",
+    "gt": "operator>",
+    "apl": "operator+=",
+    "ami": "operator-=",
+    "amu": "operator*=",
+    "adv": "operator/=",
+    "amd": "operator%=",
+    "aer": "operator^=",
+    "aad": "operator&=",
+    "aor": "operator|=",
+    "ls": "operator<<",
+    "rs": "operator>>",
+    "als": "operator<<=",
+    "ars": "operator>>=",
+    "eq": "operator==",
+    "ne": "operator!=",
+    "le": "operator<=",
+    "ge": "operator>=",
+    "aa": "operator&&",
+    "oo": "operator||",
+    "pp": "operator++",
+    "mm": "operator--",
+    "cm": "operator,",
+    "rm": "operator->*",
+    "rf": "operator->",
+    "cl": "operator()",
+    "vc": "operator[]",
+    "vt": "__vtable",
+    "RTTI": "__RTTI",
+}
+
+digits_pattern = re.compile(r"\d+")
+template_pattern = re.compile(r"<[^<>]*>")
+literal_pattern = re.compile(r"-?\d+(?=[,>]|$)")
+
+
+class DemangleError(Exception):
+    pass
+
+
+# Parses a type from the start of text, returning the parts before and after
+# the declarator (so pointers to functions and arrays can be built around
+# it) and the rest of text
+def parse_type(text: str) -> Tuple[str, str, str]:
+    pre = ""
+    post = ""
+    idx = 0
+    while idx < len(text) and text[idx] in "PRCV":
+        char = text[idx]
+        idx += 1
+        if char in "PR":
+            symbol = "*" if char == "P" else "&"
+            post = f"{symbol} {pre.strip()}{post}".rstrip() if pre else symbol + post
+            pre = ""
+        elif char == "C":
+            pre += "const "
+        else:
+            pre += "volatile "
+    text = text[idx:]
+    if not text:
+        raise DemangleError("missing type")
+
+    if text[0] == "Q" or text[0].isdigit():
+        _, qualified, text = parse_qualified(text)
+        return f"{pre}{qualified}", post, text
+
+    member = ""
+    if text[0] == "M":
+        _, member, text = parse_qualified(text[1:])
+        post = f"{member}::*{post}"
+        if text.startswith("C"):
+            text = text[1:]
+    if text[0] == "F":
+        args, text = parse_args(text[1:])
+        if member and args:
+            # Drop the implicit this pointer
+            args = args[1:]
+        if not text.startswith("_"):
+            raise DemangleError("missing return type")
+        ret_pre, ret_post, text = parse_type(text[1:])
+        arg_list = ", ".join(args)
+        declarator = f" ({post.strip()})" if post else ""
+        return f"{ret_pre}{declarator}({arg_list})", ret_post, text
+    if text[0] == "A":
+        match = digits_pattern.match(text, 1)
+        if match is None or text[match.end() : match.end() + 1] != "_":
+            raise DemangleError("bad array")
+        elem_pre, elem_post, text = parse_type(text[match.end() + 1 :])
+        declarator = f" ({post.strip()})" if post else ""
+        return f"{pre}{elem_pre}{declarator}[{match.group()}]", elem_post, text
+
+    signed = ""
+    if text[0] == "U":
+        signed = "unsigned "
+        text = text[1:]
+    elif text[0] == "S":
+        signed = "signed "
+        text = text[1:]
+    if not text or text[0] not in BASE_TYPES:
+        raise DemangleError(f"unknown type {text[:1]!r}")
+    return f"{pre}{signed}{BASE_TYPES[text[0]]}", post, text[1:]
+
+
+def format_type(text: str) -> Tuple[str, str]:
+    type_pre, type_post, text = parse_type(text)
+    return type_pre + type_post, text
+
+
+# Parses function arguments up to the end of text or a "_" before the return
+# type. A single void argument means no arguments.
+def parse_args(text: str) -> Tuple[List[str], str]:
+    args: List[str] = []
+    while text and not text.startswith("_"):
+        arg, text = format_type(text)
+        args.append(arg)
+    if args == ["void"]:
+        args = []
+    return args, text
+
+
+# Resolves the template arguments in a name, such as "Foo<i,Pc>"
+def parse_template(name: str) -> str:
+    start = name.find("<")
+    if start < 0 or not name.endswith(">"):
+        return name
+    text = name[start + 1 : -1]
+    args: List[str] = []
+    while text:
+        match = literal_pattern.match(text)
+        if match is not None:
+            arg, text = match.group(), text[match.end() :]
+        else:
+            arg, text = format_type(text)
+        args.append(arg)
+        if text.startswith(","):
+            text = text[1:]
+        elif text:
+            raise DemangleError("bad template arguments")
+    # Avoid ">>" in nested templates
+    close = " >" if args and args[-1].endswith(">") else ">"
+    return f"{name[:start]}<{', '.join(args)}{close}"
+
+
+def parse_class(text: str) -> Tuple[str, str]:
+    match = digits_pattern.match(text)
+    if match is None:
+        raise DemangleError("missing class name")
+    end = match.end() + int(match.group())
+    if end > len(text) or end == match.end():
+        raise DemangleError("bad class name")
+    return parse_template(text[match.end() : end]), text[end:]
+
+
+# Parses a class name or a Q qualified name, returning the last name, the
+# full name and the rest of text
+def parse_qualified(text: str) -> Tuple[str, str, str]:
+    if not text.startswith("Q"):
+        name, text = parse_class(text)
+        return name, name, text
+    if len(text) < 2 or not text[1].isdigit():
+        raise DemangleError("bad qualified name")
+    names: List[str] = []
+    count = int(text[1])
+    text = text[2:]
+    for _ in range(count):
+        name, text = parse_class(text)
+        names.append(name)
+    return names[-1], "::".join(names), text
+
+
+# Finds the "__" separating the name from the class and arguments, skipping
+# template arguments and the type of conversion operators
+def find_split(name: str, special: bool) -> int:
+    start = 0
+    if special and name.startswith("op"):
+        try:
+            _, rest = format_type(name[2:])
+        except DemangleError:
+            return -1
+        start = len(name) - len(rest)
+    depth = 0
+    for idx in range(start, len(name) - 2):
+        char = name[idx]
+        if char == "<":
+            depth += 1
+        elif char == ">":
+            depth -= 1
+        elif char == "_" and depth == 0 and name[idx + 1] == "_":
+            following = name[idx + 2]
+            if following in "FQC" or following.isdigit():
+                return idx
+    return -1
+
+
+def demangle_name(name: str) -> str:
+    special = name.startswith("__")
+    text = name[2:] if special else name
+    split = find_split(text, special)
+    if split < 0:
+        raise DemangleError("not mangled")
+    # Names ending in underscores, like "foo___Fv"
+    while text[split + 2 : split + 3] == "_":
+        split += 1
+    base = text[:split]
+    text = text[split + 2 :]
+
+    class_name = ""
+    qualified = ""
+    if not text.startswith("F"):
+        class_name, qualified, text = parse_qualified(text)
+    is_const = text.startswith("C")
+    if is_const:
+        text = text[1:]
+
+    if special:
+        base_name = base.split("<", 1)[0]
+        if base == "ct":
+            base = class_name.split("<", 1)[0]
+        elif base == "dt":
+            base = "~" + class_name.split("<", 1)[0]
+        elif base.startswith("op"):
+            conversion, _ = format_type(base[2:])
+            base = f"operator {conversion}"
+        elif base_name in OPERATORS:
+            base = OPERATORS[base_name] + parse_template(base[len(base_name) :])
+        else:
+            base = "__" + parse_template(base)
+    else:
+        base = parse_template(base)
+
+    if text.startswith("F"):
+        args, text = parse_args(text[1:])
+        if text.startswith("_"):
+            # Return type of template functions
+            _, text = format_type(text[1:])
+        base = f"{base}({', '.join(args)}){' const' if is_const else ''}"
+    if text:
+        raise DemangleError(f"trailing {text!r}")
+    return f"{qualified}::{base}" if qualified else base
+
+
+# Demangled name, or None if the name isn't mangled. Local statics like
+# "init$localstatic3$GetInstance__9xFooClassFv" are demangled as
+# "xFooClass::GetInstance()::init".
+@functools.lru_cache(maxsize=1 << 16)
+def demangle(name: str) -> Optional[str]:
+    if not name.isascii() or name.startswith("@"):
+        return None
+    first = name.find("$")
+    if first > 0:
+        second = name.find("$", first + 1)
+        if second < 0:
+            return None
+        function = demangle(name[second + 1 :]) or name[second + 1 :]
+        return f"{function}::{name[:first]}"
+    try:
+        return demangle_name(name)
+    except (DemangleError, IndexError, ValueError):
+        return None
+
+
+# Demangles names in bulk, returning each demangled name or the name itself.
+# Names without "__" are never mangled, so they're returned without parsing.
+def demangle_all(names: Iterable[str]) -> List[str]:
+    results: Dict[str, str] = {}
+    output: List[str] = []
+    for name in names:
+        result = results.get(name)
+        if result is None:
+            if "__" in name:
+                result = demangle(name) or name
+            else:
+                result = name
+            results[name] = result
+        output.append(result)
+    return output
+
+
+# Qualified name of a demangled function, without its arguments
+def function_name(demangled: str) -> str:
+    depth = 0
+    for idx, char in enumerate(demangled):
+        if char == "<":
+            depth += 1
+        elif char == ">":
+            depth -= 1
+        elif char == "(" and depth == 0:
+            # The name of operator() itself
+            if demangled[idx - 8 : idx + 2] == "operator()":
+                continue
+            return demangled[:idx]
+    return demangled
+
+
+# Checks demangled names against the function names in the DWARF dumps,
+# returning the number of names checked and the mismatches
+def check_dwarf(index: DwarfIndex) -> Tuple[int, List[Tuple[str, str, str]]]:
+    rows = index.conn.execute(
+        "SELECT DISTINCT mangled, name FROM entries"
+        " WHERE kind = 'function' AND mangled LIKE '%\\_\\_%' ESCAPE '\\'"
+    ).fetchall()
+    mismatches: List[Tuple[str, str, str]] = []
+    for (mangled, name), demangled in zip(rows, demangle_all(r[0] for r in rows)):
+        # The dumps leave out template arguments and some of the scopes, and
+        # keep the mangled names of constructors, destructors and operators
+        qualified = template_pattern.sub("", function_name(demangled))
+        name = template_pattern.sub("", name)
+        scope, _, last = name.rpartition("::")
+        if last in ("__ct", "__dt"):
+            class_name = scope.rpartition("::")[2]
+            last = class_name if last == "__ct" else f"~{class_name}"
+        elif last.startswith("__") and last[2:] in OPERATORS:
+            last = OPERATORS[last[2:]]
+        name = f"{scope}::{last}" if scope else last
+        if qualified != name and not qualified.endswith(f"::{name}"):
+            mismatches.append((mangled, name, demangled))
+    return len(rows), mismatches
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="""Demangle CodeWarrior names""")
+    parser.add_argument("names", nargs="*", help="""names to demangle""")
+    parser.add_argument(
+        "--symbols",
+        metavar="FILE",
+        help="""demangle every symbol in a symbols.txt file""",
+    )
+    parser.add_argument(
+        "--check",
+        action="store_true",
+        help="""check demangled function names against the DWARF dumps""",
+    )
+    parser.add_argument(
+        "--root",
+        default=DEFAULT_ROOT,
+        help=f"""dump directory for --check (default: {DEFAULT_ROOT})""",
+    )
+    args = parser.parse_args()
+
+    failed = False
+    for name in args.names:
+        demangled = demangle(name)
+        if demangled is None:
+            print(f"{name}: not mangled", file=sys.stderr)
+            failed = True
+        else:
+            print(demangled)
+
+    if args.symbols:
+        if not os.path.isfile(args.symbols):
+            sys.exit(f"{args.symbols} not found")
+        with open(args.symbols, encoding="utf-8") as f:
+            names = [line.split(" ", 1)[0] for line in f if line.strip()]
+        for name, demangled in zip(names, demangle_all(names)):
+            print(f"{name}\t{demangled}" if demangled != name else name)
+
+    if args.check:
+        with DwarfIndex(args.root) as index:
+            index.update()
+            checked, mismatches = check_dwarf(index)
+        for mangled, name, demangled in mismatches:
+            print(f"{mangled}: {demangled}, DWARF has {name}")
+        print(f"{checked - len(mismatches)}/{checked} names match the DWARF dumps")
+        failed = failed or bool(mismatches)
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
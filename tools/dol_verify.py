@@ -0,0 +1,269 @@
+#!/usr/bin/env python3
+
+###
+# Compares a built DOL with the original section by section, to find what
+# broke when the SHA-1 check fails.
+#
+# Both files are memory-mapped and each section is hashed on its own. In a
+# section that differs, the differing byte ranges are found by bisecting
+# memoryview slices, so matching parts are compared with memcmp without being
+# copied. The first differing ranges are mapped to their symbols and
+# translation units through symbols.txt and splits.txt.
+#
+# Usage:
+#   python3 tools/dol_verify.py build/GGVE78/main.dol orig/GGVE78/sys/main.dol
+#   python3 tools/dol_verify.py build/GGVE78/main.dol orig/GGVE78/sys/main.dol -n 50
+#   python3 configure.py verify
+###
+
+import argparse
+import hashlib
+import mmap
+import os
+import struct
+import sys
+import time
+from typing import List, NamedTuple, Optional, Tuple
+
+try:
+    from .splits import Splits, load_splits
+    from .symbols import SymbolTable, load_symbols
+except ImportError:
+    from splits import Splits, load_splits  # type: ignore
+    from symbols import SymbolTable, load_symbols  # type: ignore
+
+TEXT_SECTIONS = 7
+DATA_SECTIONS = 11
+HEADER_SIZE = 0x100
+# Offsets, addresses and sizes of the text and then data sections
+header_struct = struct.Struct(f">{(TEXT_SECTIONS + DATA_SECTIONS) * 3}I")
+
+# Ranges at most this long are scanned byte by byte instead of bisected
+SCAN_SIZE = 64
+
+
+class DolSection(NamedTuple):
+    name: str
+    offset: int
+    address: int
+    size: int
+
+
+class Difference(NamedTuple):
+    section: str
+    address: int
+    size: int
+
+
+# Sections by DOL slot (text0-6, then data0-10), None for empty slots
+def read_sections(data: memoryview, path: str) -> List[Optional[DolSection]]:
+    if len(data) < HEADER_SIZE:
+        sys.exit(f"{path}: not a DOL file")
+    values = header_struct.unpack_from(data)
+    count = TEXT_SECTIONS + DATA_SECTIONS
+    sections: List[Optional[DolSection]] = []
+    for idx in range(count):
+        offset = values[idx]
+        address = values[count + idx]
+        size = values[count * 2 + idx]
+        if size == 0:
+            sections.append(None)
+            continue
+        if offset + size > len(data):
+            sys.exit(f"{path}: section {idx} extends past the end of the file")
+        sections.append(DolSection(slot_name(idx), offset, address, size))
+    return sections
+
+
+def slot_name(idx: int) -> str:
+    if idx < TEXT_SECTIONS:
+        return f"text{idx}"
+    return f"data{idx - TEXT_SECTIONS}"
+
+
+# Differing [start, end) ranges of two equally long buffers, at most limit
+def find_differences(a: memoryview, b: memoryview, limit: int) -> List[Tuple[int, int]]:
+    ranges: List[Tuple[int, int]] = []
+    # Ranges still to compare, as a stack so they're found in address order
+    stack = [(0, len(a))]
+    while stack and len(ranges) <= limit:
+        start, end = stack.pop()
+        if a[start:end] == b[start:end]:
+            continue
+        if end - start > SCAN_SIZE:
+            middle = (start + end) // 2
+            stack.append((middle, end))
+            stack.append((start, middle))
+            continue
+        for idx in range(start, end):
+            if a[idx] == b[idx]:
+                continue
+            # Merge with the previous range if adjacent
+            if ranges and ranges[-1][1] == idx:
+                ranges[-1] = (ranges[-1][0], idx + 1)
+            else:
+                ranges.append((idx, idx + 1))
+    return ranges[:limit]
+
+
+def describe(
+    address: int, symbols: Optional[SymbolTable], splits: Optional[Splits]
+) -> str:
+    parts: List[str] = []
+    symbol = symbols.at(address) if symbols is not None else None
+    if symbol is not None:
+        parts.append(f"{symbol.name}+{address - symbol.address:#x}")
+    split = splits.at(address) if splits is not None else None
+    if split is not None:
+        parts.append(f"in {split.unit}")
+    return " ".join(parts) if parts else "unknown"
+
+
+# Compares the sections of two DOLs, printing the sections that differ and
+# the first differences. Returns whether the files match.
+def verify_dol(
+    built_path: str,
+    orig_path: str,
+    symbols_path: Optional[str] = None,
+    splits_path: Optional[str] = None,
+    limit: int = 10,
+) -> bool:
+    start_time = time.perf_counter()
+    with open(built_path, "rb") as built_file, open(orig_path, "rb") as orig_file:
+        with mmap.mmap(
+            built_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as built_map, mmap.mmap(
+            orig_file.fileno(), 0, access=mmap.ACCESS_READ
+        ) as orig_map:
+            built = memoryview(built_map)
+            orig = memoryview(orig_map)
+            try:
+                return compare_dols(
+                    built,
+                    orig,
+                    built_path,
+                    orig_path,
+                    symbols_path,
+                    splits_path,
+                    limit,
+                    start_time,
+                )
+            finally:
+                # Views must be released before the maps are closed
+                built.release()
+                orig.release()
+
+
+def compare_dols(
+    built: memoryview,
+    orig: memoryview,
+    built_path: str,
+    orig_path: str,
+    symbols_path: Optional[str],
+    splits_path: Optional[str],
+    limit: int,
+    start_time: float,
+) -> bool:
+    built_sections = read_sections(built, built_path)
+    orig_sections = read_sections(orig, orig_path)
+
+    splits = load_splits(splits_path) if splits_path else None
+    differences: List[Difference] = []
+    matched = True
+    for idx, (built_section, orig_section) in enumerate(
+        zip(built_sections, orig_sections)
+    ):
+        if built_section is None and orig_section is None:
+            continue
+        if built_section is None or orig_section is None:
+            matched = False
+            missing = "built" if built_section is None else "original"
+            print(f"  MISMATCH  {slot_name(idx):<12} missing in the {missing} DOL")
+            continue
+        name = orig_section.name
+        if splits is not None:
+            found = splits.overlapping(orig_section.address, orig_section.address + 1)
+            if found:
+                name = found[0].section
+        built_data = built[
+            built_section.offset : built_section.offset + built_section.size
+        ]
+        orig_data = orig[orig_section.offset : orig_section.offset + orig_section.size]
+        built_hash = hashlib.sha1(built_data).hexdigest()
+        orig_hash = hashlib.sha1(orig_data).hexdigest()
+        if built_hash == orig_hash and built_section.address == orig_section.address:
+            print(f"  OK        {name:<12} 0x{orig_section.address:08X}")
+            continue
+        matched = False
+        if built_section.address != orig_section.address:
+            print(
+                f"  MISMATCH  {name:<12} 0x{orig_section.address:08X}: built at"
+                f" 0x{built_section.address:08X}"
+            )
+            continue
+        size = min(built_section.size, orig_section.size)
+        if built_section.size != orig_section.size:
+            print(
+                f"  MISMATCH  {name:<12} 0x{orig_section.address:08X}: size"
+                f" {built_section.size:#x}, expected {orig_section.size:#x}"
+            )
+        else:
+            print(f"  MISMATCH  {name:<12} 0x{orig_section.address:08X}")
+        if len(differences) < limit:
+            ranges = find_differences(
+                built_data[:size], orig_data[:size], limit - len(differences)
+            )
+            for start, end in ranges:
+                address = orig_section.address + start
+                differences.append(Difference(name, address, end - start))
+
+    if differences:
+        symbols = load_symbols(symbols_path) if symbols_path else None
+        print(f"First {len(differences)} differences:")
+        for difference in differences:
+            print(
+                f"  0x{difference.address:08X} ({difference.size:#x} bytes):"
+                f" {describe(difference.address, symbols, splits)}"
+            )
+    elapsed = time.perf_counter() - start_time
+    result = "match" if matched else "don't match"
+    print(f"Sections {result} ({elapsed * 1000:.0f} ms)")
+    return matched
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Compare the sections of a built DOL with the original"""
+    )
+    parser.add_argument("built", help="""built DOL""")
+    parser.add_argument("original", help="""original DOL""")
+    parser.add_argument(
+        "--symbols",
+        default=os.path.join("config", "GGVE78", "symbols.txt"),
+        help="""symbols file (default: config/GGVE78/symbols.txt)""",
+    )
+    parser.add_argument(
+        "--splits",
+        default=os.path.join("config", "GGVE78", "splits.txt"),
+        help="""splits file (default: config/GGVE78/splits.txt)""",
+    )
+    parser.add_argument(
+        "-n",
+        "--limit",
+        type=int,
+        default=10,
+        help="""number of differences to map to symbols (default: 10)""",
+    )
+    args = parser.parse_args()
+
+    for path in (args.built, args.original):
+        if not os.path.isfile(path):
+            sys.exit(f"{path} not found")
+    symbols_path = args.symbols if os.path.isfile(args.symbols) else None
+    splits_path = args.splits if os.path.isfile(args.splits) else None
+    if not verify_dol(args.built, args.original, symbols_path, splits_path, args.limit):
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,550 @@
+#!/usr/bin/env python3
+
+###
+# Indexes the DWARF dumps in dwarf/ (one text file per translation unit) into
+# an SQLite database, so functions, type definitions and line tables can be
+# looked up without searching the dumps.
+#
+# Each dump is parsed into entries (functions, structs, enums, unions,
+# typedefs and variables) with their byte range in the dump, plus the line
+# table of each function. Entry names and declarations are added to a
+# full-text index when SQLite supports FTS5. Queries update the index first,
+# re-parsing only the dumps that changed since the last run.
+#
+# Usage:
+#   python3 tools/dwarf_index.py function zCamSB::update
+#   python3 tools/dwarf_index.py type xEnt --all
+#   python3 tools/dwarf_index.py lines zMusicUpdate
+#   python3 tools/dwarf_index.py address 0x2bf1a0
+#   python3 tools/dwarf_index.py search "xVec3 AND Render"
+#
+# From Python:
+#   from tools.dwarf_index import DwarfIndex
+#   with DwarfIndex("dwarf/SB04_Multi_Sku") as index:
+#       index.update()
+#       index.functions("zMusicUpdate")
+###
+
+import argparse
+import hashlib
+import os
+import re
+import sqlite3
+import sys
+import time
+from typing import Any, Dict, Iterable, List, NamedTuple, Optional, Tuple
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+
+DEFAULT_ROOT = os.path.join("dwarf", "SB04_Multi_Sku")
+# Bump when the schema or parser changes, to rebuild existing indexes
+SCHEMA_VERSION = 1
+
+SCHEMA = """
+CREATE TABLE files (
+    id INTEGER PRIMARY KEY,
+    path TEXT UNIQUE NOT NULL,
+    size INTEGER NOT NULL,
+    mtime INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE TABLE entries (
+    id INTEGER PRIMARY KEY,
+    file_id INTEGER NOT NULL,
+    kind TEXT NOT NULL,
+    name TEXT NOT NULL,
+    short_name TEXT NOT NULL,
+    mangled TEXT,
+    address INTEGER,
+    end_address INTEGER,
+    start INTEGER NOT NULL,
+    end INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    hash TEXT NOT NULL
+);
+CREATE INDEX entries_file ON entries (file_id);
+CREATE INDEX entries_name ON entries (name);
+CREATE INDEX entries_short_name ON entries (short_name);
+CREATE INDEX entries_mangled ON entries (mangled);
+CREATE INDEX entries_address ON entries (address);
+CREATE TABLE lines (
+    entry_id INTEGER NOT NULL,
+    line INTEGER NOT NULL,
+    address INTEGER NOT NULL,
+    offset INTEGER NOT NULL
+);
+CREATE INDEX lines_entry ON lines (entry_id);
+"""
+
+type_pattern = re.compile(r"^(struct|union|enum|class)\s+(\w+)")
+forward_pattern = re.compile(r"^typedef\s+(?:struct|union|enum|class)\s+\w+;$")
+function_name_pattern = re.compile(r"((?:\w+::)*~?\w+)\s*\(")
+pointer_name_pattern = re.compile(r"\(\*\s*(\w+)\)")
+variable_name_pattern = re.compile(r"(\w+)\s*(?:\[[^\]]*\]\s*)*;$")
+line_pattern = re.compile(
+    r"^\s*// Line (\d+), Address: (0x[0-9a-fA-F]+), Func Offset: (0x[0-9a-fA-F]+|0)"
+)
+func_end_pattern = re.compile(r"^\s*// Func End, Address: (0x[0-9a-fA-F]+)")
+
+
+class Entry(NamedTuple):
+    id: int
+    path: str
+    kind: str
+    name: str
+    mangled: Optional[str]
+    address: Optional[int]
+    end_address: Optional[int]
+    start: int
+    end: int
+    line: int
+    hash: str
+
+
+# An entry being parsed
+class ParsedEntry:
+    def __init__(self, kind: str, name: str, start: int, line: int) -> None:
+        self.kind = kind
+        self.name = name
+        self.mangled: Optional[str] = None
+        self.address: Optional[int] = None
+        self.end_address: Optional[int] = None
+        self.start = start
+        self.end = start
+        self.line = line
+        self.body: List[str] = []
+        self.lines: List[Tuple[int, int, int]] = []
+
+    @property
+    def short_name(self) -> str:
+        return self.name.rsplit("::", 1)[-1]
+
+
+# Name declared by a typedef or variable declaration
+def declared_name(line: str) -> Optional[str]:
+    match = pointer_name_pattern.search(line) or variable_name_pattern.search(line)
+    return match.group(1) if match else None
+
+
+# Whether a top-level declaration is a function prototype, rather than a
+# variable (which may be a function pointer)
+def is_prototype(line: str) -> bool:
+    paren = line.find("(")
+    return paren >= 0 and not line[paren + 1 :].lstrip().startswith("*")
+
+
+def parse_dump(data: bytes) -> List[ParsedEntry]:
+    entries: List[ParsedEntry] = []
+    current: Optional[ParsedEntry] = None
+    depth = 0
+    mangled: Optional[str] = None
+    mangled_start = 0
+    address: Optional[int] = None
+    offset = 0
+    for line_num, raw in enumerate(data.splitlines(keepends=True), 1):
+        start = offset
+        offset += len(raw)
+        line = raw.decode("utf-8", errors="replace").rstrip("\r\n")
+
+        if current is not None:
+            match = line_pattern.match(line)
+            if match is not None:
+                line_info = (
+                    int(match.group(1)),
+                    int(match.group(2), 16),
+                    int(match.group(3), 0),
+                )
+                current.lines.append(line_info)
+                continue
+            match = func_end_pattern.match(line)
+            if match is not None:
+                current.end_address = int(match.group(1), 16)
+                continue
+            current.body.append(line)
+            depth += line.count("{") - line.count("}")
+            if depth <= 0 and "}" in line:
+                current.end = offset
+                entries.append(current)
+                current = None
+                depth = 0
+            continue
+
+        if line.startswith("// Start address: "):
+            address = int(line[len("// Start address: ") :], 16)
+            continue
+        if line.startswith("//"):
+            mangled = line[2:].strip() or None
+            mangled_start = start
+            continue
+        if not line.strip():
+            continue
+
+        if address is not None:
+            match = function_name_pattern.search(line)
+            current = ParsedEntry(
+                "function", match.group(1) if match else line, mangled_start, line_num
+            )
+            current.mangled = mangled
+            current.address = address
+            current.body.append(line)
+            mangled = address = None
+            continue
+        mangled = None
+
+        match = type_pattern.match(line)
+        if match is not None and not line.endswith(";"):
+            current = ParsedEntry(match.group(1), match.group(2), start, line_num)
+            current.body.append(line)
+            continue
+        if forward_pattern.match(line) or not line.endswith(";"):
+            continue
+        if line.startswith("typedef"):
+            kind = "typedef"
+        elif is_prototype(line):
+            continue
+        else:
+            kind = "variable"
+        name = declared_name(line)
+        if name is not None:
+            entry = ParsedEntry(kind, name, start, line_num)
+            entry.end = offset
+            entry.body.append(line)
+            entries.append(entry)
+    return entries
+
+
+def fts5_available(conn: sqlite3.Connection) -> bool:
+    try:
+        conn.execute("CREATE VIRTUAL TABLE temp.fts5_test USING fts5(text)")
+    except sqlite3.OperationalError:
+        return False
+    conn.execute("DROP TABLE temp.fts5_test")
+    return True
+
+
+# Quotes each term of a search as an FTS5 string, so that names such as
+# zCamSB::update are matched as phrases instead of being parsed as columns.
+# AND, OR and NOT stay operators, and a trailing * still makes a prefix query.
+def fts_query(text: str) -> str:
+    terms: List[str] = []
+    for term in text.split():
+        if term in ("AND", "OR", "NOT"):
+            terms.append(term)
+            continue
+        prefix = len(term) > 1 and term.endswith("*")
+        if prefix:
+            term = term[:-1]
+        terms.append('"' + term.replace('"', '""') + '"' + ("*" if prefix else ""))
+    return " ".join(terms)
+
+
+class DwarfIndex:
+    def __init__(self, root: str, db_path: Optional[str] = None) -> None:
+        self.root = root
+        if db_path is None:
+            name = os.path.basename(os.path.normpath(root))
+            db_path = os.path.join(root_dir, "build", "dwarf", f"{name}.sqlite")
+        os.makedirs(os.path.dirname(db_path) or ".", exist_ok=True)
+        self.conn = sqlite3.connect(db_path)
+        version = self.conn.execute("PRAGMA user_version").fetchone()[0]
+        self.fts = fts5_available(self.conn)
+        if version != SCHEMA_VERSION:
+            self.create_schema()
+        else:
+            self.fts = self.has_table("entries_fts")
+
+    def __enter__(self) -> "DwarfIndex":
+        return self
+
+    def __exit__(self, *args: Any) -> None:
+        self.close()
+
+    def close(self) -> None:
+        self.conn.close()
+
+    def has_table(self, name: str) -> bool:
+        query = "SELECT 1 FROM sqlite_master WHERE name = ?"
+        return self.conn.execute(query, (name,)).fetchone() is not None
+
+    def create_schema(self) -> None:
+        with self.conn:
+            for (name,) in self.conn.execute(
+                "SELECT name FROM sqlite_master WHERE type = 'table'"
+                " AND name NOT LIKE 'sqlite_%' AND name NOT LIKE 'entries_fts_%'"
+            ).fetchall():
+                self.conn.execute(f"DROP TABLE IF EXISTS {name}")
+            self.conn.executescript(SCHEMA)
+            if self.fts:
+                self.conn.execute(
+                    "CREATE VIRTUAL TABLE entries_fts USING fts5(name, body)"
+                )
+            self.conn.execute(f"PRAGMA user_version = {SCHEMA_VERSION}")
+
+    def dump_paths(self) -> Iterable[str]:
+        for dir_path, dir_names, file_names in os.walk(self.root):
+            dir_names.sort()
+            for file_name in sorted(file_names):
+                path = os.path.join(dir_path, file_name)
+                yield os.path.relpath(path, self.root).replace(os.sep, "/")
+
+    def remove_file(self, file_id: int) -> None:
+        entry_ids = "SELECT id FROM entries WHERE file_id = ?"
+        self.conn.execute(
+            f"DELETE FROM lines WHERE entry_id IN ({entry_ids})", (file_id,)
+        )
+        if self.fts:
+            self.conn.execute(
+                f"DELETE FROM entries_fts WHERE rowid IN ({entry_ids})", (file_id,)
+            )
+        self.conn.execute("DELETE FROM entries WHERE file_id = ?", (file_id,))
+        self.conn.execute("DELETE FROM files WHERE id = ?", (file_id,))
+
+    def add_file(self, path: str, data: bytes, stat: os.stat_result) -> None:
+        cursor = self.conn.execute(
+            "INSERT INTO files (path, size, mtime, hash) VALUES (?, ?, ?, ?)",
+            (path, stat.st_size, stat.st_mtime_ns, hashlib.sha1(data).hexdigest()),
+        )
+        file_id = cursor.lastrowid
+        lines: List[Tuple[int, int, int, int]] = []
+        fts_rows: List[Tuple[int, str, str]] = []
+        for entry in parse_dump(data):
+            body = "\n".join(entry.body)
+            cursor = self.conn.execute(
+                "INSERT INTO entries (file_id, kind, name, short_name, mangled,"
+                " address, end_address, start, end, line, hash)"
+                " VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)",
+                (
+                    file_id,
+                    entry.kind,
+                    entry.name,
+                    entry.short_name,
+                    entry.mangled,
+                    entry.address,
+                    entry.end_address,
+                    entry.start,
+                    entry.end,
+                    entry.line,
+                    hashlib.sha1(body.encode("utf-8")).hexdigest()[:16],
+                ),
+            )
+            entry_id = cursor.lastrowid
+            lines.extend((entry_id, *line) for line in entry.lines)
+            fts_rows.append((entry_id, entry.name, body))
+        self.conn.executemany("INSERT INTO lines VALUES (?, ?, ?, ?)", lines)
+        if self.fts:
+            self.conn.executemany(
+                "INSERT INTO entries_fts (rowid, name, body) VALUES (?, ?, ?)", fts_rows
+            )
+
+    # Re-parses dumps that changed since the last update.
+    # Returns the number of dumps parsed and removed.
+    def update(self) -> Tuple[int, int]:
+        rows = self.conn.execute("SELECT id, path, size, mtime, hash FROM files")
+        known: Dict[str, Tuple[int, int, int, str]] = {
+            row[1]: (row[0], row[2], row[3], row[4]) for row in rows
+        }
+        parsed = 0
+        with self.conn:
+            for path in self.dump_paths():
+                full_path = os.path.join(self.root, path)
+                stat = os.stat(full_path)
+                row = known.pop(path, None)
+                if row is not None and row[1:3] == (stat.st_size, stat.st_mtime_ns):
+                    continue
+                with open(full_path, "rb") as f:
+                    data = f.read()
+                if row is not None:
+                    if row[3] == hashlib.sha1(data).hexdigest():
+                        self.conn.execute(
+                            "UPDATE files SET size = ?, mtime = ? WHERE id = ?",
+                            (stat.st_size, stat.st_mtime_ns, row[0]),
+                        )
+                        continue
+                    self.remove_file(row[0])
+                self.add_file(path, data, stat)
+                parsed += 1
+            for row in known.values():
+                self.remove_file(row[0])
+        return parsed, len(known)
+
+    def query(self, where: str, params: Iterable[Any]) -> List[Entry]:
+        rows = self.conn.execute(
+            "SELECT entries.id, files.path, kind, name, mangled, address,"
+            " end_address, start, end, line, entries.hash"
+            f" FROM entries JOIN files ON files.id = file_id WHERE {where}"
+            " ORDER BY files.path, start",
+            tuple(params),
+        )
+        return [Entry(*row) for row in rows]
+
+    # Functions by qualified, unqualified or mangled name
+    def functions(self, name: str) -> List[Entry]:
+        column = "name" if "::" in name else "short_name"
+        return self.query(
+            f"kind = 'function' AND ({column} = ? OR mangled = ?)", (name, name)
+        )
+
+    # Struct, union, enum and typedef definitions by name
+    def types(self, name: str) -> List[Entry]:
+        return self.query("kind NOT IN ('function', 'variable') AND name = ?", (name,))
+
+    def variables(self, name: str) -> List[Entry]:
+        return self.query("kind = 'variable' AND name = ?", (name,))
+
+    # Functions whose code contains the address
+    def at_address(self, address: int) -> List[Entry]:
+        return self.query(
+            "kind = 'function' AND address <= ? AND end_address > ?",
+            (address, address),
+        )
+
+    # Line table of a function, as (line, address, function offset)
+    def line_table(self, entry: Entry) -> List[Tuple[int, int, int]]:
+        return self.conn.execute(
+            "SELECT line, address, offset FROM lines WHERE entry_id = ? ORDER BY rowid",
+            (entry.id,),
+        ).fetchall()
+
+    # Full-text search over entry names and declarations, or a name
+    # substring search without FTS5. Raises sqlite3.OperationalError for an
+    # invalid query.
+    def search(self, text: str, limit: int = 50) -> List[Entry]:
+        if self.fts:
+            matches = "SELECT rowid FROM entries_fts WHERE entries_fts MATCH ?"
+            return self.query(
+                f"entries.id IN ({matches} LIMIT {int(limit)})", (fts_query(text),)
+            )
+        return self.query(f"name LIKE ? LIMIT {int(limit)}", (f"%{text}%",))
+
+    # Text of an entry, read from its dump
+    def text(self, entry: Entry) -> str:
+        with open(os.path.join(self.root, entry.path), "rb") as f:
+            f.seek(entry.start)
+            return f.read(entry.end - entry.start).decode("utf-8", errors="replace")
+
+    # Hash of the indexed dumps, to key results derived from the index
+    def digest(self) -> str:
+        h = hashlib.sha1()
+        for path, file_hash in self.conn.execute(
+            "SELECT path, hash FROM files ORDER BY path"
+        ):
+            h.update(f"{path}:{file_hash}\n".encode("utf-8"))
+        return h.hexdigest()
+
+    def stats(self) -> Dict[str, int]:
+        counts = dict(
+            self.conn.execute("SELECT kind, COUNT(*) FROM entries GROUP BY kind")
+        )
+        counts["files"] = self.conn.execute("SELECT COUNT(*) FROM files").fetchone()[0]
+        counts["lines"] = self.conn.execute("SELECT COUNT(*) FROM lines").fetchone()[0]
+        return counts
+
+
+def describe(entry: Entry) -> str:
+    location = f"{entry.path}:{entry.line}"
+    if entry.address is not None:
+        location += f" (0x{entry.address:x}"
+        if entry.end_address is not None:
+            location += f"-0x{entry.end_address:x}"
+        location += ")"
+    return f"{entry.kind} {entry.name} in {location}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Query an index of the DWARF dumps"""
+    )
+    parser.add_argument(
+        "--root",
+        default=DEFAULT_ROOT,
+        help=f"""dump directory (default: {DEFAULT_ROOT})""",
+    )
+    parser.add_argument(
+        "--db", help="""index database (default: build/dwarf/<root name>.sqlite)"""
+    )
+    parser.add_argument(
+        "--no-update", action="store_true", help="""don't update the index first"""
+    )
+    subparsers = parser.add_subparsers(dest="command", required=True)
+    subparsers.add_parser("update", help="update the index and print totals")
+    function_parser = subparsers.add_parser("function", help="show a function")
+    function_parser.add_argument("name", help="qualified, plain or mangled name")
+    type_parser = subparsers.add_parser("type", help="show a type definition")
+    type_parser.add_argument("name", help="type name")
+    type_parser.add_argument(
+        "--all", action="store_true", help="show every distinct definition"
+    )
+    lines_parser = subparsers.add_parser("lines", help="show a function's line table")
+    lines_parser.add_argument("name", help="qualified, plain or mangled name")
+    address_parser = subparsers.add_parser(
+        "address", help="find the function and line at an address"
+    )
+    address_parser.add_argument("address", help="address (hex)")
+    search_parser = subparsers.add_parser(
+        "search", help="search names and declarations (terms with AND, OR, NOT)"
+    )
+    search_parser.add_argument("text", help="search query")
+    search_parser.add_argument(
+        "--limit", type=int, default=50, help="maximum results (default: 50)"
+    )
+    args = parser.parse_args()
+
+    if not os.path.isdir(args.root):
+        sys.exit(f"{args.root} not found")
+    with DwarfIndex(args.root, args.db) as index:
+        start = time.perf_counter()
+        parsed, removed = (0, 0) if args.no_update else index.update()
+        if args.command == "update":
+            elapsed = time.perf_counter() - start
+            print(f"Parsed {parsed} dump(s), removed {removed} in {elapsed:.2f} s")
+            for key, count in sorted(index.stats().items()):
+                print(f"  {key:<10} {count:>7}")
+            return
+
+        found: List[Entry] = []
+        if args.command == "function":
+            found = index.functions(args.name)
+            for entry in found:
+                print(f"// {entry.path}")
+                print(index.text(entry))
+        elif args.command == "type":
+            found = index.types(args.name)
+            definitions: Dict[str, List[Entry]] = {}
+            for entry in found:
+                definitions.setdefault(entry.hash, []).append(entry)
+            for idx, entries in enumerate(definitions.values()):
+                if idx > 0 and not args.all:
+                    break
+                print(f"// Defined in {len(entries)} dump(s):")
+                for entry in entries:
+                    print(f"//   {entry.path}:{entry.line}")
+                print(index.text(entries[0]))
+            if len(definitions) > 1 and not args.all:
+                print(f"// {len(definitions)} distinct definitions, use --all")
+        elif args.command == "lines":
+            found = index.functions(args.name)
+            for entry in found:
+                print(describe(entry))
+                for line, address, offset in index.line_table(entry):
+                    print(f"  line {line:>5}  0x{address:x}  +0x{offset:x}")
+        elif args.command == "address":
+            address = int(args.address, 16)
+            found = index.at_address(address)
+            for entry in found:
+                lines = [row for row in index.line_table(entry) if row[1] <= address]
+                line = max(lines, key=lambda row: row[1])[0] if lines else None
+                print(f"{describe(entry)}, line {line}")
+        elif args.command == "search":
+            try:
+                found = index.search(args.text, args.limit)
+            except sqlite3.OperationalError as e:
+                sys.exit(f"Invalid search {args.text!r}: {e}")
+            for entry in found:
+                print(describe(entry))
+        if not found:
+            sys.exit(f"Nothing found in {args.root}")
+
+
+if __name__ == "__main__":
+    main()
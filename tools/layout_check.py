@@ -0,0 +1,715 @@
+#!/usr/bin/env python3
+
+###
+# Compares struct, class and union layouts in our headers against the
+# layouts in the DWARF dumps, to find wrong member offsets.
+#
+# Header layouts come from clang's record layout dump, run on every unit in
+# compile_commands.json with its flags (--target=powerpc-eabi). DWARF dumps
+# don't include offsets, so DWARF layouts are computed from the member types
+# under the PowerPC EABI rules, as MWCC lays out plain structs. Classes with
+# a vtable pointer are skipped, because clang places it as the Itanium ABI
+# does rather than as MWCC does. Members after an anonymous union can't be
+# placed from the dumps, so only the members before it are compared.
+#
+# Units and dumps are processed in parallel. Results are cached in
+# build/<version>/layouts.json, keyed on the clang arguments and the hashes
+# of every header a unit includes, so reruns only recompile what changed.
+#
+# Usage:
+#   python3 tools/layout_check.py
+#   python3 tools/layout_check.py --type xEnt --verbose
+#   python3 tools/layout_check.py -j 8 --filter src/SB/Game --json report.json
+###
+
+import argparse
+import hashlib
+import json
+import os
+import re
+import shutil
+import subprocess
+import sys
+import tempfile
+from multiprocessing import Pool
+from typing import Any, Dict, List, Optional, Set, Tuple
+
+try:
+    from .dwarf_index import DEFAULT_ROOT, DwarfIndex
+except ImportError:
+    from dwarf_index import DEFAULT_ROOT, DwarfIndex  # type: ignore
+
+# Bump when layouts are computed or parsed differently, to drop cached results
+CACHE_VERSION = 1
+
+# Layouts are dictionaries, so they can be cached as JSON:
+#   size:        size in bytes
+#   align:       alignment in bytes
+#   members:     [name, offset in bits] of each member, with the members of
+#                anonymous structs and unions flattened, and bases as "(base N)"
+#   polymorphic: whether the record has a vtable pointer
+Layout = Dict[str, Any]
+
+# Size and alignment of the base types in the dumps
+PRIMITIVES: Dict[str, Tuple[int, int]] = {
+    "void": (0, 1),
+    "bool": (1, 1),
+    "char": (1, 1),
+    "int8": (1, 1),
+    "uint8": (1, 1),
+    "int16": (2, 2),
+    "uint16": (2, 2),
+    "wchar_t": (2, 2),
+    "int32": (4, 4),
+    "uint32": (4, 4),
+    "long32": (4, 4),
+    "ulong32": (4, 4),
+    "int": (4, 4),
+    "long": (4, 4),
+    "float32": (4, 4),
+    "float": (4, 4),
+    "int64": (8, 8),
+    "uint64": (8, 8),
+    "float64": (8, 8),
+    "double": (8, 8),
+}
+POINTER = (4, 4)
+TAG_KEYWORDS = ("struct", "union", "enum", "class")
+
+record_line_pattern = re.compile(r"^(struct|union|class)\s+(\w+)\s*(?::\s*(.*))?$")
+member_pattern = re.compile(
+    r"^(?P<type>.+?)\s*(?:\(\s*\*\s*(?P<fptr>\w+)(?P<fdims>(?:\[\d+\])*)\s*\)\s*\(.*\)"
+    r"|(?P<name>\w+)(?P<dims>(?:\s*\[\d+\])*)(?:\s*:\s*(?P<bits>\d+))?)$"
+)
+vtable_pattern = re.compile(r"\b__vt__(\d+)(\w+)")
+typedef_pattern = re.compile(r"^typedef\s+(.*);$")
+dims_pattern = re.compile(r"\[(\d+)\]")
+qualifier_pattern = re.compile(r"\b(?:const|volatile|struct|union|enum|class)\s+")
+
+# clang -fdump-record-layouts output
+layout_line_pattern = re.compile(r"^\s*(\d+)(?::(\d+)-\d+|:-)? \| (\s*)(.*)$")
+sizeof_pattern = re.compile(r"\[sizeof=(\d+)(?:, dsize=\d+)?, align=(\d+)")
+
+
+def align_up(value: int, align: int) -> int:
+    return (value + align - 1) // align * align
+
+
+def array_count(dims: str) -> int:
+    count = 1
+    for dim in dims_pattern.findall(dims):
+        count *= int(dim)
+    return count
+
+
+# Lays out the records of a DWARF dump. Anonymous structs are flattened, but
+# the dumps lose the nesting inside anonymous unions, so members after one
+# can't be placed: records with anonymous unions are partial, with only the
+# members before the first union, and their sizes are taken from the headers
+# when they're used as members.
+class DwarfLayouts:
+    def __init__(
+        self, text: str, cplusplus: bool, sizes: Dict[str, Tuple[int, int]]
+    ) -> None:
+        self.cplusplus = cplusplus
+        self.sizes = sizes
+        self.records: Dict[str, Tuple[str, List[str], List[str]]] = {}
+        self.enums: Set[str] = set()
+        self.typedefs: Dict[str, Tuple[str, str, bool]] = {}
+        # Classes with a vtable, which only appears as a global variable
+        self.vtables: Set[str] = set()
+        self.layouts: Dict[str, Optional[Layout]] = {}
+        self.parse(text.splitlines())
+
+    def parse(self, lines: List[str]) -> None:
+        idx = 0
+        while idx < len(lines):
+            line = lines[idx].strip()
+            idx += 1
+            if line.startswith("enum ") and not line.endswith(";"):
+                self.enums.add(line.split()[1])
+                continue
+            match = record_line_pattern.match(line)
+            if match is not None:
+                body, idx = self.read_block(lines, idx)
+                bases = [base.strip() for base in (match.group(3) or "").split(",")]
+                self.records[match.group(2)] = (
+                    match.group(1),
+                    [base for base in bases if base],
+                    body,
+                )
+                continue
+            match = vtable_pattern.search(line)
+            if match is not None:
+                self.vtables.add(match.group(2)[: int(match.group(1))])
+                continue
+            match = typedef_pattern.match(line)
+            if match is not None:
+                member = member_pattern.match(match.group(1))
+                # Skip forward declarations, such as "typedef struct xEnt;"
+                if member is None or member.group("type") in TAG_KEYWORDS:
+                    continue
+                if member.group("fptr"):
+                    name, dims = member.group("fptr"), member.group("fdims")
+                    self.typedefs[name] = ("", dims, True)
+                elif member.group("name"):
+                    name, dims = member.group("name"), member.group("dims")
+                    self.typedefs[name] = (member.group("type"), dims, False)
+
+    # Lines of the block starting at idx (which must be "{"), without braces
+    @staticmethod
+    def read_block(lines: List[str], idx: int) -> Tuple[List[str], int]:
+        body: List[str] = []
+        depth = 0
+        while idx < len(lines):
+            line = lines[idx].strip()
+            idx += 1
+            depth += line.count("{") - line.count("}")
+            if depth <= 0 and "}" in line:
+                break
+            if depth == 1 and line == "{":
+                continue
+            body.append(line)
+        return body, idx
+
+    # Size and alignment of a type, or None if it can't be computed
+    def type_info(
+        self, type_name: str, seen: Tuple[str, ...] = ()
+    ) -> Optional[Tuple[int, int]]:
+        type_name = qualifier_pattern.sub("", type_name).strip()
+        if type_name.endswith("*") or type_name.endswith("&"):
+            return POINTER
+        if type_name in PRIMITIVES:
+            return PRIMITIVES[type_name]
+        if type_name in self.enums:
+            return (4, 4)
+        if type_name in self.typedefs and type_name not in seen:
+            target, dims, is_pointer = self.typedefs[type_name]
+            if is_pointer:
+                info: Optional[Tuple[int, int]] = POINTER
+            else:
+                info = self.type_info(target, seen + (type_name,))
+            if info is None:
+                return None
+            return info[0] * array_count(dims), info[1]
+        layout = self.layout(type_name)
+        if layout is None:
+            return None
+        if layout["partial"]:
+            return self.sizes.get(type_name)
+        return layout["size"], layout["align"]
+
+    def layout(self, name: str) -> Optional[Layout]:
+        if name in self.layouts:
+            return self.layouts[name]
+        record = self.records.get(name)
+        if record is None:
+            return None
+        # Guard against recursive definitions
+        self.layouts[name] = None
+        kind, bases, body = record
+        layout = self.layout_body(kind, bases, body)
+        if layout is not None and name in self.vtables:
+            layout["polymorphic"] = True
+        self.layouts[name] = layout
+        return layout
+
+    def layout_body(
+        self, kind: str, bases: List[str], body: List[str]
+    ) -> Optional[Layout]:
+        is_union = kind == "union"
+        members: List[List[Any]] = []
+        bit_offset = 0
+        size = 0
+        align = 1
+        polymorphic = False
+        partial = False
+
+        def place(name: str, info: Tuple[int, int]) -> None:
+            nonlocal bit_offset, size, align
+            member_size, member_align = info
+            align = max(align, member_align)
+            offset = 0 if is_union else align_up(bit_offset, member_align * 8)
+            members.append([name, offset])
+            bit_offset = offset + member_size * 8
+            size = max(size, bit_offset)
+
+        for idx, base in enumerate(bases):
+            base_layout = self.layout(base)
+            base_info = self.type_info(base)
+            if base_layout is None or base_info is None:
+                return None
+            place(f"(base {idx})", base_info)
+            polymorphic = polymorphic or base_layout["polymorphic"]
+
+        idx = 0
+        while idx < len(body):
+            line = body[idx]
+            idx += 1
+            if line == "union":
+                partial = True
+                break
+            if line == "struct":
+                nested_body, idx = self.read_block(body, idx)
+                nested = self.layout_body(line, [], nested_body)
+                if nested is None:
+                    return None
+                if nested["partial"]:
+                    partial = True
+                    break
+                place("", (nested["size"], nested["align"]))
+                offset = members.pop()[1]
+                for name, member_offset in nested["members"]:
+                    members.append([name, offset + member_offset])
+                continue
+            if not line.endswith(";") or line.startswith("static "):
+                continue
+            match = member_pattern.match(line[:-1].strip())
+            if match is None:
+                continue
+            if match.group("fptr"):
+                place(match.group("fptr"), (4 * array_count(match.group("fdims")), 4))
+                continue
+            if "(" in line:
+                # Member function
+                continue
+            name = match.group("name")
+            info = self.type_info(match.group("type"))
+            if info is None:
+                return None
+            bits = match.group("bits")
+            if bits is None:
+                place(name, (info[0] * array_count(match.group("dims")), info[1]))
+                continue
+            # Bit fields are allocated in units of their type, without crossing
+            # a unit boundary
+            width = int(bits)
+            unit = info[0] * 8
+            align = max(align, info[1])
+            offset = 0 if is_union else bit_offset
+            if width == 0 or offset % unit + width > unit:
+                offset = align_up(offset, unit)
+            members.append([name, offset])
+            bit_offset = offset + width
+            size = max(size, bit_offset)
+
+        byte_size = align_up(size, 8) // 8
+        if byte_size == 0 and self.cplusplus:
+            byte_size = 1
+        return {
+            "size": None if partial else align_up(byte_size, align),
+            "align": align,
+            "members": members,
+            "polymorphic": polymorphic,
+            "partial": partial,
+        }
+
+    def all_layouts(self) -> Dict[str, Layout]:
+        layouts: Dict[str, Layout] = {}
+        for name in self.records:
+            layout = self.layout(name)
+            if layout is not None:
+                layouts[name] = layout
+        return layouts
+
+
+def dwarf_dump_layouts(
+    args: Tuple[str, str, Dict[str, Tuple[int, int]]],
+) -> Dict[str, Layout]:
+    root, path, sizes = args
+    with open(os.path.join(root, path), encoding="utf-8", errors="replace") as f:
+        text = f.read()
+    return DwarfLayouts(text, not path.endswith(".c"), sizes).all_layouts()
+
+
+# Parses the output of clang -fdump-record-layouts into layouts by name
+def parse_clang_layouts(output: str) -> Dict[str, Layout]:
+    layouts: Dict[str, Layout] = {}
+    for block in output.split("*** Dumping AST Record Layout")[1:]:
+        name: Optional[str] = None
+        layout: Layout = {
+            "size": 0,
+            "align": 1,
+            "members": [],
+            "polymorphic": False,
+            "partial": False,
+        }
+        # Whether each nesting level is an anonymous record being flattened
+        flatten: List[bool] = []
+        bases = 0
+        for line in block.splitlines():
+            match = sizeof_pattern.search(line)
+            if match is not None:
+                layout["size"] = int(match.group(1))
+                layout["align"] = int(match.group(2))
+                continue
+            match = layout_line_pattern.match(line)
+            if match is None:
+                continue
+            offset = int(match.group(1)) * 8 + int(match.group(2) or 0)
+            level = len(match.group(3)) // 2
+            text = match.group(4).strip()
+            if level == 0:
+                name = re.sub(r"^(?:struct|class|union)\s+", "", text)
+                name = name.replace(" (empty)", "")
+                continue
+            del flatten[level - 1 :]
+            if level > 1 and not all(flatten):
+                flatten.append(False)
+                continue
+            if text.endswith("vtable pointer)"):
+                layout["polymorphic"] = True
+                layout["members"].append(["(vtable)", offset])
+                flatten.append(False)
+                continue
+            if text.endswith("(base)") or text.endswith("(primary base)"):
+                layout["members"].append([f"(base {bases})", offset])
+                bases += 1
+                flatten.append(False)
+                continue
+            anonymous = "(anonymous" in text or "(unnamed" in text
+            if anonymous and text.endswith(")"):
+                flatten.append(True)
+                continue
+            layout["members"].append([text.split()[-1], offset])
+            flatten.append(False)
+        if name is not None and "(anonymous" not in name and "(unnamed" not in name:
+            layouts[name] = layout
+    return layouts
+
+
+def hash_file(path: str) -> Optional[str]:
+    try:
+        with open(path, "rb") as f:
+            return hashlib.sha1(f.read()).hexdigest()
+    except OSError:
+        return None
+
+
+def read_depfile(path: str) -> List[str]:
+    with open(path, encoding="utf-8") as f:
+        text = f.read().replace("\\\n", " ")
+    deps = text.split(":", 1)[1].split() if ":" in text else []
+    return [os.path.normpath(dep) for dep in deps]
+
+
+# Arguments for dumping the record layouts of a compile_commands.json entry
+def clang_args(clang: str, entry: Dict[str, Any]) -> List[str]:
+    args = [clang]
+    skip = False
+    for arg in entry["arguments"][1:]:
+        if skip:
+            skip = False
+        elif arg == "-o":
+            skip = True
+        elif arg != "-c":
+            args.append(arg)
+    args.extend(
+        [
+            "-fsyntax-only",
+            "-w",
+            "-ferror-limit=0",
+            "-Xclang",
+            "-fdump-record-layouts-complete",
+        ]
+    )
+    return args
+
+
+# Runs clang on a unit, returning its header hashes, layouts and any error
+def header_layouts(
+    args: Tuple[List[str], str],
+) -> Tuple[Dict[str, Optional[str]], Dict[str, Layout], Optional[str]]:
+    command, directory = args
+    with tempfile.TemporaryDirectory() as tmp_dir:
+        depfile = os.path.join(tmp_dir, "unit.d")
+        try:
+            result = subprocess.run(
+                [*command, "-MD", "-MF", depfile],
+                cwd=directory,
+                capture_output=True,
+                text=True,
+                errors="replace",
+            )
+        except OSError as e:
+            return {}, {}, str(e)
+        deps = read_depfile(depfile) if os.path.isfile(depfile) else []
+    paths = [os.path.normpath(os.path.join(directory, dep)) for dep in deps]
+    hashes = {path: hash_file(path) for path in paths}
+    layouts = parse_clang_layouts(result.stdout)
+    error = None
+    if not layouts and result.returncode != 0:
+        error = result.stderr.strip().splitlines()[-1] if result.stderr else "failed"
+    return hashes, layouts, error
+
+
+class LayoutCache:
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.data: Dict[str, Any] = {"version": CACHE_VERSION, "units": {}}
+        try:
+            with open(path, encoding="utf-8") as f:
+                data = json.load(f)
+            if data.get("version") == CACHE_VERSION:
+                self.data = data
+        except (OSError, ValueError):
+            pass
+        self.hashes: Dict[str, Optional[str]] = {}
+
+    def file_hash(self, path: str) -> Optional[str]:
+        if path not in self.hashes:
+            self.hashes[path] = hash_file(path)
+        return self.hashes[path]
+
+    @staticmethod
+    def unit_key(command: List[str]) -> str:
+        return hashlib.sha1(json.dumps(command).encode("utf-8")).hexdigest()
+
+    # Cached layouts of a unit, if its arguments and headers are unchanged
+    def unit(self, source: str, command: List[str]) -> Optional[Dict[str, Any]]:
+        cached = self.data["units"].get(source)
+        if cached is None or cached["key"] != self.unit_key(command):
+            return None
+        # Retry units that failed, as the failure may not be in a header
+        if cached["error"]:
+            return None
+        for dep, dep_hash in cached["deps"].items():
+            if dep_hash is None or self.file_hash(dep) != dep_hash:
+                return None
+        return cached
+
+    def save(self) -> None:
+        os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+        tmp_path = f"{self.path}.{os.getpid()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(self.data, f)
+        os.replace(tmp_path, self.path)
+
+
+# Header layouts of all units by type name, and the types whose layouts
+# differ between units
+def collect_header_layouts(
+    entries: List[Dict[str, Any]], clang: str, cache: LayoutCache, jobs: int
+) -> Tuple[Dict[str, Tuple[str, Layout]], Dict[str, Set[str]], List[str]]:
+    commands = [
+        (entry["file"], clang_args(clang, entry), entry["directory"])
+        for entry in entries
+    ]
+    stale = [
+        (source, command, directory)
+        for source, command, directory in commands
+        if cache.unit(source, command) is None
+    ]
+    if stale:
+        print(f"Dumping record layouts of {len(stale)} unit(s)", file=sys.stderr)
+        with Pool(jobs) as pool:
+            tasks = [(command, directory) for _, command, directory in stale]
+            results = pool.map(header_layouts, tasks)
+        for (source, command, _), (hashes, layouts, error) in zip(stale, results):
+            cache.data["units"][source] = {
+                "key": cache.unit_key(command),
+                "deps": hashes,
+                "layouts": layouts,
+                "error": error,
+            }
+        cache.save()
+
+    layouts: Dict[str, Tuple[str, Layout]] = {}
+    conflicts: Dict[str, Set[str]] = {}
+    errors: List[str] = []
+    for source, _, _ in commands:
+        unit = cache.data["units"][source]
+        if unit.get("error"):
+            errors.append(f"{source}: {unit['error']}")
+        for name, layout in unit["layouts"].items():
+            if name not in layouts:
+                layouts[name] = (source, layout)
+            elif layouts[name][1] != layout:
+                conflicts.setdefault(name, {layouts[name][0]}).add(source)
+    return layouts, conflicts, errors
+
+
+# DWARF layouts by type name, with the dump of the most common layout. sizes
+# are the header sizes of types, used for partial DWARF layouts.
+def collect_dwarf_layouts(
+    index: DwarfIndex,
+    sizes: Dict[str, Tuple[int, int]],
+    cache: LayoutCache,
+    jobs: int,
+) -> Dict[str, Tuple[str, Layout]]:
+    sizes_json = json.dumps(sorted(sizes.items())).encode("utf-8")
+    key = f"{index.digest()}:{hashlib.sha1(sizes_json).hexdigest()}"
+    cached = cache.data.get("dwarf")
+    if cached is None or cached["key"] != key:
+        paths = [
+            row[0]
+            for row in index.conn.execute(
+                "SELECT path FROM files WHERE id IN"
+                " (SELECT file_id FROM entries"
+                " WHERE kind IN ('struct', 'union', 'class'))"
+                " ORDER BY path"
+            )
+        ]
+        with Pool(jobs) as pool:
+            results = pool.map(
+                dwarf_dump_layouts, [(index.root, path, sizes) for path in paths]
+            )
+        votes: Dict[str, Dict[str, Tuple[int, str, Layout]]] = {}
+        for path, dump_layouts in zip(paths, results):
+            for name, layout in dump_layouts.items():
+                variants = votes.setdefault(name, {})
+                variant = json.dumps(layout, sort_keys=True)
+                count, first_path, _ = variants.get(variant, (0, path, layout))
+                variants[variant] = (count + 1, first_path, layout)
+        layouts = {}
+        for name, variants in votes.items():
+            _, path, layout = max(variants.values(), key=lambda v: v[0])
+            layouts[name] = [path, layout]
+        cached = cache.data["dwarf"] = {"key": key, "layouts": layouts}
+        cache.save()
+    return {name: (path, layout) for name, (path, layout) in cached["layouts"].items()}
+
+
+def compare(dwarf: Layout, header: Layout) -> List[str]:
+    problems: List[str] = []
+    if not dwarf["partial"] and dwarf["size"] != header["size"]:
+        problems.append(f"size: DWARF {dwarf['size']:#x}, header {header['size']:#x}")
+    header_members = {name: offset for name, offset in header["members"]}
+    dwarf_names = set()
+    for name, offset in dwarf["members"]:
+        dwarf_names.add(name)
+        if name not in header_members:
+            problems.append(f"{name}: at {format_offset(offset)}, missing in header")
+        elif header_members[name] != offset:
+            problems.append(
+                f"{name}: DWARF {format_offset(offset)},"
+                f" header {format_offset(header_members[name])}"
+            )
+    for name, offset in header["members"]:
+        if name not in dwarf_names and not dwarf["partial"]:
+            problems.append(f"{name}: at {format_offset(offset)}, not in DWARF")
+    return problems
+
+
+def format_offset(bits: int) -> str:
+    if bits % 8:
+        return f"{bits // 8:#x}:{bits % 8}"
+    return f"{bits // 8:#x}"
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Compare header struct layouts against the DWARF dumps"""
+    )
+    parser.add_argument(
+        "--compile-commands",
+        default="compile_commands.json",
+        help="""compile_commands.json written by configure.py""",
+    )
+    parser.add_argument(
+        "--filter",
+        default="src/SB/",
+        help="""only dump units whose path contains this (default: src/SB/)""",
+    )
+    parser.add_argument(
+        "--root",
+        default=DEFAULT_ROOT,
+        help=f"""dump directory (default: {DEFAULT_ROOT})""",
+    )
+    parser.add_argument(
+        "--db", help="""DWARF index database (default: build/dwarf/<root>.sqlite)"""
+    )
+    parser.add_argument("--clang", default="clang", help="""clang binary""")
+    parser.add_argument(
+        "--cache",
+        default=os.path.join("build", "GGVE78", "layouts.json"),
+        help="""cache file (default: build/GGVE78/layouts.json)""",
+    )
+    parser.add_argument(
+        "-j",
+        "--jobs",
+        type=int,
+        default=os.cpu_count() or 1,
+        help="""worker processes (default: CPU count)""",
+    )
+    parser.add_argument("--type", action="append", help="""only check these types""")
+    parser.add_argument(
+        "-v", "--verbose", action="store_true", help="""print both layouts"""
+    )
+    parser.add_argument("--json", metavar="FILE", help="""write the report as JSON""")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.compile_commands):
+        sys.exit(f"{args.compile_commands} not found, run configure.py first")
+    if shutil.which(args.clang) is None:
+        sys.exit(f"{args.clang} not found, use --clang")
+    with open(args.compile_commands, encoding="utf-8") as f:
+        entries = [
+            entry
+            for entry in json.load(f)
+            if args.filter in os.path.relpath(entry["file"]).replace(os.sep, "/")
+        ]
+
+    cache = LayoutCache(args.cache)
+    headers, conflicts, errors = collect_header_layouts(
+        entries, args.clang, cache, args.jobs
+    )
+    sizes = {
+        name: (layout["size"], layout["align"]) for name, (_, layout) in headers.items()
+    }
+    with DwarfIndex(args.root, args.db) as index:
+        index.update()
+        dwarf = collect_dwarf_layouts(index, sizes, cache, args.jobs)
+
+    names = sorted(set(dwarf) & set(headers))
+    if args.type:
+        names = [name for name in names if name in args.type]
+    report: Dict[str, Any] = {}
+    skipped = 0
+    partial = 0
+    for name in names:
+        dwarf_path, dwarf_layout = dwarf[name]
+        header_source, header_layout = headers[name]
+        header_unit = os.path.relpath(header_source)
+        if dwarf_layout["polymorphic"] or header_layout["polymorphic"]:
+            skipped += 1
+            continue
+        partial += dwarf_layout["partial"]
+        problems = compare(dwarf_layout, header_layout)
+        if not problems and not args.verbose:
+            continue
+        report[name] = {
+            "dwarf": dwarf_path,
+            "header_unit": header_unit,
+            "problems": problems,
+            "conflicting_units": sorted(conflicts.get(name, ())),
+        }
+        print(f"{name} (DWARF {dwarf_path}, header via {header_unit})")
+        for problem in problems:
+            print(f"  {problem}")
+        if args.verbose:
+            for label, layout in (("DWARF", dwarf_layout), ("header", header_layout)):
+                size = "partial" if layout["partial"] else f"size {layout['size']:#x}"
+                members = ", ".join(
+                    f"{member}@{format_offset(offset)}"
+                    for member, offset in layout["members"]
+                )
+                print(f"  {label}: {size}: {members}")
+
+    for error in errors:
+        print(f"warning: {error}", file=sys.stderr)
+    mismatched = sum(1 for entry in report.values() if entry["problems"])
+    print(
+        f"{len(names)} types compared: {len(names) - skipped - mismatched} match"
+        f" ({partial} partially), {mismatched} mismatch,"
+        f" {skipped} skipped (vtable pointer); {len(conflicts)} differ between units"
+    )
+    if args.json:
+        with open(args.json, "w", encoding="utf-8") as f:
+            json.dump(report, f, indent=2)
+    if mismatched:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,728 @@
+#!/usr/bin/env python3
+
+###
+# Reduces a context file (as generated by decompctx.py) to what a function
+# needs, for smaller scratches on https://decomp.me that compile faster.
+#
+# The context is split into top-level declarations (typedefs, structs, enums,
+# prototypes, variables, function definitions and macros), each with the
+# names it declares and the identifiers it uses. Starting from the body of the
+# target function, only the declarations it transitively needs are kept, in
+# their original order. Other functions are reduced to prototypes, unless
+# they're inline or templates. Pragmas and linkage blocks are always kept,
+# conditionals only around a declaration that is kept.
+#
+# Usage:
+#   python3 tools/minimal_ctx.py build/GGVE78/src/SB/Game/zWadNME.ctx \
+#     -f zNMEDennis::RenderHud -o ctx.c
+#
+# Bulk mode reduces the context of every unit in objdiff.json to what the
+# unit's own functions need, writing <unit>.min.ctx next to each context:
+#   python3 tools/minimal_ctx.py --objdiff objdiff.json -j 8
+###
+
+import argparse
+import bisect
+import json
+import os
+import re
+import sys
+import time
+from typing import Any, Dict, FrozenSet, Iterable, List, Optional, Set, Tuple
+
+# Comments, and the include markers written by decompctx.py, which are
+# replaced by \x01 (start of a header) and \x02 (end of a header), or \x03
+# and \x04 for included source files
+comment_pattern = re.compile(
+    r'(?P<begin>/\* "[^"\n]*" line \d+ "([^"\n]*)" \*/)'
+    r'|(?P<end>/\* end "([^"\n]*)" \*/)'
+    r"|(?P<comment>//[^\n]*|/\*.*?\*/)"
+    r'|"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\'',
+    re.S,
+)
+token_pattern = re.compile(
+    r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+    r"|^[ \t]*#(?:\\\n|[^\n\x01-\x04])*"
+    r"|[{}();\x01-\x04]",
+    re.M,
+)
+# Within braces, only nested braces (and markers) matter
+body_pattern = re.compile(
+    r'"(?:\\.|[^"\\\n])*"|\'(?:\\.|[^\'\\\n])*\''
+    r"|^[ \t]*#(?:\\\n|[^\n\x01-\x04])*"
+    r"|[{}\x01-\x04]",
+    re.M,
+)
+identifier_pattern = re.compile(r"[A-Za-z_]\w*")
+qualified_pattern = re.compile(r"(?:[A-Za-z_]\w*\s*::\s*)*~?[A-Za-z_]\w*")
+directive_pattern = re.compile(r"\s*#\s*(\w*)\s*([A-Za-z_]\w*)?(\()?")
+conditional_pattern = re.compile(
+    r"^[ \t]*#[ \t]*(if|ifdef|ifndef|elif|else|endif)\b(?:\\\n|[^\n])*", re.M
+)
+scope_pattern = re.compile(
+    r'[\s\x01-\x04]*(?:extern\s*"C(?:\+\+)?"|namespace(?:\s+\w+)?)\s*$'
+)
+class_pattern = re.compile(r"\b(?:struct|class|union|enum)\b(?:\s+([A-Za-z_]\w*))?")
+template_pattern = re.compile(r"\s*template\s*<")
+inline_pattern = re.compile(r"\b(?:inline|__inline|__inline__)\b")
+linkage_pattern = re.compile(r'\bextern\s*"C(?:\+\+)?"')
+# Type keywords, which a declaration is never named
+keywords = frozenset(
+    "auto bool char class const double enum extern float int long register short"
+    " signed static struct typedef union unsigned void volatile".split()
+)
+markers = str.maketrans("", "", "\x01\x02\x03\x04")
+source_extensions = (".c", ".cc", ".cp", ".cpp", ".cxx", ".inc")
+
+
+class Item:
+    def __init__(self, text: str, origin: int) -> None:
+        self.text = text
+        # Header nesting level the item ended in, 0 for the unit's own source
+        # (including the source files it includes)
+        self.origin = origin
+        self.structural = False  # Always kept
+        self.names: List[str] = []
+        self.uses: FrozenSet[str] = frozenset()
+        # Function definitions: the qualified name, and the prototype (and the
+        # identifiers it uses) written when only a declaration is needed
+        self.function: Optional[str] = None
+        self.keep_body = False
+        self.prototype: Optional[str] = None
+        self.prototype_uses: FrozenSet[str] = frozenset()
+
+
+# Replaces comments, keeping string literals and turning include markers
+# into single characters
+def strip_comments(text: str) -> str:
+    def replace(match: "re.Match[str]") -> str:
+        if match["begin"]:
+            return "\x03" if match[2].lower().endswith(source_extensions) else "\x01"
+        if match["end"]:
+            return "\x04" if match[4].lower().endswith(source_extensions) else "\x02"
+        if match["comment"]:
+            return " "
+        return match[0]
+
+    return comment_pattern.sub(replace, text)
+
+
+# Removes the contents of balanced groups (such as parentheses or template
+# arguments) that don't contain other kinds of groups
+def flatten(text: str, group: str) -> str:
+    while True:
+        flat = re.sub(group, "", text)
+        if flat == text:
+            return flat
+        text = flat
+
+
+def remove_braces(text: str) -> str:
+    return flatten(text, r"\{[^{}]*\}")
+
+
+def remove_templates(text: str) -> str:
+    return flatten(text, r"<[^<>(){};]*>")
+
+
+# Splits text at commas outside of any parentheses, brackets or braces
+def split_top(text: str) -> List[str]:
+    parts: List[str] = []
+    depth = 0
+    start = 0
+    for match in re.finditer(r"[(\[{]|[)\]}]|,", text):
+        c = match[0]
+        if c in "([{":
+            depth += 1
+        elif c in ")]}":
+            depth -= 1
+        elif depth == 0:
+            parts.append(text[start : match.start()])
+            start = match.end()
+    parts.append(text[start:])
+    return parts
+
+
+# Position of the first opening parenthesis, and its matching one
+def first_group(text: str) -> Optional[Tuple[int, int]]:
+    start = text.find("(")
+    if start < 0:
+        return None
+    depth = 0
+    for idx in range(start, len(text)):
+        if text[idx] == "(":
+            depth += 1
+        elif text[idx] == ")":
+            depth -= 1
+            if depth == 0:
+                return start, idx
+    return start, len(text)
+
+
+# Whether every conditional in the code starts and ends within it
+def balanced(code: str) -> bool:
+    if "#" not in code:
+        return True
+    depth = 0
+    for match in conditional_pattern.finditer(code):
+        if match[1].startswith("if"):
+            depth += 1
+        elif depth == 0:
+            return False
+        elif match[1] == "endif":
+            depth -= 1
+    return depth == 0
+
+
+# Code with only the first branch of each conditional, which is the one the
+# context is split by
+def first_branch(code: str) -> str:
+    if "#" not in code:
+        return code
+    parts: List[str] = []
+    # For each open conditional, whether its current branch is left out
+    skipped: List[bool] = []
+    pos = 0
+    for match in conditional_pattern.finditer(code):
+        if not any(skipped):
+            parts.append(code[pos : match.start()])
+        pos = match.end()
+        if match[1].startswith("if"):
+            skipped.append(False)
+        elif match[1] == "endif":
+            if skipped:
+                skipped.pop()
+        elif skipped:
+            skipped[-1] = True
+    if not any(skipped):
+        parts.append(code[pos:])
+    return " ".join(part.strip() for part in parts if part.strip())
+
+
+def unmark(text: str) -> str:
+    return text.translate(markers)
+
+
+def identifiers(code: str) -> FrozenSet[str]:
+    uses = _identifiers.get(code)
+    if uses is None:
+        uses = _identifiers[code] = frozenset(identifier_pattern.findall(code))
+    return uses
+
+
+_identifiers: Dict[str, FrozenSet[str]] = {}
+
+
+def normalize(name: str) -> str:
+    return re.sub(r"\s+", "", name)
+
+
+def last_name(text: str) -> Optional[str]:
+    names = qualified_pattern.findall(text)
+    return normalize(names[-1]) if names else None
+
+
+# Name of a function, given the text before its parameter list
+def function_name(head: str) -> Optional[str]:
+    head = remove_templates(head)
+    operator = re.search(r"((?:[A-Za-z_]\w*\s*::\s*)*operator)\b", head)
+    if operator:
+        return normalize(operator[1])
+    group = first_group(head)
+    if group is None:
+        return None
+    match = re.search(
+        r"((?:[A-Za-z_]\w*\s*::\s*)*~?[A-Za-z_]\w*)\s*$", head[: group[0]]
+    )
+    return normalize(match[1]) if match else None
+
+
+# Names declared by a declaration without its braced parts,
+# such as "typedef int a, *b;" or "void (*callback)(int);"
+def declarator_names(text: str) -> List[str]:
+    text = remove_templates(linkage_pattern.sub("", text))
+    using = re.match(r"\s*using\s+(?:namespace\b|([A-Za-z_]\w*)\s*=)?", text)
+    if using:
+        if using[1]:
+            return [using[1]]
+        return [] if "namespace" in using[0] else [n for n in [last_name(text)] if n]
+
+    names: List[str] = []
+    for part in split_top(text.rstrip().rstrip(";")):
+        part = re.sub(r"\[[^\]]*\]", "", part.split("=", 1)[0])
+        group = first_group(part)
+        if group is None:
+            name = last_name(part)
+        else:
+            inner = part[group[0] + 1 : group[1]]
+            if re.match(r"\s*(?:[A-Za-z_]\w*\s*::\s*)*[*&^]", inner):
+                # Pointer to function (or array) declarator
+                name = last_name(inner.split("(", 1)[0])
+            else:
+                name = function_name(part[: group[1] + 1])
+        if name is not None:
+            names.append(name)
+    return names
+
+
+# Names declared by a top-level declaration (None if it's to be kept in any
+# case), given the function-like macros it uses. Headers are shared between
+# units, so results are kept for reuse.
+def declared_names(code: str, macros: FrozenSet[str]) -> Optional[List[str]]:
+    key = (code, macros)
+    if key in _declared:
+        return _declared[key]
+    text = code
+    if macros:
+        text = re.sub(
+            r"\b([A-Za-z_]\w*)\s*\([^()]*\)",
+            lambda match: " " if match[1] in macros else match[0],
+            text,
+        )
+    text = re.sub(r"__declspec\s*\([^()]*\)", " ", text)
+    text = re.sub(r"__attribute__\s*\(\((?:[^()]|\([^()]*\))*\)\)", " ", text)
+    if template_pattern.match(text):
+        text = remove_templates(text)
+
+    names: Optional[List[str]] = []
+    brace = text.find("{")
+    head = text[:brace] if brace >= 0 else text
+    tag = class_pattern.search(head)
+    if brace >= 0 and tag is not None and "(" not in flatten(head, r"\([^()]*\)"):
+        if tag[1]:
+            names.append(tag[1])
+        if tag[0].startswith("enum"):
+            body = remove_braces(text[brace + 1 : text.rfind("}")])
+            for enumerator in split_top(body):
+                match = identifier_pattern.search(enumerator)
+                if match:
+                    names.append(match[0])
+        # Typedef names and variables after the braces. The tag (with any
+        # base classes) is left out, so that it isn't taken as one of them.
+        tail = head[: tag.start()] + remove_braces(text[brace:])
+        names.extend(declarator_names(tail))
+    elif re.match(r"\s*(?:struct|class|union|enum)\s+\w+\s*;", text):
+        # Forward declaration
+        names.append(tag[1] if tag is not None else text.split()[1])
+    elif re.match(r"\s*using\s+namespace\b", text):
+        names = None
+    else:
+        names = declarator_names(remove_braces(text))
+    if names is not None:
+        # As left by macros that expand to nothing, as in "double __fabs(double)"
+        names = [name for name in names if name not in keywords]
+    _declared[key] = names
+    return names
+
+
+_declared: Dict[Tuple[str, FrozenSet[str]], Optional[List[str]]] = {}
+
+
+# A function definition's prototype, or None if it can't be declared on its own
+def prototype(head: str, name: str) -> Optional[str]:
+    if "::" in name:
+        # Members are declared by their class
+        return None
+    head = re.sub(r"\basm\b", "", head).strip()
+    return head + ";"
+
+
+class Context:
+    def __init__(self, text: str) -> None:
+        self.items: List[Item] = []
+        self.function_macros: Set[str] = set()
+        # Declarations, analyzed once all function-like macros are known
+        self.declarations: List[Item] = []
+        self.split(strip_comments(text))
+        for item in self.declarations:
+            item.uses = identifiers(item.text)
+            macros = item.uses & self.function_macros
+            names = declared_names(first_branch(item.text), macros)
+            if names is None:
+                item.structural = True
+            else:
+                item.names.extend(names)
+        self.declarers: Dict[str, List[int]] = {}
+        for index, item in enumerate(self.items):
+            for name in item.names:
+                self.declarers.setdefault(name, []).append(index)
+
+    # Splits the context into top-level items
+    def split(self, text: str) -> None:
+        start = 0
+        depth = 0
+        parens = 0
+        body = -1
+        origin = 0
+        defines: List[str] = []
+        # Open conditionals: where each starts, the depth and parentheses there
+        # and at the end of its first branch, and the index of the item holding
+        # just its directive (-1 if none)
+        conds: List[List[Any]] = []
+
+        def add(end: int, kind: str = "") -> None:
+            nonlocal start, body, defines
+            code = unmark(text[start:end]).strip()
+            if code not in ("", ";"):
+                item = Item(code, origin)
+                if kind == "structural" or not balanced(code):
+                    # Kept whole, so that conditionals stay matched
+                    item.structural = True
+                    item.uses = identifiers(code)
+                elif kind == "function":
+                    head = first_branch(unmark(text[start:body]).strip())
+                    self.function_item(item, head)
+                else:
+                    self.declarations.append(item)
+                item.names.extend(defines)
+                self.items.append(item)
+            start = end
+            body = -1
+            defines = []
+
+        pos = 0
+        while True:
+            match = (body_pattern if depth else token_pattern).search(text, pos)
+            if match is None:
+                break
+            pos = match.end()
+            token = match[0]
+            c = token[0]
+            if c in "\"'":
+                continue
+            if c == "\x01":
+                origin += 1
+            elif c == "\x02":
+                origin -= 1
+            elif c in "\x03\x04":
+                continue
+            elif c == "(":
+                if depth == 0:
+                    parens += 1
+            elif c == ")":
+                if depth == 0 and parens > 0:
+                    parens -= 1
+            elif c == "{":
+                if depth == 0 and scope_pattern.match(text[start : match.start()]):
+                    # Linkage blocks and namespaces are kept around their contents
+                    add(match.end(), "structural")
+                    continue
+                if depth == 0:
+                    body = match.start()
+                depth += 1
+            elif c == "}":
+                if depth == 0:
+                    add(match.start())
+                    add(match.end(), "structural")
+                    continue
+                depth -= 1
+                if depth == 0 and not self.continues(unmark(text[start:body])):
+                    add(match.end(), "function")
+            elif c == ";":
+                # A declaration doesn't end within a conditional it started in
+                if depth > 0 or parens > 0:
+                    continue
+                if not conds or conds[-1][0] < start:
+                    add(match.end())
+            else:
+                directive = directive_pattern.match(token)
+                assert directive is not None
+                inside = depth > 0 or unmark(text[start : match.start()]).strip()
+                # Splitting follows the first branch of each conditional, and
+                # later branches are assumed to end at the same depth
+                cond = conds[-1] if conds else None
+                if directive[1] in ("if", "ifdef", "ifndef"):
+                    cond = [match.start(), depth, parens, None, -1]
+                    conds.append(cond)
+                elif directive[1] in ("elif", "else") and cond is not None:
+                    if cond[3] is None:
+                        cond[3] = (depth, parens)
+                    depth, parens = cond[1], cond[2]
+                elif directive[1] == "endif" and cond is not None:
+                    conds.pop()
+                    if cond[3] is not None:
+                        depth, parens = cond[3]
+                if inside:
+                    if (
+                        cond is not None
+                        and cond[0] < start
+                        and cond[4] == len(self.items) - 1
+                    ):
+                        # The conditional started right before this declaration,
+                        # which then includes it (as for K&R function heads)
+                        start = cond[0]
+                        self.items.pop()
+                        cond[4] = -1
+                    # Within a declaration, which then also provides the macro
+                    if directive[1] == "define" and directive[2]:
+                        defines.append(directive[2])
+                    continue
+                add(match.start())
+                if directive[1] in ("define", "undef") and directive[2]:
+                    item = Item(token.strip(), origin)
+                    item.names.append(directive[2])
+                    item.uses = frozenset(identifier_pattern.findall(token)[2:])
+                    if directive[1] == "define" and directive[3]:
+                        self.function_macros.add(directive[2])
+                    self.items.append(item)
+                    start = match.end()
+                else:
+                    add(match.end(), "structural")
+                    if directive[1] in ("if", "ifdef", "ifndef"):
+                        conds[-1][4] = len(self.items) - 1
+        add(len(text))
+
+    # Whether a declaration continues after its braces, as for a struct
+    # definition or an initializer
+    @staticmethod
+    def continues(head: str) -> bool:
+        if template_pattern.match(head):
+            head = remove_templates(head)
+        flat = flatten(head, r"\([^()]*\)")
+        if "=" in flat or re.match(r"\s*typedef\b", flat):
+            return True
+        return class_pattern.search(flat) is not None and "(" not in flat
+
+    def function_item(self, item: Item, head: str) -> None:
+        item.uses = identifiers(item.text)
+        name = function_name(head)
+        if name is None:
+            # Not a function, keep whatever it is
+            item.structural = True
+            return
+        item.function = name
+        item.names.append(name)
+        item.keep_body = bool(
+            template_pattern.match(head) or inline_pattern.search(head)
+        )
+        item.prototype = prototype(head, name)
+        item.prototype_uses = identifiers(head)
+        if "::" in name:
+            # Inline members are needed along with their class
+            item.names.append(name.split("::", 1)[0])
+
+    # Items defining a function, by qualified name or by its last component
+    def find_functions(self, name: str) -> List[int]:
+        name = normalize(name)
+        exact = [i for i, item in enumerate(self.items) if item.function == name]
+        if exact or "::" in name:
+            return exact
+        return [
+            i
+            for i, item in enumerate(self.items)
+            if item.function is not None and item.function.rsplit("::", 1)[-1] == name
+        ]
+
+    # Functions defined in the unit's own source file
+    def unit_functions(self) -> List[int]:
+        return [
+            i
+            for i, item in enumerate(self.items)
+            if item.function is not None and item.origin == 0
+        ]
+
+    # Conditionals, each as the indices of the items holding its directives
+    # from #if to #endif, with inner conditionals first
+    def conditionals(self) -> List[List[int]]:
+        groups: List[List[int]] = []
+        stack: List[List[int]] = []
+        for index, item in enumerate(self.items):
+            if not item.structural or "#" not in item.text:
+                continue
+            for match in conditional_pattern.finditer(item.text):
+                if match[1].startswith("if"):
+                    stack.append([index])
+                elif stack:
+                    stack[-1].append(index)
+                    if match[1] == "endif":
+                        groups.append(stack.pop())
+        return groups
+
+    # Text of the declarations needed by the given function definitions,
+    # which are left out. Conditionals are only kept around what's kept.
+    def minimize(self, targets: Iterable[int]) -> str:
+        targets = set(targets)
+        needed: Set[int] = set()
+        full: Set[int] = set()
+        seen: Set[str] = set()
+        pending: List[str] = []
+        groups = self.conditionals()
+        # Items that are just a directive of a (terminated) conditional are
+        # only kept along with it, other structural items in any case
+        directives = {
+            index
+            for group in groups
+            for index in group
+            if conditional_pattern.fullmatch(self.items[index].text)
+        }
+        kept_groups: Set[int] = set()
+        kept_directives: Set[int] = set()
+
+        def use(names: Iterable[str]) -> None:
+            for name in names:
+                if name not in seen:
+                    seen.add(name)
+                    pending.append(name)
+
+        for index in targets:
+            use(self.items[index].uses)
+        for index, item in enumerate(self.items):
+            if item.structural and index not in directives:
+                full.add(index)
+                use(item.uses)
+        while pending:
+            while pending:
+                for index in self.declarers.get(pending.pop(), []):
+                    item = self.items[index]
+                    if item.function is not None and (
+                        index in targets or not item.keep_body
+                    ):
+                        if index not in needed:
+                            needed.add(index)
+                            use(item.prototype_uses)
+                    elif index not in full:
+                        full.add(index)
+                        use(item.uses)
+
+            # Keep each conditional around a kept item, with the macros it tests,
+            # which may keep more items. Nested conditionals are kept first.
+            kept = sorted(
+                full
+                | {i for i in needed if self.items[i].prototype is not None}
+                | kept_directives
+            )
+            for number, group in enumerate(groups):
+                if number in kept_groups:
+                    continue
+                first = bisect.bisect_left(kept, group[0])
+                if first < len(kept) and kept[first] <= group[-1]:
+                    kept_groups.add(number)
+                    for index in group:
+                        use(self.items[index].uses)
+                        kept_directives.add(index)
+                        bisect.insort(kept, index)
+
+        lines: List[str] = []
+        for index, item in enumerate(self.items):
+            if index in full:
+                lines.append(item.text)
+            elif index in needed and item.prototype is not None:
+                lines.append(item.prototype)
+            elif index in kept_directives:
+                lines.append(item.text)
+        return "\n".join(lines) + "\n"
+
+
+def minimize_text(text: str, functions: List[str]) -> Tuple[str, List[str]]:
+    context = Context(text)
+    targets: List[int] = []
+    missing: List[str] = []
+    for name in functions:
+        found = context.find_functions(name)
+        if not found:
+            missing.append(name)
+        targets.extend(found)
+    return context.minimize(targets), missing
+
+
+# Reduces the context of an objdiff unit to what its functions need,
+# returning the sizes before and after, and the time taken
+def minimize_unit(paths: Tuple[str, str]) -> Tuple[str, int, int, float]:
+    ctx_path, out_path = paths
+    start = time.perf_counter()
+    with open(ctx_path, encoding="utf-8") as f:
+        text = f.read()
+    context = Context(text)
+    minimal = context.minimize(context.unit_functions())
+    with open(out_path, "w", encoding="utf-8") as f:
+        f.write(minimal)
+    return ctx_path, len(text), len(minimal), time.perf_counter() - start
+
+
+def minimize_objdiff(objdiff_path: str, jobs: int, stats: bool) -> None:
+    with open(objdiff_path, encoding="utf-8") as f:
+        units: List[Dict[str, Any]] = json.load(f).get("units", [])
+    work: List[Tuple[str, str]] = []
+    skipped = 0
+    for unit in units:
+        ctx_path = unit.get("scratch", {}).get("ctx_path")
+        if not ctx_path:
+            continue
+        if not os.path.isfile(ctx_path):
+            skipped += 1
+            continue
+        work.append((ctx_path, os.path.splitext(ctx_path)[0] + ".min.ctx"))
+
+    if jobs > 1 and len(work) > 1:
+        from multiprocessing import Pool
+
+        with Pool(jobs) as pool:
+            results = pool.map(minimize_unit, work, chunksize=1)
+    else:
+        results = [minimize_unit(paths) for paths in work]
+
+    before = sum(r[1] for r in results)
+    after = sum(r[2] for r in results)
+    if stats:
+        for ctx_path, size, minimal, elapsed in results:
+            print(f"{ctx_path}: {size} -> {minimal} bytes, {elapsed * 1000:.1f} ms")
+    print(
+        f"Reduced {len(results)} contexts from {before} to {after} bytes"
+        f" ({after / max(before, 1):.1%})"
+    )
+    if skipped:
+        print(f"{skipped} context(s) not found, build them with `ninja ctx`")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Reduce a context file to what a function needs"""
+    )
+    parser.add_argument("ctx_file", nargs="?", help="""Context file to reduce""")
+    parser.add_argument(
+        "-f",
+        "--function",
+        action="append",
+        help="""Function to keep the context of (plain or qualified name)""",
+    )
+    parser.add_argument("-o", "--output", default="ctx.c", help="""Output file""")
+    parser.add_argument(
+        "--objdiff",
+        metavar="JSON",
+        help="""Reduce the context of every unit in objdiff.json""",
+    )
+    parser.add_argument(
+        "-j", "--jobs", type=int, default=1, help="""Worker processes for --objdiff"""
+    )
+    parser.add_argument(
+        "--stats",
+        action="store_true",
+        help="""Print the size before and after, and the time taken""",
+    )
+    args = parser.parse_args()
+
+    if args.objdiff:
+        minimize_objdiff(args.objdiff, args.jobs, args.stats)
+        return
+    if args.ctx_file is None:
+        sys.exit("No context file specified")
+    if not args.function:
+        sys.exit("No function specified")
+    start = time.perf_counter()
+    with open(args.ctx_file, encoding="utf-8") as f:
+        text = f.read()
+    minimal, missing = minimize_text(text, args.function)
+    if missing:
+        sys.exit(f"Function(s) not found in {args.ctx_file}: {', '.join(missing)}")
+    with open(args.output, "w", encoding="utf-8") as f:
+        f.write(minimal)
+    if args.stats:
+        elapsed = time.perf_counter() - start
+        print(
+            f"{args.ctx_file}: {len(text)} -> {len(minimal)} bytes,"
+            f" {elapsed * 1000:.1f} ms"
+        )
+
+
+if __name__ == "__main__":
+    main()
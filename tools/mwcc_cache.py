@@ -0,0 +1,484 @@
+#!/usr/bin/env python3
+
+###
+# Local, content-addressed cache for MWCC compile results.
+#
+# Wraps a compiler invocation. Results are keyed on the compiler flags,
+# the compiler version, the source file and the contents of every header
+# listed in the dependency file of a previous compile. On a hit, the cached
+# object and dependency file are restored without running the compiler.
+#
+# The cache directory only contains relative paths and can be shared between
+# build directories and CI jobs by copying or mounting it.
+#
+# Usage:
+#   python3 tools/mwcc_cache.py compile --dir build/cache -o build/src/file.o \
+#     -d build/src/file.d -- wibo mwcceppc.exe -c src/file.c -o build/src
+#   python3 tools/mwcc_cache.py stats --dir build/cache
+#   python3 tools/mwcc_cache.py clear --dir build/cache
+###
+
+import argparse
+import contextlib
+import hashlib
+import json
+import os
+import platform
+import shutil
+import subprocess
+import sys
+import time
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+# Maximum number of header sets remembered per source/flags combination
+MAX_MANIFEST_ENTRIES = 16
+# Evict down to this fraction of the maximum size
+EVICT_TARGET = 0.9
+# Bytes appended to the event log for each counted lookup
+EVENTS = {"hits": b"h", "misses": b"m"}
+
+
+def parse_size(value: str) -> int:
+    units = {"K": 1 << 10, "M": 1 << 20, "G": 1 << 30}
+    suffix = value[-1:].upper()
+    if suffix in units:
+        return int(float(value[:-1]) * units[suffix])
+    return int(value)
+
+
+def format_size(size: int) -> str:
+    if size < 1 << 10:
+        return f"{size} B"
+    elif size < 1 << 20:
+        return f"{size / (1 << 10):.1f} KiB"
+    elif size < 1 << 30:
+        return f"{size / (1 << 20):.1f} MiB"
+    return f"{size / (1 << 30):.1f} GiB"
+
+
+def hash_file(path: str) -> Optional[str]:
+    h = hashlib.sha256()
+    try:
+        with open(path, "rb") as f:
+            while True:
+                chunk = f.read(1 << 20)
+                if not chunk:
+                    break
+                h.update(chunk)
+    except OSError:
+        return None
+    return h.hexdigest()
+
+
+# Write a file atomically, so that concurrent readers never see partial data
+def write_atomic(path: str, data: bytes) -> None:
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = f"{path}.{os.getpid()}.tmp"
+    with open(tmp_path, "wb") as f:
+        f.write(data)
+    os.replace(tmp_path, path)
+
+
+# Whether a process on this host is still running
+def pid_alive(pid: int) -> bool:
+    if os.name == "nt":
+        import ctypes
+
+        kernel32 = ctypes.windll.kernel32  # type: ignore
+        # PROCESS_QUERY_LIMITED_INFORMATION
+        handle = kernel32.OpenProcess(0x1000, False, pid)
+        if not handle:
+            return False
+        code = ctypes.c_ulong()
+        kernel32.GetExitCodeProcess(handle, ctypes.byref(code))
+        kernel32.CloseHandle(handle)
+        return code.value == 259  # STILL_ACTIVE
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def to_relative(path: str) -> str:
+    path = os.path.normpath(path)
+    if os.path.isabs(path):
+        try:
+            rel_path = os.path.relpath(path)
+        except ValueError:
+            # Different drive on Windows
+            return path
+        if not rel_path.startswith(".."):
+            return rel_path
+    return path
+
+
+# Reads the paths from a (transformed) dependency file, one path per line
+def read_depfile(path: str) -> List[str]:
+    deps: List[str] = []
+    with open(path, encoding="utf-8") as f:
+        for idx, line in enumerate(f):
+            if idx == 0:
+                continue
+            line = line.strip()
+            if line.endswith("\\"):
+                line = line[:-1].rstrip()
+            if line:
+                deps.append(to_relative(line))
+    return deps
+
+
+def write_depfile(path: str, target: str, deps: List[str]) -> None:
+    lines = [target.replace("\\", "/") + ":"]
+    lines.extend("\t" + dep for dep in deps)
+    write_atomic(path, (" \\\n".join(lines) + "\n").encode("utf-8"))
+
+
+class CompileCache:
+    def __init__(self, cache_dir: str, max_size: int) -> None:
+        self.dir = cache_dir
+        self.max_size = max_size
+        self._hashes: Dict[str, Optional[str]] = {}
+
+    def file_hash(self, path: str) -> Optional[str]:
+        if path not in self._hashes:
+            self._hashes[path] = hash_file(path)
+        return self._hashes[path]
+
+    def _manifest_path(self, key: str) -> str:
+        return os.path.join(self.dir, "manifests", key[:2], key + ".json")
+
+    def _result_dir(self, key: str) -> str:
+        return os.path.join(self.dir, "results", key[:2], key)
+
+    def _read_manifest(self, key: str) -> List[Dict]:
+        try:
+            with open(self._manifest_path(key), encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return []
+
+    # Finds a cached result whose recorded headers all match their current contents
+    def lookup(self, key: str) -> Optional[Tuple[str, List[str]]]:
+        for entry in self._read_manifest(key):
+            deps: Dict[str, str] = entry["deps"]
+            if all(self.file_hash(dep) == digest for dep, digest in deps.items()):
+                result_dir = self._result_dir(entry["result"])
+                obj_path = os.path.join(result_dir, "object.o")
+                if os.path.isfile(obj_path):
+                    return obj_path, list(deps.keys())
+        return None
+
+    def store(self, key: str, obj_path: str, deps: List[str]) -> None:
+        dep_hashes: Dict[str, str] = {}
+        for dep in deps:
+            digest = self.file_hash(dep)
+            if digest is None:
+                # Can't validate this result later, don't cache it
+                return
+            dep_hashes[dep] = digest
+
+        h = hashlib.sha256(key.encode("utf-8"))
+        for dep, digest in dep_hashes.items():
+            h.update(f"{dep}\0{digest}\0".encode("utf-8"))
+        result_key = h.hexdigest()
+
+        with open(obj_path, "rb") as f:
+            data = f.read()
+        result_path = os.path.join(self._result_dir(result_key), "object.o")
+
+        with self.locked() as acquired:
+            if not acquired:
+                print("mwcc_cache: cache is locked, not storing", file=sys.stderr)
+                return
+            # Re-storing a result replaces a file that was already counted
+            try:
+                old_size = os.path.getsize(result_path)
+            except OSError:
+                old_size = 0
+            write_atomic(result_path, data)
+            entries = [e for e in self._read_manifest(key) if e["result"] != result_key]
+            entries.insert(0, {"deps": dep_hashes, "result": result_key})
+            manifest = json.dumps(entries[:MAX_MANIFEST_ENTRIES]).encode("utf-8")
+            write_atomic(self._manifest_path(key), manifest)
+            stats = self.read_stats()
+            stats["size"] = stats.get("size", 0) + len(data) - old_size
+            stats["stores"] = stats.get("stores", 0) + 1
+            if stats["size"] > self.max_size:
+                stats["size"], evicted = self.evict()
+                stats["evictions"] = stats.get("evictions", 0) + evicted
+            self.write_stats(stats)
+
+    # Removes least recently used results until the cache fits its size limit.
+    # Returns the new cache size and the number of evicted results.
+    def evict(self, max_size: Optional[int] = None) -> Tuple[int, int]:
+        if max_size is None:
+            max_size = self.max_size
+        results: List[Tuple[float, int, str]] = []
+        results_dir = os.path.join(self.dir, "results")
+        for root, _, files in os.walk(results_dir):
+            for name in files:
+                path = os.path.join(root, name)
+                try:
+                    st = os.stat(path)
+                except OSError:
+                    continue
+                results.append((st.st_mtime, st.st_size, path))
+        size = sum(r[1] for r in results)
+        evicted = 0
+        if size > max_size:
+            results.sort()
+            target = int(max_size * EVICT_TARGET)
+            for _, file_size, path in results:
+                if size <= target:
+                    break
+                shutil.rmtree(os.path.dirname(path), ignore_errors=True)
+                size -= file_size
+                evicted += 1
+        return size, evicted
+
+    def stats_path(self) -> str:
+        return os.path.join(self.dir, "stats.json")
+
+    def events_path(self) -> str:
+        return os.path.join(self.dir, "events.log")
+
+    # Statistics, with the hits and misses counted in the event log
+    def read_stats(self) -> Dict[str, int]:
+        try:
+            with open(self.stats_path(), encoding="utf-8") as f:
+                stats = json.load(f)
+        except (OSError, ValueError):
+            stats = {}
+        try:
+            with open(self.events_path(), "rb") as f:
+                events = f.read()
+        except OSError:
+            events = b""
+        for stat, event in EVENTS.items():
+            stats[stat] = events.count(event)
+        return stats
+
+    def write_stats(self, stats: Dict[str, int]) -> None:
+        stats = {k: v for k, v in stats.items() if k not in EVENTS}
+        write_atomic(self.stats_path(), json.dumps(stats, indent=2).encode("utf-8"))
+
+    # Counts a hit or miss by appending to the event log, which needs no lock
+    def count(self, stat: str) -> None:
+        os.makedirs(self.dir, exist_ok=True)
+        with open(self.events_path(), "ab") as f:
+            f.write(EVENTS[stat])
+
+    # Cross-process lock for manifest and size updates, which are only made
+    # when storing a result. Yields whether the lock was acquired in time.
+    # A lock is only broken once the process that holds it has exited.
+    @contextmanager
+    def locked(self, timeout: float = 10.0) -> Iterator[bool]:
+        os.makedirs(self.dir, exist_ok=True)
+        lock_path = os.path.join(self.dir, "lock")
+        owner = f"{os.getpid()} {platform.node()}"
+        deadline = time.monotonic() + timeout
+        delay = 0.001
+        acquired = False
+        while not acquired:
+            try:
+                fd = os.open(lock_path, os.O_CREAT | os.O_EXCL | os.O_WRONLY)
+            except FileExistsError:
+                if self._break_dead_lock(lock_path, timeout):
+                    continue
+                if time.monotonic() > deadline:
+                    break
+                time.sleep(delay)
+                delay = min(delay * 2, 0.05)
+                continue
+            with os.fdopen(fd, "w", encoding="utf-8") as f:
+                f.write(owner)
+            acquired = True
+        try:
+            yield acquired
+        finally:
+            if acquired and read_lock_owner(lock_path) == owner:
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(lock_path)
+
+    # Removes the lock if its owner ran on this host and has exited, or if it
+    # was never written (its owner was killed right after creating it)
+    @staticmethod
+    def _break_dead_lock(lock_path: str, timeout: float) -> bool:
+        owner = read_lock_owner(lock_path)
+        if owner is None:
+            try:
+                age = time.time() - os.path.getmtime(lock_path)
+            except OSError:
+                return False
+            if age < timeout:
+                return False
+        else:
+            pid, _, host = owner.partition(" ")
+            if host != platform.node() or not pid.isdigit() or pid_alive(int(pid)):
+                return False
+        if read_lock_owner(lock_path) != owner:
+            return False
+        with contextlib.suppress(FileNotFoundError):
+            os.remove(lock_path)
+        return True
+
+
+# Contents of a lock file, or None if there's none or it's still being written
+def read_lock_owner(lock_path: str) -> Optional[str]:
+    try:
+        with open(lock_path, encoding="utf-8") as f:
+            return f.read() or None
+    except OSError:
+        return None
+
+
+# Computes the cache key for a compiler command line.
+# Output paths are excluded so that results can be shared between build directories.
+def command_key(extra_keys: List[str], command: List[str]) -> Tuple[str, str]:
+    compiler_idx = next(
+        (i for i, arg in enumerate(command) if arg.lower().endswith("mwcceppc.exe")),
+        None,
+    )
+    if compiler_idx is None:
+        sys.exit("mwcc_cache: mwcceppc.exe not found in command")
+    args = command[compiler_idx + 1 :]
+
+    h = hashlib.sha256()
+    source: Optional[str] = None
+    idx = 0
+    while idx < len(args):
+        arg = args[idx]
+        if arg == "-o" and idx + 1 < len(args):
+            idx += 2
+            continue
+        if arg == "-c" and idx + 1 < len(args):
+            source = args[idx + 1]
+        h.update(arg.encode("utf-8") + b"\0")
+        idx += 1
+    if source is None:
+        sys.exit("mwcc_cache: no source file in command")
+    for key in extra_keys:
+        h.update(key.encode("utf-8") + b"\0")
+    source_hash = hash_file(source)
+    if source_hash is None:
+        sys.exit(f"mwcc_cache: failed to read {source}")
+    h.update(source_hash.encode("utf-8"))
+    return h.hexdigest(), to_relative(source)
+
+
+def cached_compile(args: argparse.Namespace) -> int:
+    try:
+        from .transform_dep import keep_unchanged, transform_d_file
+    except ImportError:
+        from transform_dep import keep_unchanged, transform_d_file  # type: ignore
+
+    cache = CompileCache(args.dir, parse_size(args.max_size))
+    key, source = command_key(args.key or [], args.command)
+
+    cached = cache.lookup(key)
+    if cached is not None:
+        obj_path, deps = cached
+        os.makedirs(os.path.dirname(args.output) or ".", exist_ok=True)
+        with open(obj_path, "rb") as f:
+            write_atomic(args.output, f.read())
+        write_depfile(args.depfile, args.output, deps)
+        if args.keep_unchanged:
+            keep_unchanged(args.output)
+        # Mark as recently used
+        os.utime(obj_path)
+        cache.count("hits")
+        return 0
+
+    result = subprocess.run(args.command)
+    if result.returncode != 0:
+        return result.returncode
+    if args.transform_dep:
+        transform_d_file(args.depfile)
+    if args.keep_unchanged and os.path.isfile(args.output):
+        keep_unchanged(args.output)
+    cache.count("misses")
+
+    if os.path.isfile(args.output) and os.path.isfile(args.depfile):
+        deps = read_depfile(args.depfile)
+        if source not in deps:
+            deps.insert(0, source)
+        cache.store(key, args.output, deps)
+    return 0
+
+
+def print_stats(args: argparse.Namespace) -> int:
+    cache = CompileCache(args.dir, 0)
+    stats = cache.read_stats()
+    hits, misses = stats.get("hits", 0), stats.get("misses", 0)
+    total = hits + misses
+    rate = hits / total * 100 if total else 0.0
+    print(f"Cache directory: {args.dir}")
+    print(f"  Hits:      {hits} ({rate:.2f}%)")
+    print(f"  Misses:    {misses}")
+    print(f"  Stores:    {stats.get('stores', 0)}")
+    print(f"  Evictions: {stats.get('evictions', 0)}")
+    print(f"  Size:      {format_size(stats.get('size', 0))}")
+    return 0
+
+
+def clear(args: argparse.Namespace) -> int:
+    for name in ("manifests", "results"):
+        shutil.rmtree(os.path.join(args.dir, name), ignore_errors=True)
+    cache = CompileCache(args.dir, 0)
+    with contextlib.suppress(FileNotFoundError):
+        os.remove(cache.events_path())
+    cache.write_stats({})
+    return 0
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="""MWCC compile result cache""")
+    subparsers = parser.add_subparsers(dest="mode", required=True)
+
+    compile_parser = subparsers.add_parser("compile", help="run a cached compile")
+    compile_parser.add_argument("--dir", required=True, help="cache directory")
+    compile_parser.add_argument(
+        "--max-size",
+        default="2G",
+        help="maximum cache size, with optional K/M/G suffix (default: 2G)",
+    )
+    compile_parser.add_argument(
+        "--key",
+        action="append",
+        help="additional cache key component (e.g. compiler version)",
+    )
+    compile_parser.add_argument(
+        "--transform-dep",
+        action="store_true",
+        help="convert the dependency file from Wine paths after compiling",
+    )
+    compile_parser.add_argument(
+        "--keep-unchanged",
+        action="store_true",
+        help="keep the object's modification time if its contents didn't change",
+    )
+    compile_parser.add_argument("-o", "--output", required=True, help="object file")
+    compile_parser.add_argument(
+        "-d", "--depfile", required=True, help="dependency file"
+    )
+    compile_parser.add_argument("command", nargs="+", help="compiler command")
+
+    for mode in ("stats", "clear"):
+        mode_parser = subparsers.add_parser(mode, help=f"{mode} the cache")
+        mode_parser.add_argument("--dir", required=True, help="cache directory")
+
+    args = parser.parse_args()
+    if args.mode == "compile":
+        sys.exit(cached_compile(args))
+    elif args.mode == "stats":
+        sys.exit(print_stats(args))
+    elif args.mode == "clear":
+        sys.exit(clear(args))
+
+
+if __name__ == "__main__":
+    main()
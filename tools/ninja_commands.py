@@ -0,0 +1,72 @@
+#!/usr/bin/env python3
+
+###
+# Compares the commands of two ninja build files, as expanded by ninja.
+#
+# Checks that a change to the build file generator that should only change
+# how build.ninja is written (such as the shared cflags_<lib>/includes_<lib>
+# variables) leaves every command unchanged. The order of the commands isn't
+# compared, as it follows the expected compile times.
+#
+# Usage:
+#   python3 tools/ninja_commands.py before/build.ninja build.ninja
+#   python3 tools/ninja_commands.py before/build.ninja build.ninja -t all_source
+#
+# Each build file is read from its own directory, so the build file to compare
+# against can be generated by another revision in a git worktree.
+###
+
+import argparse
+import os
+import subprocess
+import sys
+from collections import Counter
+from typing import List
+
+
+# Commands needed to build the targets (ninja's defaults if none), expanded
+def ninja_commands(ninja: str, path: str, targets: List[str]) -> List[str]:
+    directory, name = os.path.split(os.path.abspath(path))
+    result = subprocess.run(
+        [ninja, "-C", directory, "-f", name, "-t", "commands", *targets],
+        capture_output=True,
+        text=True,
+    )
+    if result.returncode != 0:
+        sys.exit(f"Failed to list the commands of {path}:\n{result.stderr}")
+    return result.stdout.splitlines()
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Compare the expanded commands of two ninja build files"""
+    )
+    parser.add_argument("before", help="""build file to compare against""")
+    parser.add_argument("after", help="""build file to check""")
+    parser.add_argument(
+        "-t",
+        "--target",
+        action="append",
+        default=[],
+        help="""target to list the commands of (default: ninja's defaults)""",
+    )
+    parser.add_argument(
+        "--ninja", default="ninja", help="""ninja executable (default: ninja)"""
+    )
+    args = parser.parse_args()
+
+    before = Counter(ninja_commands(args.ninja, args.before, args.target))
+    after = Counter(ninja_commands(args.ninja, args.after, args.target))
+    removed = sorted((before - after).elements())
+    added = sorted((after - before).elements())
+    for command in removed:
+        print(f"- {command}")
+    for command in added:
+        print(f"+ {command}")
+    if removed or added:
+        sys.exit(f"{len(removed)} command(s) removed, {len(added)} added")
+    print(f"{sum(after.values())} commands unchanged")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,395 @@
+#!/usr/bin/env python3
+
+###
+# Analyzes build times from .ninja_log and build.ninja.
+#
+# Reports per-unit compile and link times, a per-library and per-compiler
+# breakdown, and the critical path through the last build. A short summary
+# of every analyzed build is kept in a history file to show trends.
+#
+# Usage:
+#   python3 tools/ninja_log.py
+#   python3 tools/ninja_log.py --top 30 --history build/GGVE78/build_times.json
+###
+
+import argparse
+import json
+import os
+import sys
+import time
+from typing import Any, Dict, Iterable, List, Optional, Tuple
+
+# Number of builds kept in the history file
+MAX_HISTORY = 100
+
+
+class LogEntry:
+    def __init__(self, start: int, end: int, mtime: int, output: str, cmd_hash: str):
+        self.start = start
+        self.end = end
+        self.mtime = mtime
+        self.output = output
+        self.cmd_hash = cmd_hash
+
+    @property
+    def duration(self) -> int:
+        return self.end - self.start
+
+
+# Reads .ninja_log, returning the entries of each build in order.
+# A new build is detected when the end time goes backwards.
+def read_ninja_log(path: str) -> List[List[LogEntry]]:
+    builds: List[List[LogEntry]] = []
+    current: List[LogEntry] = []
+    last_end = 0
+    with open(path, encoding="utf-8", errors="replace") as f:
+        for line in f:
+            if line.startswith("#"):
+                continue
+            fields = line.rstrip("\n").split("\t")
+            if len(fields) < 5:
+                continue
+            start, end = int(fields[0]), int(fields[1])
+            entry = LogEntry(start, end, int(fields[2]), fields[3], fields[4])
+            if current and end < last_end:
+                builds.append(current)
+                current = []
+            current.append(entry)
+            last_end = end
+    if current:
+        builds.append(current)
+    return builds
+
+
+class Edge:
+    def __init__(self, rule: str, outputs: List[str], inputs: List[str]) -> None:
+        self.rule = rule
+        self.outputs = outputs
+        self.inputs = inputs
+        self.variables: Dict[str, str] = {}
+        self.lib: Optional[str] = None
+
+
+def _split_unescaped(text: str) -> List[str]:
+    words: List[str] = []
+    word = ""
+    idx = 0
+    while idx < len(text):
+        c = text[idx]
+        if c == "$" and idx + 1 < len(text):
+            word += text[idx + 1]
+            idx += 2
+            continue
+        if c == " ":
+            if word:
+                words.append(word)
+            word = ""
+        else:
+            word += c
+        idx += 1
+    if word:
+        words.append(word)
+    return words
+
+
+def _find_colon(text: str) -> int:
+    idx = 0
+    while idx < len(text):
+        if text[idx] == "$":
+            idx += 2
+            continue
+        if text[idx] == ":":
+            return idx
+        idx += 1
+    return -1
+
+
+def _logical_lines(path: str) -> Iterable[str]:
+    with open(path, encoding="utf-8") as f:
+        pending = ""
+        for line in f:
+            line = line.rstrip("\n")
+            # Line continuation (an odd number of trailing $)
+            stripped = line.rstrip("$")
+            if (len(line) - len(stripped)) % 2 == 1:
+                pending += line[:-1]
+                continue
+            if pending:
+                line = pending + line.lstrip()
+                pending = ""
+            yield line
+
+
+# Parses the build statements of a ninja manifest, following subninja/include.
+# Only what's needed for timing analysis is understood.
+def read_ninja_edges(path: str) -> List[Edge]:
+    edges: List[Edge] = []
+
+    def parse(file_path: str) -> None:
+        lib: Optional[str] = None
+        edge: Optional[Edge] = None
+        for line in _logical_lines(file_path):
+            if line.startswith("# Library "):
+                lib = line[len("# Library ") :].strip()
+                continue
+            if not line or line.startswith("#"):
+                continue
+            if line.startswith("  ") or line.startswith("\t"):
+                if edge is not None and "=" in line:
+                    key, value = line.strip().split("=", 1)
+                    edge.variables[key.strip()] = value.strip()
+                continue
+            edge = None
+            if line.startswith("build "):
+                colon = _find_colon(line)
+                outputs = _split_unescaped(line[len("build ") : colon])
+                rest = _split_unescaped(line[colon + 1 :])
+                if not rest:
+                    continue
+                outputs = [o for o in outputs if o != "|"]
+                inputs = [i for i in rest[1:] if i not in ("|", "||")]
+                edge = Edge(rest[0], outputs, inputs)
+                edge.lib = lib
+                edges.append(edge)
+            elif line.startswith("subninja ") or line.startswith("include "):
+                sub_path = line.split(" ", 1)[1].strip()
+                if os.path.isfile(sub_path):
+                    parse(sub_path)
+
+    parse(path)
+    return edges
+
+
+class BuildAnalysis:
+    def __init__(self, edges: List[Edge], entries: List[LogEntry]) -> None:
+        self.edges = edges
+        self.entries = {entry.output: entry for entry in entries}
+        self.producers: Dict[str, Edge] = {}
+        for edge in edges:
+            for output in edge.outputs:
+                self.producers[output] = edge
+        self.start = min((e.start for e in entries), default=0)
+        self.end = max((e.end for e in entries), default=0)
+
+    def edge_entry(self, edge: Edge) -> Optional[LogEntry]:
+        for output in edge.outputs:
+            entry = self.entries.get(output)
+            if entry is not None:
+                return entry
+        return None
+
+    def timed_edges(self, rules: Tuple[str, ...]) -> List[Tuple[Edge, LogEntry]]:
+        out = []
+        for edge in self.edges:
+            if edge.rule not in rules:
+                continue
+            entry = self.edge_entry(edge)
+            if entry is not None:
+                out.append((edge, entry))
+        out.sort(key=lambda e: e[1].duration, reverse=True)
+        return out
+
+    # Longest chain of edges that ran in this build, ending at the last edge to finish
+    def critical_path(self) -> List[Tuple[Edge, LogEntry]]:
+        memo: Dict[str, Tuple[int, Optional[str]]] = {}
+
+        def cost(node: str, visiting: set) -> int:
+            if node in memo:
+                return memo[node][0]
+            edge = self.producers.get(node)
+            if edge is None or node in visiting:
+                return 0
+            visiting.add(node)
+            best, best_input = 0, None
+            for input in edge.inputs:
+                c = cost(input, visiting)
+                if c > best:
+                    best, best_input = c, input
+            visiting.discard(node)
+            entry = self.edge_entry(edge)
+            total = best + (entry.duration if entry is not None else 0)
+            memo[node] = (total, best_input)
+            return total
+
+        if not self.entries:
+            return []
+        last = max(self.entries.values(), key=lambda e: e.end)
+        sys.setrecursionlimit(max(sys.getrecursionlimit(), 10000))
+        cost(last.output, set())
+        path: List[Tuple[Edge, LogEntry]] = []
+        node: Optional[str] = last.output
+        while node is not None:
+            edge = self.producers.get(node)
+            entry = self.entries.get(node)
+            if edge is None:
+                break
+            entry = entry or self.edge_entry(edge)
+            if entry is not None:
+                path.append((edge, entry))
+            node = memo.get(node, (0, None))[1]
+        path.reverse()
+        return path
+
+
+def format_ms(ms: float) -> str:
+    if ms >= 60000:
+        return f"{int(ms // 60000)}m{ms % 60000 / 1000:04.1f}s"
+    return f"{ms / 1000:.2f}s"
+
+
+def breakdown(
+    edges: List[Tuple[Edge, LogEntry]], key: str
+) -> List[Tuple[str, int, int, int]]:
+    groups: Dict[str, List[int]] = {}
+    for edge, entry in edges:
+        name = edge.lib if key == "lib" else edge.variables.get(key)
+        groups.setdefault(name or "(none)", []).append(entry.duration)
+    rows = [(name, len(d), sum(d), max(d)) for name, d in groups.items()]
+    rows.sort(key=lambda r: r[2], reverse=True)
+    return rows
+
+
+def load_history(path: str) -> List[Dict[str, Any]]:
+    try:
+        with open(path, encoding="utf-8") as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return []
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Analyze build times from .ninja_log"""
+    )
+    parser.add_argument(
+        "--log", default=".ninja_log", help="""ninja log (default: .ninja_log)"""
+    )
+    parser.add_argument(
+        "--manifest",
+        default="build.ninja",
+        help="""ninja manifest (default: build.ninja)""",
+    )
+    parser.add_argument(
+        "--top", type=int, default=20, help="""number of units to list (default: 20)"""
+    )
+    parser.add_argument(
+        "--history",
+        default=os.path.join("build", "build_times.json"),
+        help="""history file (default: build/build_times.json)""",
+    )
+    parser.add_argument(
+        "--no-history", action="store_true", help="""don't read or update history"""
+    )
+    parser.add_argument("--json", action="store_true", help="""output JSON""")
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.log):
+        sys.exit(f"{args.log} not found, run ninja first")
+    builds = read_ninja_log(args.log)
+    if not builds:
+        sys.exit(f"{args.log} is empty")
+    analysis = BuildAnalysis(read_ninja_edges(args.manifest), builds[-1])
+
+    compiles = analysis.timed_edges(("mwcc", "mwcc_sjis", "as"))
+    links = analysis.timed_edges(("link", "makerel", "elf2dol"))
+    path = analysis.critical_path()
+    summary = {
+        "time": int(time.time()),
+        "wall": analysis.end - analysis.start,
+        "edges": len(analysis.entries),
+        "compile_count": len(compiles),
+        "compile_total": sum(e.duration for _, e in compiles),
+        "link_total": sum(e.duration for _, e in links),
+        "critical_path": sum(e.duration for _, e in path),
+    }
+
+    history: List[Dict[str, Any]] = []
+    if not args.no_history:
+        history = load_history(args.history)
+        # Don't record the same build twice
+        if (
+            not history
+            or history[-1].get("wall") != summary["wall"]
+            or history[-1].get("edges") != summary["edges"]
+        ):
+            history.append(summary)
+            history = history[-MAX_HISTORY:]
+            os.makedirs(os.path.dirname(args.history) or ".", exist_ok=True)
+            with open(args.history, "w", encoding="utf-8") as f:
+                json.dump(history, f, indent=2)
+
+    if args.json:
+        json.dump(
+            {
+                "summary": summary,
+                "compiles": [
+                    {
+                        "output": entry.output,
+                        "source": edge.inputs[0] if edge.inputs else None,
+                        "lib": edge.lib,
+                        "mw_version": edge.variables.get("mw_version"),
+                        "ms": entry.duration,
+                    }
+                    for edge, entry in compiles
+                ],
+                "links": [
+                    {"output": entry.output, "rule": edge.rule, "ms": entry.duration}
+                    for edge, entry in links
+                ],
+                "critical_path": [
+                    {"output": entry.output, "rule": edge.rule, "ms": entry.duration}
+                    for edge, entry in path
+                ],
+                "history": history,
+            },
+            sys.stdout,
+            indent=2,
+        )
+        print()
+        return
+
+    print(
+        f"Last build: {summary['edges']} edges in {format_ms(summary['wall'])}"
+        f" ({summary['compile_count']} compiles, {format_ms(summary['compile_total'])} total)"
+    )
+
+    print("\nSlowest compiles:")
+    for edge, entry in compiles[: args.top]:
+        source = edge.inputs[0] if edge.inputs else entry.output
+        print(f"  {format_ms(entry.duration):>9}  {source}")
+
+    if links:
+        print("\nLink steps:")
+        for edge, entry in links:
+            print(f"  {format_ms(entry.duration):>9}  {edge.rule:<8} {entry.output}")
+
+    for title, key in (("library", "lib"), ("compiler", "mw_version")):
+        rows = breakdown(compiles, key)
+        if not rows:
+            continue
+        print(f"\nCompile time by {title}:")
+        for name, count, total, longest in rows:
+            print(
+                f"  {format_ms(total):>9}  {name:<24} {count:>5} units,"
+                f" slowest {format_ms(longest)}"
+            )
+
+    if path:
+        print(f"\nCritical path ({format_ms(summary['critical_path'])}):")
+        for edge, entry in path:
+            print(f"  {format_ms(entry.duration):>9}  {edge.rule:<10} {entry.output}")
+
+    if len(history) > 1:
+        print(f"\nHistory (last {min(len(history), 10)} builds):")
+        for item in history[-10:]:
+            when = time.strftime("%Y-%m-%d %H:%M", time.localtime(item["time"]))
+            print(
+                f"  {when}  wall {format_ms(item['wall']):>9}"
+                f"  compile {format_ms(item['compile_total']):>9}"
+                f"  link {format_ms(item['link_total']):>8}"
+                f"  critical {format_ms(item['critical_path']):>9}"
+            )
+
+
+if __name__ == "__main__":
+    main()
@@ -19,10 +19,12 @@ just a helpful utility for build-file-generation systems that already
 use Python.
 """
 
+import hashlib
 import re
 import textwrap
 import os
-from io import StringIO
+import weakref
+from io import TextIOBase
 from pathlib import Path
 from typing import Dict, Iterable, List, Match, Optional, Tuple, Union
 
@@ -35,8 +37,90 @@ def escape_path(word: str) -> str:
     return word.replace("$ ", "$$ ").replace(" ", "$ ").replace(":", "$:")
 
 
+class AtomicFileOutput(TextIOBase):
+    """Streaming text sink for a generated file.
+
+    Text is written to a temporary file next to `path` while a running hash is
+    kept. On close(), the temporary file atomically replaces `path`, unless the
+    existing file has identical contents, in which case it is left untouched.
+    An interrupted generator never leaves a truncated file behind.
+    """
+
+    def __init__(self, path: NinjaPath, encoding: str = "utf-8") -> None:
+        super().__init__()
+        self.path = Path(path)
+        self._encoding = encoding
+        self.tmp_path = self.path.with_name(self.path.name + ".tmp")
+        self.changed = False
+        self._hash = hashlib.sha256()
+        self._file = open(self.tmp_path, "w", encoding=encoding)
+        # Remove the temporary file if we never get to close()
+        self._finalizer = weakref.finalize(self, _remove_file, self.tmp_path)
+
+    @property
+    def encoding(self) -> str:
+        return self._encoding
+
+    def writable(self) -> bool:
+        return True
+
+    def write(self, text: str) -> int:
+        self._hash.update(text.encode(self._encoding))
+        return self._file.write(text)
+
+    def _existing_digest(self) -> Optional[str]:
+        h = hashlib.sha256()
+        try:
+            with open(self.path, "r", encoding=self._encoding) as f:
+                while True:
+                    chunk = f.read(1 << 20)
+                    if not chunk:
+                        break
+                    h.update(chunk.encode(self._encoding))
+        except (FileNotFoundError, UnicodeDecodeError):
+            return None
+        return h.hexdigest()
+
+    def close(self) -> None:
+        if self.closed:
+            return
+        self._file.close()
+        if self._existing_digest() == self._hash.hexdigest():
+            self._finalizer()
+        else:
+            os.replace(self.tmp_path, self.path)
+            self._finalizer.detach()
+            self.changed = True
+        super().close()
+
+    def discard(self) -> None:
+        """Close without replacing the output file."""
+        if self.closed:
+            return
+        self._file.close()
+        self._finalizer()
+        super().close()
+
+    def __del__(self) -> None:
+        # Never commit partial output when garbage collected
+        self.discard()
+
+    def __exit__(self, exc_type, exc_value, traceback) -> None:
+        if exc_type is None:
+            self.close()
+        else:
+            self.discard()
+
+
+def _remove_file(path: Path) -> None:
+    try:
+        os.remove(path)
+    except FileNotFoundError:
+        pass
+
+
 class Writer(object):
-    def __init__(self, output: StringIO, width: int = 78) -> None:
+    def __init__(self, output: TextIOBase, width: int = 78) -> None:
         self.output = output
         self.width = width
 
@@ -10,11 +10,13 @@
 # https://github.com/encounter/dtk-template
 ###
 
-import io
+import hashlib
+import heapq
 import json
 import math
 import os
 import platform
+import re
 import sys
 from pathlib import Path
 from typing import (
@@ -33,7 +35,22 @@ from typing import (
 )
 
 from . import ninja_syntax
+from .ninja_log import format_ms, read_ninja_log
 from .ninja_syntax import serialize_path
+from .dol_verify import verify_dol
+from .splits import check_splits
+
+# Modules of the tools package the generator imports, directly or not. A
+# change to any of them re-runs configure.
+GENERATOR_MODULES = [
+    "ninja_syntax.py",
+    "ninja_log.py",
+    "splits.py",
+    "dol_verify.py",
+    "symbols.py",
+    "demangle.py",
+    "dwarf_index.py",
+]
 
 if sys.platform == "cygwin":
     sys.exit(
@@ -161,6 +178,7 @@ class ProjectConfig:
         self.build_rels: bool = True  # Build REL files
         self.check_sha_path: Optional[Path] = None  # Path to version.sha1
         self.config_path: Optional[Path] = None  # Path to config.yml
+        self.splits_path: Optional[Path] = None  # Path to splits.txt, if not beside it
         self.generate_map: bool = False  # Generate map file(s)
         self.asflags: Optional[List[str]] = None  # Assembler flags
         self.ldflags: Optional[List[str]] = None  # Linker flags
@@ -195,6 +213,53 @@ class ProjectConfig:
         self.link_order_callback: Optional[Callable[[int, List[str]], List[str]]] = (
             None  # Callback to add/remove/reorder units within a module
         )
+        self.compile_cache_dir: Optional[Path] = (
+            None  # MWCC compile result cache directory, disabled if None
+        )
+        self.compile_cache_size: str = "2G"  # Maximum compile cache size (K/M/G suffix)
+        self.warn_link_order: bool = (
+            False  # Report units added or dropped by link_order_callback
+        )
+        self.fingerprint_configure: bool = (
+            True  # Skip regenerating build files when configure inputs are unchanged
+        )
+        self.order_by_cost: bool = (
+            True  # Write compile edges longest-first, using .ninja_log timings
+        )
+        self.print_makespan: bool = (
+            False  # Print the predicted compile makespan when ordering by cost
+        )
+        self.build_jobs: Optional[int] = (
+            None  # Parallel jobs (ninja -j) for pools and makespan, ninja's if None
+        )
+        self.ctx_batch: bool = (
+            False  # Generate all .ctx files from a single batch decompctx edge
+        )
+        self.ctx_conditionals: bool = (
+            False  # Leave out conditional code not compiled with the unit's defines
+        )
+        self.restat_objects: bool = (
+            True  # Keep unchanged objects, skipping the link (needs a compile wrapper)
+        )
+        self.use_pools: bool = (
+            False  # Limit compiles and links with generated ninja pools
+        )
+        self.compile_pool_depth: Optional[int] = (
+            None  # Parallel compiles, sized from build jobs and memory if None
+        )
+        self.compile_memory: Optional[int] = (
+            None  # Estimated MiB per compiler process, by wrapper if None
+        )
+        self.heavy_unit_size: Optional[int] = (
+            None  # Source size (bytes) above which units use the heavy pool
+        )
+        self.heavy_pool_depth: Optional[int] = (
+            None  # Parallel heavy compiles, sized from the compile pool if None
+        )
+        self.link_pool_depth: int = 1  # Parallel link and makerel steps
+        self.check_splits: bool = (
+            False  # Check splits.txt for overlaps and misalignment before configuring
+        )
 
         # Progress output, progress.json and report.json config
         self.progress = True  # Enable report.json generation and CLI progress output
@@ -282,6 +347,42 @@ def is_windows() -> bool:
     return os.name == "nt"
 
 
+# Number of parallel jobs ninja runs by default
+def default_jobs() -> int:
+    cpus = os.cpu_count() or 1
+    return cpus + 2 if cpus > 2 else cpus + 1
+
+
+# Total physical memory in bytes, if it can be determined
+def physical_memory() -> Optional[int]:
+    if is_windows():
+        import ctypes
+
+        class MemoryStatusEx(ctypes.Structure):
+            _fields_ = [
+                ("dwLength", ctypes.c_ulong),
+                ("dwMemoryLoad", ctypes.c_ulong),
+                ("ullTotalPhys", ctypes.c_ulonglong),
+                ("ullAvailPhys", ctypes.c_ulonglong),
+                ("ullTotalPageFile", ctypes.c_ulonglong),
+                ("ullAvailPageFile", ctypes.c_ulonglong),
+                ("ullTotalVirtual", ctypes.c_ulonglong),
+                ("ullAvailVirtual", ctypes.c_ulonglong),
+                ("ullAvailExtendedVirtual", ctypes.c_ulonglong),
+            ]
+
+        status = MemoryStatusEx()
+        status.dwLength = ctypes.sizeof(MemoryStatusEx)
+        kernel32 = ctypes.windll.kernel32  # type: ignore
+        if kernel32.GlobalMemoryStatusEx(ctypes.byref(status)):
+            return status.ullTotalPhys
+        return None
+    try:
+        return os.sysconf("SC_PAGE_SIZE") * os.sysconf("SC_PHYS_PAGES")
+    except (AttributeError, ValueError, OSError):
+        return None
+
+
 # On Windows, we need this to use && in commands
 CHAIN = "cmd /c " if is_windows() else ""
 # Native executable extension
@@ -304,6 +405,64 @@ def file_is_c_cpp(path: Path) -> bool:
     return file_is_c(path) or file_is_cpp(path)
 
 
+# Index of every file below the source (and asm) directories, built with a
+# single os.scandir walk per configure run. Existence checks for objects then
+# become set lookups instead of a stat per path.
+class SourceIndex:
+    def __init__(self, roots: Iterable[Path]) -> None:
+        self.roots: List[str] = []
+        self.files: Set[str] = set()
+        for root in sorted({self._key(r) for r in roots}):
+            # Skip roots nested inside an already scanned root
+            if any(root.startswith(r + os.sep) for r in self.roots):
+                continue
+            self.roots.append(root)
+            self._scan(root)
+        self._fallback: Dict[str, bool] = {}
+
+    # Builds the index for all source and asm directories used by objects
+    @staticmethod
+    def build(config: ProjectConfig, objects: Dict[str, Object]) -> "SourceIndex":
+        roots: Set[Path] = {config.src_dir}
+        for obj in objects.values():
+            roots.add(Path(obj.options["src_dir"]))
+            if obj.options["asm_dir"] is not None:
+                roots.add(Path(obj.options["asm_dir"]))
+        return SourceIndex(roots)
+
+    @staticmethod
+    def _key(path: Union[str, Path]) -> str:
+        return os.path.normcase(os.path.normpath(path))
+
+    def _scan(self, root: str) -> None:
+        stack = [root]
+        while stack:
+            try:
+                it = os.scandir(stack.pop())
+            except (FileNotFoundError, NotADirectoryError):
+                continue
+            with it:
+                for entry in it:
+                    if entry.is_dir():
+                        stack.append(entry.path)
+                    elif entry.is_file():
+                        self.files.add(self._key(entry.path))
+
+    def exists(self, path: Optional[Path]) -> bool:
+        if path is None:
+            return False
+        key = self._key(path)
+        if key in self.files:
+            return True
+        if any(key.startswith(r + os.sep) for r in self.roots):
+            return False
+        # Outside of the indexed directories, fall back to a (cached) stat
+        exists = self._fallback.get(key)
+        if exists is None:
+            exists = self._fallback[key] = path.is_file()
+        return exists
+
+
 def make_flags_str(flags: Optional[List[str]]) -> str:
     if flags is None:
         return ""
@@ -370,41 +529,349 @@ def load_build_config(
     if config.link_order_callback:
         modules: List[BuildConfigModule] = [build_config, *build_config["modules"]]
         for module in modules:
-            unit_names = list(map(lambda u: u["name"], module["units"]))
-            unit_names = config.link_order_callback(module["module_id"], unit_names)
-            units: List[BuildConfigUnit] = []
-            for unit_name in unit_names:
-                units.append(
-                    # Find existing unit or create a new one
-                    next(
-                        (u for u in module["units"] if u["name"] == unit_name),
-                        {"object": None, "name": unit_name, "autogenerated": False},
-                    )
-                )
-            module["units"] = units
+            apply_link_order(config, module)
 
     return build_config
 
 
+# Rebuild a module's unit list in the order returned by the link order callback.
+# Units are indexed by name once, keeping this linear in the module size.
+def apply_link_order(config: ProjectConfig, module: BuildConfigModule) -> None:
+    if config.link_order_callback is None:
+        return
+
+    units_by_name: Dict[str, BuildConfigUnit] = {}
+    for unit in module["units"]:
+        units_by_name.setdefault(unit["name"], unit)
+
+    unit_names = [u["name"] for u in module["units"]]
+    unit_names = config.link_order_callback(module["module_id"], unit_names)
+
+    units: List[BuildConfigUnit] = []
+    seen: Set[str] = set()
+    duplicated: List[str] = []
+    invented: List[str] = []
+    for unit_name in unit_names:
+        if unit_name in seen:
+            duplicated.append(unit_name)
+        seen.add(unit_name)
+        # Find existing unit or create a new one
+        existing_unit = units_by_name.get(unit_name)
+        if existing_unit is None:
+            existing_unit = units_by_name[unit_name] = {
+                "object": None,
+                "name": unit_name,
+                "autogenerated": False,
+            }
+            invented.append(unit_name)
+        units.append(existing_unit)
+    dropped = [name for name in units_by_name if name not in seen]
+    module["units"] = units
+
+    # Report the differences in a single pass
+    def report(kind: str, names: List[str]) -> None:
+        print(
+            f"Link order callback {kind} {len(names)} unit(s) in {module['name']}: "
+            + ", ".join(names)
+        )
+
+    if duplicated:
+        report("duplicated", duplicated)
+    if config.warn_link_order:
+        if dropped:
+            report("dropped", dropped)
+        if invented:
+            report("added", invented)
+
+
+# Gets the path of the subninja file holding a library's build statements
+def lib_ninja_path(config: ProjectConfig, lib_name: str) -> Path:
+    file_name = re.sub(r"[^A-Za-z0-9_.-]", "_", lib_name)
+    if file_name != lib_name:
+        # Keep names that sanitize alike (e.g. "a b" and "a/b") apart
+        digest = hashlib.sha1(lib_name.encode("utf-8")).hexdigest()[:8]
+        file_name = f"{file_name}-{digest}"
+    return config.out_path() / "ninja" / f"{file_name}.ninja"
+
+
+# Write a file only if its contents differ, leaving an identical file
+# (and its mtime) untouched. Returns whether the file was written.
+def write_if_changed(path: Union[str, Path], contents: str) -> bool:
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            if f.read() == contents:
+                return False
+    except (FileNotFoundError, UnicodeDecodeError):
+        pass
+    with open(path, "w", encoding="utf-8") as f:
+        f.write(contents)
+    return True
+
+
+# Compute a fingerprint of every input that affects the generated build files:
+# arguments, project settings, resolved object options, existing source files,
+# the (link-order adjusted) config.json and the generator itself.
+def configure_fingerprint(
+    config: ProjectConfig,
+    objects: Dict[str, Object],
+    build_config: Optional[BuildConfig],
+    sources: SourceIndex,
+    costs: Optional["CompileCosts"] = None,
+) -> str:
+    h = hashlib.sha256()
+
+    def default(o: Any) -> Any:
+        if isinstance(o, Path):
+            return o.as_posix()
+        if callable(o):
+            return getattr(o, "__qualname__", type(o).__name__)
+        if hasattr(o, "__dict__"):
+            return vars(o)
+        return str(o)
+
+    def update(value: Any) -> None:
+        h.update(json.dumps(value, sort_keys=True, default=default).encode("utf-8"))
+        h.update(b"\n")
+
+    update([sys.executable, *sys.argv])
+    update({k: v for k, v in vars(config).items() if k != "libs"})
+    update({k: [obj.completed, obj.options] for k, obj in objects.items()})
+    update(build_config)
+
+    existing_paths: List[Path] = []
+    for obj in objects.values():
+        for path in (obj.src_path, obj.asm_path):
+            if path is not None and sources.exists(path):
+                existing_paths.append(path)
+    update(sorted(existing_paths))
+    if costs is not None:
+        # Only changes to the (quantized) costs reorder the build files
+        update(costs.buckets())
+    if config.use_pools:
+        update(pool_depths(config))
+
+    tools_dir = Path(__file__).parent
+    generator_files = [tools_dir / name for name in GENERATOR_MODULES]
+    for generator_file in (Path(__file__), *generator_files):
+        with open(generator_file, "rb") as f:
+            h.update(f.read())
+
+    return h.hexdigest()
+
+
+# Expected compile time (in ms) of each object, taken from its last recorded
+# build in .ninja_log. Objects without history are estimated from the source
+# size, scaled by the average time per byte of the measured objects.
+class CompileCosts:
+    # Costs within ~19% of each other share a bucket, so that normal timing
+    # noise doesn't reorder (and rewrite) the build files
+    BUCKETS_PER_DOUBLING = 4
+    # Estimated compile time per source byte when nothing was measured yet
+    DEFAULT_MS_PER_BYTE = 0.01
+
+    def __init__(
+        self,
+        config: ProjectConfig,
+        objects: Dict[str, Object],
+        sources: SourceIndex,
+        log_path: Path = Path(".ninja_log"),
+    ) -> None:
+        self.config = config
+        self.ms: Dict[str, float] = {}
+        self.measured = 0
+        self.last_makespan: Optional[int] = None
+
+        builds = read_ninja_log(str(log_path)) if log_path.is_file() else []
+        durations: Dict[str, int] = {}
+        for build in builds:
+            for entry in build:
+                durations[entry.output] = entry.duration
+
+        src_paths: Dict[str, Path] = {}
+        for obj in objects.values():
+            for src_path, obj_path in (
+                (obj.src_path, obj.src_obj_path),
+                (obj.asm_path, obj.asm_obj_path),
+            ):
+                if src_path is not None and obj_path is not None:
+                    if sources.exists(src_path):
+                        src_paths[obj_path.as_posix()] = src_path
+
+        def source_size(key: str) -> int:
+            try:
+                return os.path.getsize(src_paths[key])
+            except OSError:
+                return 0
+
+        unmeasured: List[str] = []
+        for key in src_paths:
+            if key in durations:
+                self.ms[key] = durations[key]
+                self.measured += 1
+            else:
+                unmeasured.append(key)
+        if unmeasured:
+            ms_per_byte = self.DEFAULT_MS_PER_BYTE
+            measured_bytes = sum(source_size(key) for key in self.ms)
+            if measured_bytes > 0:
+                ms_per_byte = sum(self.ms.values()) / measured_bytes
+            for key in unmeasured:
+                self.ms[key] = source_size(key) * ms_per_byte
+
+        # Compile span of the last build that compiled (nearly) everything
+        compile_outputs = set(self.ms)
+        for build in reversed(builds):
+            entries = [e for e in build if e.output in compile_outputs]
+            if len(entries) >= len(compile_outputs) * 0.9:
+                self.last_makespan = max(e.end for e in entries) - min(
+                    e.start for e in entries
+                )
+                break
+
+    def bucket(self, obj_path: Path) -> int:
+        ms = self.ms.get(obj_path.as_posix(), 0.0)
+        return int(round(math.log2(max(ms, 1.0)) * self.BUCKETS_PER_DOUBLING))
+
+    def buckets(self) -> Dict[str, int]:
+        return {key: self.bucket(Path(key)) for key in self.ms}
+
+    # Number of parallel compiles, matching ninja's default and the pools
+    def jobs(self) -> int:
+        jobs = self.config.build_jobs
+        if jobs is None:
+            jobs = default_jobs()
+        if self.config.use_pools:
+            jobs = min(jobs, sum(pool_depths(self.config)))
+        return jobs
+
+    # Simulates starting the compiles in the given order on the available jobs
+    def predict_makespan(self, obj_paths: List[Path]) -> float:
+        workers = [0.0] * self.jobs()
+        for obj_path in obj_paths:
+            start = heapq.heappop(workers)
+            heapq.heappush(workers, start + self.ms.get(obj_path.as_posix(), 0.0))
+        return max(workers, default=0.0)
+
+    def report(self, obj_paths: List[Path]) -> None:
+        predicted = self.predict_makespan(obj_paths)
+        if self.measured == 0:
+            source = "estimated from source sizes"
+        else:
+            source = f"{self.measured}/{len(self.ms)} units timed"
+        line = (
+            f"Compile makespan: predicted {format_ms(predicted)} on {self.jobs()} jobs"
+            f" ({source})"
+        )
+        if self.last_makespan is not None:
+            line += f", last full build {format_ms(self.last_makespan)}"
+        print(line)
+
+
+# Fraction of physical memory that compiles may use
+POOL_MEMORY_FRACTION = 0.75
+# Heavy units are assumed to need this many times the memory of other units
+HEAVY_MEMORY_FACTOR = 4
+
+
+# Sizes the compile and heavy compile pools as (compile depth, heavy depth).
+# Compiles are limited to the build's job count (ninja's default unless given),
+# and to the number of compiler processes that fit in memory after reserving
+# room for the heavy pool. Explicit depths in the config take precedence.
+def pool_depths(config: ProjectConfig) -> Tuple[int, int]:
+    jobs = config.build_jobs
+    if jobs is None:
+        jobs = default_jobs()
+    memory = config.compile_memory
+    if memory is None:
+        if config.use_wibo():
+            memory = 128
+        elif is_windows():
+            memory = 96
+        else:
+            memory = 320  # Wine
+    heavy_memory = memory * HEAVY_MEMORY_FACTOR
+
+    total = physical_memory()
+    budget = int(total * POOL_MEMORY_FRACTION) // (1024 * 1024) if total else None
+
+    heavy = config.heavy_pool_depth
+    if heavy is None:
+        heavy = max(1, jobs // 4)
+        if budget is not None:
+            # Heavy compiles may take at most half of the budget
+            heavy = min(heavy, max(1, budget // 2 // heavy_memory))
+    compile = config.compile_pool_depth
+    if compile is None:
+        compile = jobs
+        if budget is not None:
+            compile = min(compile, max(1, (budget - heavy * heavy_memory) // memory))
+    return compile, heavy
+
+
 # Generate build.ninja, objdiff.json and compile_commands.json
 def generate_build(config: ProjectConfig) -> None:
     config.validate()
+    if config.check_splits:
+        assert config.config_path is not None
+        splits_path = config.splits_path or config.config_path.parent / "splits.txt"
+        check_splits(str(splits_path))
     objects = config.objects()
     build_config = load_build_config(config, config.out_path() / "config.json")
-    generate_build_ninja(config, objects, build_config)
-    generate_objdiff_config(config, objects, build_config)
+    sources = SourceIndex.build(config, objects)
+    # The heavy pool holds back exactly the units that ordering starts first
+    costs: Optional[CompileCosts] = None
+    heavy_pool = config.use_pools and config.heavy_unit_size is not None
+    if config.order_by_cost and not heavy_pool and build_config is not None:
+        costs = CompileCosts(config, objects, sources)
+
+    fingerprint: Optional[str] = None
+    fingerprint_path = config.out_path() / "configure.fingerprint"
+    if config.fingerprint_configure:
+        fingerprint = configure_fingerprint(
+            config, objects, build_config, sources, costs
+        )
+        outputs = [Path("build.ninja")]
+        if build_config is not None:
+            if costs is None:
+                outputs.extend(
+                    lib_ninja_path(config, lib["lib"]) for lib in config.libs or []
+                )
+            outputs.append(Path("objdiff.json"))
+            if config.generate_compile_commands:
+                outputs.append(Path("compile_commands.json"))
+        if (
+            fingerprint_path.is_file()
+            and fingerprint_path.read_text(encoding="utf-8").strip() == fingerprint
+            and all(output.is_file() for output in outputs)
+        ):
+            # Nothing relevant changed, keep the existing build files
+            return
+
+    generate_build_ninja(config, objects, build_config, sources, costs)
+    generate_objdiff_config(config, objects, build_config, sources)
     generate_compile_commands(config, objects, build_config)
 
+    if fingerprint is not None:
+        fingerprint_path.parent.mkdir(parents=True, exist_ok=True)
+        write_if_changed(fingerprint_path, fingerprint + "\n")
+
 
 # Generate build.ninja
 def generate_build_ninja(
     config: ProjectConfig,
     objects: Dict[str, Object],
     build_config: Optional[BuildConfig],
+    sources: Optional[SourceIndex] = None,
+    costs: Optional["CompileCosts"] = None,
 ) -> None:
-    out = io.StringIO()
+    if sources is None:
+        sources = SourceIndex.build(config, objects)
+
+    # Streamed to a temporary file, replacing build.ninja only if it changed
+    out = ninja_syntax.AtomicFileOutput("build.ninja")
     n = ninja_syntax.Writer(out)
-    n.variable("ninja_required_version", "1.3")
+    # The batch context edge has a depfile for many outputs, needing 1.10
+    n.variable("ninja_required_version", "1.10" if config.ctx_batch else "1.3")
     n.newline()
 
     configure_script = Path(os.path.relpath(os.path.abspath(sys.argv[0])))
@@ -442,13 +909,23 @@ def generate_build_ninja(
     )
 
     decompctx = config.tools_dir / "decompctx.py"
+    ctx_args = " --conditionals $defines" if config.ctx_conditionals else ""
     n.rule(
         name="decompctx",
-        command=f"$python {decompctx} $in -o $out -d $out.d $includes",
+        command=f"$python {decompctx} $in -o $out -d $out.d $includes{ctx_args}",
         description="CTX $in",
         depfile="$out.d",
         deps="gcc",
     )
+    if config.ctx_batch:
+        ctx_args = " --conditionals" if config.ctx_conditionals else ""
+        n.rule(
+            name="decompctx_batch",
+            command=f"$python {decompctx} --batch $in -d $depfile{ctx_args}",
+            description="CTX (batch) $in",
+            depfile="$depfile",
+            deps="gcc",
+        )
 
     cargo_rule_written = False
 
@@ -628,18 +1105,64 @@ def generate_build_ninja(
     )
     gnu_as_implicit = [binutils_implicit or gnu_as, dtk]
 
-    if os.name != "nt":
-        transform_dep = config.tools_dir / "transform_dep.py"
-        mwcc_cmd += f" && $python {transform_dep} $basefile.d $basefile.d"
-        mwcc_sjis_cmd += f" && $python {transform_dep} $basefile.d $basefile.d"
+    transform_dep = config.tools_dir / "transform_dep.py"
+    # Depfiles are transformed by the outermost compile wrapper, if any
+    use_transform_dep = os.name != "nt"
+    # Objects rebuilt unchanged keep their mtime, so restat can skip linking and
+    # everything after it. The wrappers do this, so without one (on Windows
+    # without the compile cache) no Python process is added to each compile.
+    use_restat = config.restat_objects and (
+        use_transform_dep or config.compile_cache_dir is not None
+    )
+    if config.compile_cache_dir is not None:
+        # Route compiles through the compile result cache
+        mwcc_cache = config.tools_dir / "mwcc_cache.py"
+        cache_cmd = (
+            f"$python {mwcc_cache} compile --dir {config.compile_cache_dir}"
+            f" --max-size {config.compile_cache_size} --key $mw_version"
+        )
+        if use_transform_dep:
+            cache_cmd += " --transform-dep"
+        if use_restat:
+            cache_cmd += " --keep-unchanged"
+        cache_args = "-o $out -d $basefile.d --"
+        mwcc_cmd = f"{cache_cmd} --key mwcc {cache_args} {mwcc_cmd}"
+        mwcc_sjis_cmd = f"{cache_cmd} --key sjis {cache_args} {mwcc_sjis_cmd}"
+        mwcc_implicit.append(mwcc_cache)
+        mwcc_sjis_implicit.append(mwcc_cache)
+    elif use_transform_dep:
+        transform_cmd = f"$python {transform_dep} $basefile.d $basefile.d"
+        if use_restat:
+            transform_cmd += " --keep-unchanged $out"
+        mwcc_cmd += f" && {transform_cmd}"
+        mwcc_sjis_cmd += f" && {transform_cmd}"
+    if use_transform_dep or config.compile_cache_dir is not None:
         mwcc_implicit.append(transform_dep)
         mwcc_sjis_implicit.append(transform_dep)
 
+    # Resource pools, limiting parallel compiles by available memory
+    # and keeping links from competing with each other
+    compile_pool: Optional[str] = None
+    heavy_pool: Optional[str] = None
+    link_pool: Optional[str] = None
+    if config.use_pools:
+        compile_depth, heavy_depth = pool_depths(config)
+        n.comment("Resource pools")
+        compile_pool = "compile_pool"
+        n.pool(compile_pool, compile_depth)
+        if config.heavy_unit_size is not None:
+            heavy_pool = "heavy_pool"
+            n.pool(heavy_pool, heavy_depth)
+        link_pool = "link_pool"
+        n.pool(link_pool, config.link_pool_depth)
+        n.newline()
+
     n.comment("Link ELF file")
     n.rule(
         name="link",
         command=mwld_cmd,
         description="LINK $out",
+        pool=link_pool,
         rspfile="$out.rsp",
         rspfile_content="$in_newline",
     )
@@ -660,6 +1183,8 @@ def generate_build_ninja(
         description="MWCC $out",
         depfile="$basefile.d",
         deps="gcc",
+        pool=compile_pool,
+        restat=use_restat,
     )
     n.newline()
 
@@ -670,6 +1195,8 @@ def generate_build_ninja(
         description="MWCC $out",
         depfile="$basefile.d",
         deps="gcc",
+        pool=compile_pool,
+        restat=use_restat,
     )
     n.newline()
 
@@ -844,6 +1371,7 @@ def generate_build_ninja(
             n.newline()
 
     link_outputs: List[Path] = []
+    lib_outputs: Dict[str, ninja_syntax.AtomicFileOutput] = {}
     if build_config:
         link_steps: List[LinkStep] = []
         used_compiler_versions: Set[str] = set()
@@ -851,6 +1379,68 @@ def generate_build_ninja(
         host_source_inputs: List[Path] = []
         source_added: Set[Path] = set()
 
+        # Build statements for each library are written to their own subninja
+        # file, and each file is only replaced when its contents change. When
+        # ordering by cost, they're all written to build.ninja instead, as the
+        # order only holds within a file.
+        lib_writers: Dict[str, ninja_syntax.Writer] = {}
+        split_libs = costs is None
+        for lib in config.libs or [] if split_libs else []:
+            lib_path = lib_ninja_path(config, lib["lib"])
+            if str(lib_path) in lib_outputs:
+                continue
+            lib_path.parent.mkdir(parents=True, exist_ok=True)
+            lib_out = ninja_syntax.AtomicFileOutput(lib_path)
+            lib_n = ninja_syntax.Writer(lib_out)
+            lib_n.comment(f"Library {lib['lib']}")
+            lib_n.newline()
+            lib_outputs[str(lib_path)] = lib_out
+            lib_writers[lib["lib"]] = lib_n
+
+        def lib_writer(lib_name: Optional[str]) -> ninja_syntax.Writer:
+            if lib_name is None or not split_libs:
+                return n
+            return lib_writers[lib_name]
+
+        # Identical flag sets (shared by most objects in a library) are written
+        # once as top-level variables and referenced from each build statement
+        shared_variables: Dict[ninja_syntax.Writer, Dict[Tuple[str, str], str]] = {}
+
+        def shared_variable(
+            w: ninja_syntax.Writer, prefix: str, lib_name: Optional[str], value: str
+        ) -> str:
+            variables = shared_variables.setdefault(w, {})
+            name = variables.get((prefix, value))
+            if name is None:
+                base_name = re.sub(r"[^A-Za-z0-9_]", "_", f"{prefix}_{lib_name}")
+                name = base_name
+                names = set(variables.values())
+                idx = 2
+                while name in names:
+                    name = f"{base_name}_{idx}"
+                    idx += 1
+                variables[(prefix, value)] = name
+                w.variable(name, value)
+            return f"${name}"
+
+        # Compile statements are collected first, then written longest-first
+        # (by expected compile time) since ninja starts ready edges roughly in
+        # manifest order. Without costs, link order is kept.
+        ctx_units: List[Dict[str, Any]] = []
+        compile_steps: List[
+            Tuple[int, int, Path, Optional[str], Callable[[ninja_syntax.Writer], None]]
+        ] = []
+
+        def add_compile_step(
+            lib_name: Optional[str],
+            obj_path: Path,
+            write: Callable[[ninja_syntax.Writer], None],
+        ) -> None:
+            bucket = costs.bucket(obj_path) if costs is not None else 0
+            compile_steps.append(
+                (-bucket, len(compile_steps), obj_path, lib_name, write)
+            )
+
         def c_build(obj: Object, src_path: Path) -> Optional[Path]:
             # Avoid creating duplicate build rules
             if obj.src_obj_path is None or obj.src_obj_path in source_added:
@@ -877,60 +1467,119 @@ def generate_build_ninja(
             cflags_str = make_flags_str(all_cflags)
             used_compiler_versions.add(obj.options["mw_version"])
 
-            # Add MWCC build rule
             lib_name = obj.options["lib"]
-            n.comment(f"{obj.name}: {lib_name} (linked {obj.completed})")
-            n.build(
-                outputs=obj.src_obj_path,
-                rule="mwcc_sjis" if obj.options["shift_jis"] else "mwcc",
-                inputs=src_path,
-                variables={
-                    "mw_version": Path(obj.options["mw_version"]),
-                    "cflags": cflags_str,
-                    "basedir": os.path.dirname(obj.src_obj_path),
-                    "basefile": obj.src_obj_path.with_suffix(""),
-                },
-                implicit=(
-                    mwcc_sjis_implicit if obj.options["shift_jis"] else mwcc_implicit
-                ),
-                order_only="pre-compile",
-            )
 
-            # Add ctx build rule
+            include_dirs: List[str] = []
+            defines: List[str] = []
+            undefines: List[str] = []
+            lang = "c++" if file_is_cpp(src_path) else "c"
+            for flag in all_cflags:
+                if (
+                    flag.startswith("-i ")
+                    or flag.startswith("-I ")
+                    or flag.startswith("-I+")
+                ):
+                    include_dirs.append(flag[3:])
+                elif flag in ("-I-", "-i-"):
+                    # Splits user and system include paths
+                    include_dirs.append("-")
+                elif flag.startswith(("-D+", "-D ", "-d ", "-U+", "-U ")):
+                    (defines if flag[1] in "Dd" else undefines).append(flag[3:])
+                elif flag.startswith(("-D", "-U")):
+                    (defines if flag[1] == "D" else undefines).append(flag[2:])
+                elif flag.startswith("-lang"):
+                    value = flag[len("-lang") :].lstrip("= ").lower()
+                    lang = "c++" if value in ("c++", "cplus", "ec++") else "c"
             if obj.ctx_path is not None:
-                include_dirs = []
-                for flag in all_cflags:
-                    if (
-                        flag.startswith("-i ")
-                        or flag.startswith("-I ")
-                        or flag.startswith("-I+")
-                    ):
-                        include_dirs.append(flag[3:])
-                includes = " ".join([f"-I {d}" for d in include_dirs])
-                n.build(
-                    outputs=obj.ctx_path,
-                    rule="decompctx",
-                    inputs=src_path,
-                    implicit=decompctx,
-                    variables={"includes": includes},
-                )
-
-            # Add host build rule
-            if obj.options["host"] and obj.host_obj_path is not None:
-                n.build(
-                    outputs=obj.host_obj_path,
-                    rule="host_cc" if file_is_c(src_path) else "host_cpp",
+                ctx_unit: Dict[str, Any] = {
+                    "source": src_path.as_posix(),
+                    "output": obj.ctx_path.as_posix(),
+                    "depfile": f"{obj.ctx_path.as_posix()}.d",
+                    "includes": include_dirs,
+                }
+                if config.ctx_conditionals:
+                    ctx_unit["defines"] = defines
+                    ctx_unit["undefines"] = undefines
+                    ctx_unit["lang"] = lang
+                ctx_units.append(ctx_unit)
+
+            # Units with large sources compile in their own, smaller pool
+            pool: Optional[str] = None
+            if heavy_pool is not None and config.heavy_unit_size is not None:
+                try:
+                    if os.path.getsize(src_path) > config.heavy_unit_size:
+                        pool = heavy_pool
+                except OSError:
+                    pass
+
+            def write(w: ninja_syntax.Writer) -> None:
+                # Add MWCC build rule
+                cflags_var = shared_variable(w, "cflags", lib_name, cflags_str)
+                w.comment(f"{obj.name}: {lib_name} (linked {obj.completed})")
+                w.build(
+                    outputs=obj.src_obj_path,
+                    rule="mwcc_sjis" if obj.options["shift_jis"] else "mwcc",
                     inputs=src_path,
                     variables={
-                        "basedir": os.path.dirname(obj.host_obj_path),
-                        "basefile": obj.host_obj_path.with_suffix(""),
+                        "mw_version": Path(obj.options["mw_version"]),
+                        "cflags": cflags_var,
+                        "basedir": os.path.dirname(obj.src_obj_path),
+                        "basefile": obj.src_obj_path.with_suffix(""),
                     },
+                    implicit=(
+                        mwcc_sjis_implicit
+                        if obj.options["shift_jis"]
+                        else mwcc_implicit
+                    ),
                     order_only="pre-compile",
+                    pool=pool,
                 )
-                if obj.options["add_to_all"]:
-                    host_source_inputs.append(obj.host_obj_path)
-            n.newline()
 
+                # Add ctx build rule
+                if obj.ctx_path is not None and not config.ctx_batch:
+                    includes = " ".join([f"-I {d}" for d in include_dirs])
+                    ctx_variables = {
+                        "includes": shared_variable(w, "includes", lib_name, includes)
+                    }
+                    if config.ctx_conditionals:
+                        ctx_defines = " ".join(
+                            [f"--lang {lang}"]
+                            + [f"-D {d}" for d in defines]
+                            + [f"-U {u}" for u in undefines]
+                        )
+                        ctx_variables["defines"] = shared_variable(
+                            w, "defines", lib_name, ctx_defines
+                        )
+                    w.build(
+                        outputs=obj.ctx_path,
+                        rule="decompctx",
+                        inputs=src_path,
+                        implicit=decompctx,
+                        variables=ctx_variables,
+                    )
+
+                # Add host build rule
+                if obj.options["host"] and obj.host_obj_path is not None:
+                    w.build(
+                        outputs=obj.host_obj_path,
+                        rule="host_cc" if file_is_c(src_path) else "host_cpp",
+                        inputs=src_path,
+                        variables={
+                            "basedir": os.path.dirname(obj.host_obj_path),
+                            "basefile": obj.host_obj_path.with_suffix(""),
+                        },
+                        order_only="pre-compile",
+                    )
+                w.newline()
+
+            add_compile_step(lib_name, obj.src_obj_path, write)
+
+            if (
+                obj.options["host"]
+                and obj.host_obj_path is not None
+                and obj.options["add_to_all"]
+            ):
+                host_source_inputs.append(obj.host_obj_path)
             if obj.options["add_to_all"]:
                 source_inputs.append(obj.src_obj_path)
 
@@ -953,16 +1602,20 @@ def generate_build_ninja(
 
             # Add assembler build rule
             lib_name = obj.options["lib"]
-            n.comment(f"{obj.name}: {lib_name} (linked {obj.completed})")
-            n.build(
-                outputs=obj_path,
-                rule="as",
-                inputs=src_path,
-                variables={"asflags": asflags_str},
-                implicit=gnu_as_implicit,
-                order_only="pre-compile",
-            )
-            n.newline()
+
+            def write(w: ninja_syntax.Writer) -> None:
+                w.comment(f"{obj.name}: {lib_name} (linked {obj.completed})")
+                w.build(
+                    outputs=obj_path,
+                    rule="as",
+                    inputs=src_path,
+                    variables={"asflags": asflags_str},
+                    implicit=gnu_as_implicit,
+                    order_only="pre-compile",
+                )
+                w.newline()
+
+            add_compile_step(lib_name, obj_path, write)
 
             if obj.options["add_to_all"]:
                 source_inputs.append(obj_path)
@@ -981,7 +1634,7 @@ def generate_build_ninja(
 
             link_built_obj = obj.completed
             built_obj_path: Optional[Path] = None
-            if obj.src_path is not None and obj.src_path.exists():
+            if obj.src_path is not None and sources.exists(obj.src_path):
                 if file_is_c_cpp(obj.src_path):
                     # Add MWCC & host build rules
                     built_obj_path = c_build(obj, obj.src_path)
@@ -996,7 +1649,7 @@ def generate_build_ninja(
                 link_built_obj = False
 
             # Assembly overrides
-            if obj.asm_path is not None and obj.asm_path.exists():
+            if obj.asm_path is not None and sources.exists(obj.asm_path):
                 link_built_obj = True
                 built_obj_path = asm_build(obj, obj.asm_path, obj.asm_obj_path)
 
@@ -1032,8 +1685,28 @@ def generate_build_ninja(
                         module_link_step,
                     )
                 link_steps.append(module_link_step)
+
+        # Write compile statements
+        compile_steps.sort(key=lambda step: step[:2])
+        for _, _, _, lib_name, write in compile_steps:
+            write(lib_writer(lib_name))
+        if costs is not None and config.print_makespan:
+            costs.report([step[2] for step in compile_steps])
         n.newline()
 
+        # Include library build files
+        if lib_outputs:
+            n.comment("Library build files")
+            for lib_path, lib_out in lib_outputs.items():
+                lib_out.close()
+                n.subninja(lib_path)
+            n.newline()
+
+        # Remove build files of libraries that no longer exist
+        for stale_path in (build_path / "ninja").glob("*.ninja"):
+            if str(stale_path) not in lib_outputs:
+                stale_path.unlink()
+
         # Check if all compiler versions exist
         for mw_version in used_compiler_versions:
             mw_path = compilers / mw_version / "mwcceppc.exe"
@@ -1081,6 +1754,7 @@ def generate_build_ninja(
             name="makerel",
             command=f"{dtk} rel make {flags} -c $config $names @$rspfile",
             description="REL",
+            pool=link_pool,
             rspfile="$rspfile",
             rspfile_content="$in_newline",
         )
@@ -1147,6 +1821,32 @@ def generate_build_ninja(
         )
         n.newline()
 
+        ###
+        # Helper rule for building all context files
+        ###
+        ctx_outputs = [Path(unit["output"]) for unit in ctx_units]
+        if config.ctx_batch and ctx_units:
+            # Generate every context file with a single decompctx invocation
+            ctx_list_path = build_path / "ctx.json"
+            write_if_changed(ctx_list_path, json.dumps(ctx_units, indent=2) + "\n")
+            n.comment("Generate all context files")
+            n.build(
+                outputs=ctx_outputs,
+                rule="decompctx_batch",
+                inputs=ctx_list_path,
+                implicit=[decompctx, *[Path(unit["source"]) for unit in ctx_units]],
+                variables={"depfile": build_path / "ctx.d"},
+            )
+            n.newline()
+
+        n.comment("Build all context files")
+        n.build(
+            outputs="ctx",
+            rule="phony",
+            inputs=ctx_outputs,
+        )
+        n.newline()
+
         ###
         # Helper rule for building all source files, with a host compiler
         ###
@@ -1288,15 +1988,18 @@ def generate_build_ninja(
         command=f"$python {configure_script} $configure_args",
         generator=True,
         description=f"RUN {configure_script}",
+        # Unchanged build files are left untouched, avoiding a manifest reload
+        restat=True,
     )
     n.build(
         outputs="build.ninja",
         rule="configure",
+        implicit_outputs=list(lib_outputs.keys()),
         implicit=[
             build_config_path,
             configure_script,
             python_lib,
-            python_lib_dir / "ninja_syntax.py",
+            *(python_lib_dir / name for name in GENERATOR_MODULES),
             *(config.reconfig_deps or []),
         ],
     )
@@ -1317,9 +2020,11 @@ def generate_build_ninja(
         n.default(build_config_path)
 
     # Write build.ninja
-    with open("build.ninja", "w", encoding="utf-8") as f:
-        f.write(out.getvalue())
-    out.close()
+    n.close()
+
+    # Ninja only reloads the manifest when build.ninja itself is updated
+    if not out.changed and any(o.changed for o in lib_outputs.values()):
+        os.utime("build.ninja")
 
 
 # Generate objdiff.json
@@ -1327,9 +2032,12 @@ def generate_objdiff_config(
     config: ProjectConfig,
     objects: Dict[str, Object],
     build_config: Optional[BuildConfig],
+    sources: Optional[SourceIndex] = None,
 ) -> None:
     if build_config is None:
         return
+    if sources is None:
+        sources = SourceIndex.build(config, objects)
 
     # Load existing objdiff.json
     existing_units = {}
@@ -1421,7 +2129,7 @@ def generate_objdiff_config(
             objdiff_config["units"].append(unit_config)
             return
 
-        src_exists = obj.src_path is not None and obj.src_path.exists()
+        src_exists = sources.exists(obj.src_path)
         if src_exists:
             unit_config["base_path"] = obj.src_obj_path
             unit_config["metadata"]["source_path"] = obj.src_path
@@ -1528,12 +2236,13 @@ def generate_objdiff_config(
             return d
 
     # Write objdiff.json
-    with open("objdiff.json", "w", encoding="utf-8") as w:
-
-        def unix_path(input: Any) -> str:
-            return str(input).replace(os.sep, "/") if input else ""
+    def unix_path(input: Any) -> str:
+        return str(input).replace(os.sep, "/") if input else ""
 
-        json.dump(cleandict(objdiff_config), w, indent=2, default=unix_path)
+    write_if_changed(
+        "objdiff.json",
+        json.dumps(cleandict(objdiff_config), indent=2, default=unix_path),
+    )
 
 
 def generate_compile_commands(
@@ -1739,14 +2448,44 @@ def generate_compile_commands(
             add_unit(unit)
 
     # Write compile_commands.json
-    with open("compile_commands.json", "w", encoding="utf-8") as w:
+    def default_format(o):
+        if isinstance(o, Path):
+            return o.resolve().as_posix()
+        return str(o)
+
+    write_if_changed(
+        "compile_commands.json",
+        json.dumps(clangd_config, indent=2, default=default_format),
+    )
 
-        def default_format(o):
-            if isinstance(o, Path):
-                return o.resolve().as_posix()
-            return str(o)
 
-        json.dump(clangd_config, w, indent=2, default=default_format)
+# Compare the sections of the built DOL with the original, mapping the first
+# differences to symbols and units
+def verify_build(config: ProjectConfig, limit: int = 10) -> None:
+    config.validate()
+    assert config.config_path is not None
+    built_path = config.out_path() / "main.dol"
+    if not built_path.is_file():
+        sys.exit(f"{built_path} does not exist, build it first")
+    orig_path: Optional[Path] = None
+    with open(config.config_path, "r", encoding="utf-8") as f:
+        for line in f:
+            if line.startswith("object:"):
+                orig_path = Path(line.split(":", 1)[1].strip())
+                break
+    if orig_path is None or not orig_path.is_file():
+        sys.exit(f"Original DOL not found, check object in {config.config_path}")
+    config_dir = config.config_path.parent
+    splits_path = config.splits_path or config_dir / "splits.txt"
+    symbols_path = config_dir / "symbols.txt"
+    if not verify_dol(
+        str(built_path),
+        str(orig_path),
+        str(symbols_path) if symbols_path.is_file() else None,
+        str(splits_path) if splits_path.is_file() else None,
+        limit,
+    ):
+        sys.exit(1)
 
 
 # Calculate, print and write progress to progress.json
@@ -0,0 +1,423 @@
+#!/usr/bin/env python3
+
+###
+# Matches the functions in symbols.txt with the functions in the DWARF dumps
+# of another SKU, so any GameCube function can be looked up in the dumps.
+#
+# Functions are joined by hashing, in three passes over the ones still
+# unmatched:
+#   mangled    identical mangled names
+#   signature  mangled names equal after normalizing platform differences
+#              (long and long long as int, template return types)
+#   name       the same qualified name, with any arguments
+# Functions sharing a key are paired by how close their size ratio is to the
+# median ratio of the mangled matches, which also scales the confidence.
+#
+# The table is stored in the DWARF index database and rebuilt when
+# symbols.txt or the dumps change.
+#
+# Usage:
+#   python3 tools/sku_match.py
+#   python3 tools/sku_match.py lookup zMusicGetCurrentVolume__FUi
+#   python3 tools/sku_match.py lookup 0x800D5BA0 --lines
+###
+
+import argparse
+import math
+import os
+import sqlite3
+import sys
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+try:
+    from .dwarf_index import DEFAULT_ROOT, DwarfIndex, Entry
+    from .symbols import Symbol, SymbolTable, load_symbols
+except ImportError:
+    from dwarf_index import DEFAULT_ROOT, DwarfIndex, Entry  # type: ignore
+    from symbols import Symbol, SymbolTable, load_symbols  # type: ignore
+
+# Bump when matching changes, to rebuild stored tables
+MATCH_VERSION = 1
+
+# Confidence of each pass, before scaling by the size ratio
+METHODS = (("mangled", 1.0), ("signature", 0.9), ("name", 0.7))
+# Scale for keys shared by more than one function on either side
+AMBIGUOUS_SCALE = 0.8
+# Largest key group paired in the name pass
+MAX_GROUP = 8
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS sku_matches (
+    gc_index INTEGER NOT NULL,
+    gc_name TEXT NOT NULL,
+    gc_address INTEGER NOT NULL,
+    gc_size INTEGER NOT NULL,
+    entry_id INTEGER NOT NULL,
+    dwarf_address INTEGER,
+    dwarf_size INTEGER,
+    method TEXT NOT NULL,
+    confidence REAL NOT NULL
+);
+CREATE INDEX IF NOT EXISTS sku_matches_gc_name ON sku_matches (gc_name);
+CREATE INDEX IF NOT EXISTS sku_matches_gc_address ON sku_matches (gc_address);
+CREATE TABLE IF NOT EXISTS sku_match_state (key TEXT NOT NULL);
+"""
+
+
+class Match(NamedTuple):
+    gc_index: int
+    gc_name: str
+    gc_address: int
+    gc_size: int
+    entry_id: int
+    dwarf_address: Optional[int]
+    dwarf_size: Optional[int]
+    method: str
+    confidence: float
+
+
+# Splits a CodeWarrior mangled name into its name, scope and arguments.
+# The arguments are None for names that aren't mangled functions.
+def split_mangled(name: str) -> Tuple[str, str, Optional[str]]:
+    depth = 0
+    sep = -1
+    for idx in range(1, len(name) - 1):
+        c = name[idx]
+        if c == "<":
+            depth += 1
+        elif c == ">":
+            depth -= 1
+        elif depth == 0 and name.startswith("__", idx):
+            sep = idx
+            break
+    if sep < 0:
+        return name, "", None
+    base, rest = name[:sep], name[sep + 2 :]
+    pos = 0
+    count = 1
+    if rest.startswith("Q") and len(rest) > 1 and rest[1].isdigit():
+        count = int(rest[1])
+        pos = 2
+    for _ in range(count):
+        end = pos
+        while end < len(rest) and rest[end].isdigit():
+            end += 1
+        if end == pos:
+            break
+        pos = end + int(rest[pos:end])
+    if rest.startswith("CF", pos):
+        pos += 1
+    if not rest.startswith("F", pos):
+        return name, "", None
+    return base, rest[:pos], rest[pos + 1 :]
+
+
+# Normalizes mangled arguments across platforms: long and long long become
+# int, and the return type of template functions is dropped
+def normalize_args(args: str) -> str:
+    out: List[str] = []
+    depth = 0
+    idx = 0
+    while idx < len(args):
+        c = args[idx]
+        if c.isdigit():
+            end = idx
+            while end < len(args) and args[end].isdigit():
+                end += 1
+            end += int(args[idx:end])
+            out.append(args[idx:end])
+            idx = end
+            continue
+        if c == "Q" and idx + 1 < len(args):
+            out.append(args[idx : idx + 2])
+            idx += 2
+            continue
+        if c == "A":
+            end = args.find("_", idx)
+            if end < 0:
+                end = len(args) - 1
+            out.append(args[idx : end + 1])
+            idx = end + 1
+            continue
+        if c == "F":
+            depth += 1
+        elif c == "_":
+            if depth == 0:
+                break
+            depth -= 1
+        elif c in "lx":
+            c = "i"
+        out.append(c)
+        idx += 1
+    return "".join(out)
+
+
+def signature_key(name: str) -> str:
+    base, scope, args = split_mangled(name)
+    if args is None:
+        return name
+    return f"{base}__{scope}F{normalize_args(args)}"
+
+
+def name_key(name: str) -> str:
+    base, scope, _ = split_mangled(name)
+    return f"{base}__{scope}"
+
+
+# How well a size ratio agrees with the expected ratio, from 0 to 1
+def size_score(gc_size: int, dwarf_size: Optional[int], expected: float) -> float:
+    if not gc_size or not dwarf_size:
+        return 0.5
+    distance = abs(math.log(gc_size / dwarf_size / expected))
+    return 1.0 / (1.0 + 2.0 * distance)
+
+
+def dwarf_size(entry: Entry) -> Optional[int]:
+    if entry.address is None or entry.end_address is None:
+        return None
+    return entry.end_address - entry.address
+
+
+def match_functions(
+    symbols: List[Symbol], entries: List[Entry], expected: Optional[float] = None
+) -> List[Match]:
+    remaining_gc: Dict[int, Symbol] = {symbol.index: symbol for symbol in symbols}
+    remaining_dwarf: Dict[int, Entry] = {entry.id: entry for entry in entries}
+    matches: List[Match] = []
+
+    for method, weight in METHODS:
+        key_func = {
+            "mangled": lambda name: name,
+            "signature": signature_key,
+            "name": name_key,
+        }[method]
+        gc_groups: Dict[str, List[Symbol]] = {}
+        for symbol in remaining_gc.values():
+            gc_groups.setdefault(key_func(symbol.name), []).append(symbol)
+        dwarf_groups: Dict[str, List[Entry]] = {}
+        for entry in remaining_dwarf.values():
+            key = key_func(entry.mangled or entry.name)
+            dwarf_groups.setdefault(key, []).append(entry)
+
+        if expected is None:
+            # Median size ratio of the exact matches
+            ratios: List[float] = []
+            for key, group in gc_groups.items():
+                others = dwarf_groups.get(key, [])
+                if len(group) == 1 and len(others) == 1:
+                    size = dwarf_size(others[0])
+                    if group[0].size and size:
+                        ratios.append(group[0].size / size)
+            ratios.sort()
+            expected = ratios[len(ratios) // 2] if ratios else 1.0
+
+        for key, gc_group in gc_groups.items():
+            dwarf_group = dwarf_groups.get(key)
+            if dwarf_group is None:
+                continue
+            if method == "name" and max(len(gc_group), len(dwarf_group)) > MAX_GROUP:
+                continue
+            scale = weight
+            if len(gc_group) > 1 or len(dwarf_group) > 1:
+                scale *= AMBIGUOUS_SCALE
+            pairs = [
+                (size_score(symbol.size, dwarf_size(entry), expected), symbol, entry)
+                for symbol in gc_group
+                for entry in dwarf_group
+            ]
+            pairs.sort(key=lambda pair: -pair[0])
+            for score, symbol, entry in pairs:
+                if symbol.index not in remaining_gc or entry.id not in remaining_dwarf:
+                    continue
+                del remaining_gc[symbol.index]
+                del remaining_dwarf[entry.id]
+                matches.append(
+                    Match(
+                        symbol.index,
+                        symbol.name,
+                        symbol.address,
+                        symbol.size,
+                        entry.id,
+                        entry.address,
+                        dwarf_size(entry),
+                        method,
+                        round(scale * (0.6 + 0.4 * score), 3),
+                    )
+                )
+    matches.sort(key=lambda match: match.gc_address)
+    return matches
+
+
+# GameCube functions with names, and DWARF functions without duplicates
+# (functions from headers may appear in several dumps)
+def load_functions(
+    table: SymbolTable, index: DwarfIndex
+) -> Tuple[List[Symbol], List[Entry]]:
+    symbols = [
+        symbol
+        for symbol in table
+        if symbol.type == "function" and not symbol.name.startswith("fn_")
+    ]
+    seen = set()
+    entries: List[Entry] = []
+    for entry in index.query("kind = 'function'", ()):
+        key = (entry.mangled or entry.name, entry.address)
+        if key not in seen:
+            seen.add(key)
+            entries.append(entry)
+    return symbols, entries
+
+
+class MatchTable:
+    def __init__(self, table: SymbolTable, index: DwarfIndex) -> None:
+        self.table = table
+        self.index = index
+        self.conn: sqlite3.Connection = index.conn
+        self.conn.executescript(SCHEMA)
+
+    def state_key(self) -> str:
+        return f"{MATCH_VERSION}:{self.table.digest.hex()}:{self.index.digest()}"
+
+    # Rebuilds the stored matches if their inputs changed.
+    # Returns whether they were rebuilt.
+    def update(self) -> bool:
+        key = self.state_key()
+        row = self.conn.execute("SELECT key FROM sku_match_state").fetchone()
+        if row is not None and row[0] == key:
+            return False
+        matches = match_functions(*load_functions(self.table, self.index))
+        with self.conn:
+            self.conn.execute("DELETE FROM sku_matches")
+            self.conn.execute("DELETE FROM sku_match_state")
+            self.conn.executemany(
+                "INSERT INTO sku_matches VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?)", matches
+            )
+            self.conn.execute("INSERT INTO sku_match_state VALUES (?)", (key,))
+        return True
+
+    def all(self) -> List[Match]:
+        rows = self.conn.execute("SELECT * FROM sku_matches ORDER BY gc_address")
+        return [Match(*row) for row in rows]
+
+    def for_symbol(self, symbol: Symbol) -> Optional[Match]:
+        row = self.conn.execute(
+            "SELECT * FROM sku_matches WHERE gc_index = ?", (symbol.index,)
+        ).fetchone()
+        return Match(*row) if row else None
+
+    def entry(self, match: Match) -> Optional[Entry]:
+        found = self.index.query("entries.id = ?", (match.entry_id,))
+        return found[0] if found else None
+
+
+def print_summary(matches: List[Match], functions: int) -> None:
+    print(f"Matched {len(matches)} of {functions} named GameCube functions")
+    for method, _ in METHODS:
+        confidences = [m.confidence for m in matches if m.method == method]
+        if confidences:
+            average = sum(confidences) / len(confidences)
+            print(
+                f"  {method:<10} {len(confidences):>6}"
+                f"  (average confidence {average:.2f})"
+            )
+    buckets = [0] * 5
+    for match in matches:
+        buckets[min(int(match.confidence * 5), 4)] += 1
+    print("Confidence:")
+    for idx, count in enumerate(buckets):
+        print(f"  {idx / 5:.1f}-{(idx + 1) / 5:.1f} {count:>6}")
+
+
+def find_symbol(table: SymbolTable, query: str) -> Optional[Symbol]:
+    try:
+        return table.at(int(query, 16))
+    except ValueError:
+        pass
+    found = [symbol for symbol in table.find(query) if symbol.type == "function"]
+    return found[0] if found else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Match GameCube functions with another SKU's DWARF dumps"""
+    )
+    parser.add_argument(
+        "--symbols",
+        default=os.path.join("config", "GGVE78", "symbols.txt"),
+        help="""symbols file (default: config/GGVE78/symbols.txt)""",
+    )
+    parser.add_argument(
+        "--root",
+        default=DEFAULT_ROOT,
+        help=f"""dump directory (default: {DEFAULT_ROOT})""",
+    )
+    parser.add_argument(
+        "--db", help="""index database (default: build/dwarf/<root name>.sqlite)"""
+    )
+    subparsers = parser.add_subparsers(dest="command")
+    lookup_parser = subparsers.add_parser(
+        "lookup", help="show the DWARF function matching a GameCube function"
+    )
+    lookup_parser.add_argument("function", help="GameCube symbol name or address")
+    lookup_parser.add_argument(
+        "--lines", action="store_true", help="also print the line table"
+    )
+    export_parser = subparsers.add_parser("export", help="print the table as TSV")
+    export_parser.add_argument(
+        "--min-confidence",
+        type=float,
+        default=0.0,
+        help="leave out matches below this confidence",
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.symbols):
+        sys.exit(f"{args.symbols} not found")
+    if not os.path.isdir(args.root):
+        sys.exit(f"{args.root} not found")
+    table = load_symbols(args.symbols)
+    with DwarfIndex(args.root, args.db) as index:
+        index.update()
+        matches = MatchTable(table, index)
+        matches.update()
+
+        if args.command == "lookup":
+            symbol = find_symbol(table, args.function)
+            if symbol is None:
+                sys.exit(f"No GameCube function {args.function}")
+            match = matches.for_symbol(symbol)
+            entry = matches.entry(match) if match else None
+            if match is None or entry is None:
+                sys.exit(f"No DWARF function matches {symbol.name}")
+            print(
+                f"// {symbol.name} at 0x{symbol.address:08X}:"
+                f" {match.method} match, confidence {match.confidence:.2f}"
+            )
+            print(f"// {entry.path}")
+            print(index.text(entry))
+            if args.lines:
+                for line, address, offset in index.line_table(entry):
+                    # Scaled to the GameCube function's size, so only a hint
+                    gc_offset = int(offset * symbol.size / (match.dwarf_size or 1)) & ~3
+                    print(
+                        f"  line {line:>5}  +0x{offset:x}"
+                        f"  (~0x{symbol.address + gc_offset:08X})"
+                    )
+        elif args.command == "export":
+            print("gc_name\tgc_address\tdwarf_name\tdwarf_path\tmethod\tconfidence")
+            entries = {e.id: e for e in index.query("kind = 'function'", ())}
+            for match in matches.all():
+                if match.confidence < args.min_confidence:
+                    continue
+                entry = entries[match.entry_id]
+                print(
+                    f"{match.gc_name}\t0x{match.gc_address:08X}\t{entry.name}"
+                    f"\t{entry.path}\t{match.method}\t{match.confidence:.3f}"
+                )
+        else:
+            functions = len(load_functions(table, index)[0])
+            print_summary(matches.all(), functions)
+
+
+if __name__ == "__main__":
+    main()
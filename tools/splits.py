@@ -0,0 +1,337 @@
+#!/usr/bin/env python3
+
+###
+# Index of a dtk splits.txt file, mapping addresses to translation units.
+#
+# The splits of each section are kept sorted by address, so point and range
+# queries are binary searches. Validation checks every section in one pass
+# for overlapping splits, misaligned splits, gaps between splits and common
+# .bss splits that aren't at the end of the section.
+#
+# Usage:
+#   python3 tools/splits.py 0x80123456
+#   python3 tools/splits.py 0x80005000-0x80006000 --section .text
+#   python3 tools/splits.py --validate --gaps
+#
+# From Python:
+#   from tools.splits import load_splits
+#   splits = load_splits("config/GGVE78/splits.txt")
+#   splits.at(0x80123456), splits.validate()
+###
+
+import argparse
+import bisect
+import os
+import re
+import sys
+from array import array
+from typing import Dict, Iterator, List, NamedTuple, Optional, Tuple
+
+# Minimum alignment of splits in code sections
+CODE_ALIGN = 4
+
+section_pattern = re.compile(r"^\s+(\S+)\s*(.*)$")
+split_attributes = {"start", "end", "align", "common", "rename", "skip"}
+
+
+class SectionInfo(NamedTuple):
+    name: str
+    type: str
+    align: int
+
+
+class Split(NamedTuple):
+    unit: str
+    section: str
+    start: int
+    end: int
+    align: Optional[int]
+    common: bool
+    rename: Optional[str]
+    skip: bool
+    line: int
+
+    @property
+    def size(self) -> int:
+        return self.end - self.start
+
+    def __str__(self) -> str:
+        return f"{self.unit} {self.section} 0x{self.start:08X}-0x{self.end:08X}"
+
+
+class Issue(NamedTuple):
+    kind: str  # "overlap", "align", "common", "range" or "gap"
+    section: str
+    start: int
+    end: int
+    message: str
+
+    # Gaps are left to dtk, which generates units for them
+    @property
+    def is_error(self) -> bool:
+        return self.kind != "gap"
+
+    def __str__(self) -> str:
+        return f"{self.section} 0x{self.start:08X}-0x{self.end:08X}: {self.message}"
+
+
+# Splits of a section, sorted by start and then end address
+class SectionSplits:
+    def __init__(self, splits: List[Split]) -> None:
+        self.splits = sorted(splits, key=lambda split: (split.start, split.end))
+        self.starts = array("I", (split.start for split in self.splits))
+        # Highest end address of the splits up to each one, to stop searching
+        # backwards for splits containing an address
+        self.max_ends = array("I")
+        max_end = 0
+        for split in self.splits:
+            max_end = max(max_end, split.end)
+            self.max_ends.append(max_end)
+
+    def __iter__(self) -> Iterator[Split]:
+        return iter(self.splits)
+
+    # Splits intersecting [start, end), in address order
+    def overlapping(self, start: int, end: int) -> List[Split]:
+        index = bisect.bisect_left(self.starts, max(end, start + 1)) - 1
+        found: List[Split] = []
+        while index >= 0 and self.max_ends[index] > start:
+            if self.splits[index].end > start:
+                found.append(self.splits[index])
+            index -= 1
+        found.reverse()
+        return found
+
+    def at(self, address: int) -> Optional[Split]:
+        found = self.overlapping(address, address + 1)
+        return found[-1] if found else None
+
+
+class Splits:
+    def __init__(self, sections: Dict[str, SectionInfo], splits: List[Split]):
+        self.sections = sections
+        self.units: List[str] = []
+        by_section: Dict[str, List[Split]] = {}
+        for split in splits:
+            if not self.units or self.units[-1] != split.unit:
+                self.units.append(split.unit)
+            by_section.setdefault(split.section, []).append(split)
+        self.index = {name: SectionSplits(s) for name, s in by_section.items()}
+
+    def __iter__(self) -> Iterator[Split]:
+        for section in self.index.values():
+            yield from section
+
+    # Split containing the address, in the given section or any section
+    def at(self, address: int, section: Optional[str] = None) -> Optional[Split]:
+        if section is not None:
+            section_splits = self.index.get(section)
+            return section_splits.at(address) if section_splits else None
+        for section_splits in self.index.values():
+            split = section_splits.at(address)
+            if split is not None:
+                return split
+        return None
+
+    def overlapping(
+        self, start: int, end: int, section: Optional[str] = None
+    ) -> List[Split]:
+        found: List[Split] = []
+        for name, section_splits in self.index.items():
+            if section is None or name == section:
+                found.extend(section_splits.overlapping(start, end))
+        return found
+
+    def unit_splits(self, unit: str) -> List[Split]:
+        return [split for split in self if split.unit == unit]
+
+    # Checks each section in a single pass over its sorted splits
+    def validate(self) -> List[Issue]:
+        issues: List[Issue] = []
+        for name, section_splits in self.index.items():
+            info = self.sections.get(name)
+            is_bss = info is not None and info.type == "bss"
+            is_code = info is not None and info.type == "code"
+            previous: Optional[Split] = None
+            common: Optional[Split] = None
+
+            def issue(kind: str, start: int, end: int, message: str) -> None:
+                issues.append(Issue(kind, name, start, end, message))
+
+            for split in section_splits:
+                if split.end < split.start:
+                    issue("range", split.start, split.end, f"{split.unit} ends first")
+                align = split.align or (CODE_ALIGN if is_code else 1)
+                if split.start % align != 0 or (is_code and split.end % align != 0):
+                    issue(
+                        "align",
+                        split.start,
+                        split.end,
+                        f"{split.unit} isn't aligned to {align}",
+                    )
+                if split.common and not is_bss:
+                    issue("common", split.start, split.end, f"{split.unit} isn't .bss")
+                if common is not None and not split.common:
+                    issue(
+                        "common",
+                        split.start,
+                        split.end,
+                        f"{split.unit} follows common split {common.unit}",
+                    )
+                if previous is not None:
+                    if split.start < previous.end:
+                        issue(
+                            "overlap",
+                            split.start,
+                            min(split.end, previous.end),
+                            f"{split.unit} overlaps {previous.unit}",
+                        )
+                    elif split.start > previous.end:
+                        issue(
+                            "gap",
+                            previous.end,
+                            split.start,
+                            f"{split.start - previous.end:#x} bytes unsplit"
+                            f" after {previous.unit}",
+                        )
+                if split.common and common is None:
+                    common = split
+                if previous is None or split.end > previous.end:
+                    previous = split
+        return issues
+
+
+def parse_number(value: str) -> int:
+    return int(value, 0)
+
+
+def parse_splits(path: str, text: str) -> Splits:
+    sections: Dict[str, SectionInfo] = {}
+    splits: List[Split] = []
+    unit: Optional[str] = None
+    for line_num, line in enumerate(text.splitlines(), 1):
+        if not line.strip() or line.lstrip().startswith("//"):
+            continue
+        if not line[0].isspace():
+            unit = line.split(":", 1)[0].strip()
+            continue
+        match = section_pattern.match(line)
+        if match is None or unit is None:
+            sys.exit(f"{path}:{line_num}: unexpected line: {line.strip()}")
+        name = match.group(1)
+        attrs: Dict[str, str] = {}
+        for attr in match.group(2).split():
+            key, _, value = attr.partition(":")
+            attrs[key] = value
+        try:
+            if unit == "Sections":
+                sections[name] = SectionInfo(
+                    name, attrs.get("type", ""), parse_number(attrs.get("align", "1"))
+                )
+                continue
+            unknown = set(attrs) - split_attributes
+            if unknown:
+                raise ValueError(f"unknown attribute {sorted(unknown)[0]}")
+            splits.append(
+                Split(
+                    unit,
+                    name,
+                    parse_number(attrs["start"]),
+                    parse_number(attrs["end"]),
+                    parse_number(attrs["align"]) if "align" in attrs else None,
+                    "common" in attrs,
+                    attrs.get("rename"),
+                    "skip" in attrs,
+                    line_num,
+                )
+            )
+        except KeyError as e:
+            sys.exit(f"{path}:{line_num}: missing {e.args[0]}")
+        except ValueError as e:
+            sys.exit(f"{path}:{line_num}: {e}")
+    return Splits(sections, splits)
+
+
+def load_splits(path: str) -> Splits:
+    with open(path, encoding="utf-8") as f:
+        return parse_splits(path, f.read())
+
+
+# Validates splits.txt, exiting on errors. Used by configure as a pre-check.
+def check_splits(path: str) -> None:
+    errors = [issue for issue in load_splits(path).validate() if issue.is_error]
+    for issue in errors:
+        print(f"{path}: {issue}", file=sys.stderr)
+    if errors:
+        sys.exit(f"{len(errors)} error(s) in {path}")
+
+
+def parse_query(query: str) -> Tuple[int, int]:
+    start, sep, end = query.partition("-")
+    try:
+        begin = int(start, 16)
+        return begin, int(end, 16) if sep else begin + 1
+    except ValueError:
+        sys.exit(f"Invalid address or range: {query}")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Look up and validate translation unit splits"""
+    )
+    parser.add_argument(
+        "query",
+        nargs="*",
+        help="""address or START-END range (hex, optionally 0x prefixed)""",
+    )
+    parser.add_argument(
+        "--splits",
+        default=os.path.join("config", "GGVE78", "splits.txt"),
+        help="""splits file (default: config/GGVE78/splits.txt)""",
+    )
+    parser.add_argument("--section", help="""only query this section""")
+    parser.add_argument(
+        "--validate", action="store_true", help="""check for overlaps and alignment"""
+    )
+    parser.add_argument(
+        "--gaps", action="store_true", help="""also list unsplit gaps when validating"""
+    )
+    args = parser.parse_args()
+
+    if not os.path.isfile(args.splits):
+        sys.exit(f"{args.splits} not found")
+    splits = load_splits(args.splits)
+
+    failed = False
+    for query in args.query:
+        start, end = parse_query(query)
+        if end == start + 1:
+            split = splits.at(start, args.section)
+            if split is None:
+                print(f"0x{start:08X}: no split")
+                failed = True
+            else:
+                print(f"0x{start:08X}: {split} (+{start - split.start:#x})")
+            continue
+        found = splits.overlapping(start, end, args.section)
+        if not found:
+            print(f"0x{start:08X}-0x{end:08X}: no splits")
+            failed = True
+        for split in found:
+            print(split)
+
+    if args.validate:
+        issues = splits.validate()
+        errors = sum(issue.is_error for issue in issues)
+        for issue in issues:
+            if issue.is_error or args.gaps:
+                print(issue)
+        gaps = len(issues) - errors
+        print(f"{errors} error(s), {gaps} gap(s) in {len(splits.units)} units")
+        failed = failed or errors > 0
+    if failed:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,485 @@
+#!/usr/bin/env python3
+
+###
+# Index of a dtk symbols.txt file, for fast lookups from other tools.
+#
+# The symbols are parsed once into columns sorted by address (address, size,
+# alignment, section, type, scope, data kind and flags), with the names
+# interned in a single blob. The columns are saved to a binary cache keyed on
+# the hash of symbols.txt, which later runs memory-map instead of parsing.
+#
+# Usage:
+#   python3 tools/symbols.py 0x80003110 memset
+#   python3 tools/symbols.py --demangle update__6zCamSBFR6xScenef
+#   python3 tools/symbols.py --symbols config/GGVE78/symbols.txt --stats
+#
+# From Python:
+#   from tools.symbols import load_symbols
+#   symbols = load_symbols("config/GGVE78/symbols.txt")
+#   symbols.at(0x80003110), symbols.find("memset")
+###
+
+import argparse
+import bisect
+import hashlib
+import mmap
+import os
+import re
+import struct
+import sys
+import time
+from array import array
+from typing import (
+    Dict,
+    Iterator,
+    List,
+    NamedTuple,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+try:
+    from .demangle import demangle
+except ImportError:
+    from demangle import demangle  # type: ignore
+
+script_dir = os.path.dirname(os.path.realpath(__file__))
+root_dir = os.path.abspath(os.path.join(script_dir, ".."))
+
+# Values of the enumerated attributes, stored as their index
+SYMBOL_TYPES = ("", "function", "object", "label")
+SCOPES = ("", "global", "local", "weak")
+DATA_KINDS = (
+    "",
+    "byte",
+    "2byte",
+    "4byte",
+    "8byte",
+    "float",
+    "double",
+    "string",
+    "wstring",
+    "string_table",
+    "wstring_table",
+)
+# Attributes without a value, stored as bits
+FLAGS = ("hidden", "force_active", "noreloc", "noexport", "stripped")
+
+symbol_pattern = re.compile(r"^(\S+) = ([^:\s]+):0x([0-9A-Fa-f]+);(?: // (.*))?$")
+
+CACHE_MAGIC = b"SYMI"
+CACHE_VERSION = 1
+# Magic, version, little endian flag, symbols.txt hash, symbol count,
+# name blob size and section name blob size
+CACHE_HEADER = struct.Struct("<4sHH32sIII")
+
+
+class Symbol(NamedTuple):
+    index: int
+    name: str
+    section: str
+    address: int
+    size: int
+    type: str
+    scope: str
+    data: str
+    align: int
+    flags: Tuple[str, ...]
+
+    @property
+    def end(self) -> int:
+        return self.address + self.size
+
+    # Formats the symbol as a symbols.txt line
+    def __str__(self) -> str:
+        attrs = [f"type:{self.type}"] if self.type else []
+        if self.size:
+            attrs.append(f"size:{self.size:#X}".replace("0X", "0x"))
+        if self.scope:
+            attrs.append(f"scope:{self.scope}")
+        if self.align:
+            attrs.append(f"align:{self.align}")
+        if self.data:
+            attrs.append(f"data:{self.data}")
+        attrs.extend(self.flags)
+        location = f"{self.section}:0x{self.address:08X}"
+        return f"{self.name} = {location}; // {' '.join(attrs)}"
+
+
+# Columns of parsed symbols, in file order
+class Columns:
+    def __init__(self) -> None:
+        self.addresses = array("I")
+        self.sizes = array("I")
+        self.aligns = array("I")
+        self.sections = array("B")
+        self.types = array("B")
+        self.scopes = array("B")
+        self.data = array("B")
+        self.flags = array("B")
+        self.names: List[bytes] = []
+        self.section_names: List[str] = []
+
+
+def parse_attributes(columns: Columns, comment: str, line_num: int, path: str) -> None:
+    size = align = symbol_type = scope = data = flags = 0
+    for attr in comment.split():
+        key, _, value = attr.partition(":")
+        try:
+            if key == "type":
+                symbol_type = SYMBOL_TYPES.index(value)
+            elif key == "size":
+                size = int(value, 0)
+            elif key == "scope":
+                scope = SCOPES.index(value)
+            elif key == "align":
+                align = int(value, 0)
+            elif key == "data":
+                data = DATA_KINDS.index(value)
+            elif not value and key in FLAGS:
+                flags |= 1 << FLAGS.index(key)
+            else:
+                raise ValueError
+        except ValueError:
+            sys.exit(f"{path}:{line_num}: unknown symbol attribute {attr}")
+    columns.sizes.append(size)
+    columns.aligns.append(align)
+    columns.types.append(symbol_type)
+    columns.scopes.append(scope)
+    columns.data.append(data)
+    columns.flags.append(flags)
+
+
+def parse_symbols(path: str, text: str) -> Columns:
+    columns = Columns()
+    section_ids: Dict[str, int] = {}
+    for line_num, line in enumerate(text.splitlines(), 1):
+        line = line.strip()
+        if not line:
+            continue
+        match = symbol_pattern.match(line)
+        if match is None:
+            sys.exit(f"{path}:{line_num}: invalid symbol: {line}")
+        name, section, address, comment = match.groups()
+        section_id = section_ids.get(section)
+        if section_id is None:
+            section_id = section_ids[section] = len(columns.section_names)
+            columns.section_names.append(section)
+        columns.names.append(name.encode("utf-8"))
+        columns.addresses.append(int(address, 16))
+        columns.sections.append(section_id)
+        parse_attributes(columns, comment or "", line_num, path)
+    return columns
+
+
+# Serializes the columns sorted by address (then file order), with the names
+# in a blob and a permutation of the symbols sorted by name
+def build_cache(digest: bytes, columns: Columns) -> bytes:
+    count = len(columns.addresses)
+    order = sorted(range(count), key=lambda i: columns.addresses[i])
+    names = [columns.names[i] for i in order]
+    name_offsets = array("I", [0])
+    for name in names:
+        name_offsets.append(name_offsets[-1] + len(name))
+    name_order = array("I", sorted(range(count), key=names.__getitem__))
+    # Highest end address of the symbols up to each one, to stop searching
+    # backwards for a symbol containing an address
+    max_ends = array("I")
+    max_end = 0
+    for i in order:
+        max_end = max(max_end, columns.addresses[i] + columns.sizes[i])
+        max_ends.append(max_end)
+
+    name_blob = b"".join(names)
+    section_blob = "\0".join(columns.section_names).encode("utf-8")
+    parts = [
+        CACHE_HEADER.pack(
+            CACHE_MAGIC,
+            CACHE_VERSION,
+            sys.byteorder == "little",
+            digest,
+            count,
+            len(name_blob),
+            len(section_blob),
+        ),
+        pad(section_blob),
+    ]
+    for column in word_columns(columns):
+        parts.append(array("I", (column[i] for i in order)).tobytes())
+    parts.append(name_offsets.tobytes())
+    parts.append(name_order.tobytes())
+    parts.append(max_ends.tobytes())
+    for column in byte_columns(columns):
+        parts.append(pad(bytes(column[i] for i in order)))
+    parts.append(name_blob)
+    return b"".join(parts)
+
+
+def word_columns(columns: Columns) -> Sequence[array]:
+    return columns.addresses, columns.sizes, columns.aligns
+
+
+def byte_columns(columns: Columns) -> Sequence[array]:
+    return (
+        columns.sections,
+        columns.types,
+        columns.scopes,
+        columns.data,
+        columns.flags,
+    )
+
+
+def pad(data: bytes) -> bytes:
+    return data + b"\0" * (-len(data) % 4)
+
+
+def default_cache_path(path: str) -> str:
+    version = os.path.basename(os.path.dirname(os.path.abspath(path)))
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(root_dir, "build", version, f"{name}.idx")
+
+
+class SymbolTable:
+    def __init__(self, data: Union[bytes, mmap.mmap]) -> None:
+        self._data = data
+        view = memoryview(data)
+        header = CACHE_HEADER.unpack_from(view)
+        _, _, _, self.digest, count, names_size, sections_size = header
+        offset = CACHE_HEADER.size
+        sections = bytes(view[offset : offset + sections_size]).decode("utf-8")
+        self.section_names = sections.split("\0")
+        offset += sections_size + (-sections_size % 4)
+
+        def words(length: int) -> memoryview:
+            nonlocal offset
+            column = view[offset : offset + length * 4].cast("I")
+            offset += length * 4
+            return column
+
+        def raw_bytes(length: int) -> memoryview:
+            nonlocal offset
+            column = view[offset : offset + length]
+            offset += length + (-length % 4)
+            return column
+
+        self.addresses = words(count)
+        self.sizes = words(count)
+        self.aligns = words(count)
+        self._name_offsets = words(count + 1)
+        self._name_order = words(count)
+        self._max_ends = words(count)
+        self.sections = raw_bytes(count)
+        self.types = raw_bytes(count)
+        self.scopes = raw_bytes(count)
+        self.data = raw_bytes(count)
+        self.flags = raw_bytes(count)
+        self._names = view[offset : offset + names_size]
+
+    def __len__(self) -> int:
+        return len(self.addresses)
+
+    def __iter__(self) -> Iterator[Symbol]:
+        return (self[i] for i in range(len(self)))
+
+    def __getitem__(self, index: int) -> Symbol:
+        flags = self.flags[index]
+        return Symbol(
+            index,
+            self.name(index),
+            self.section_names[self.sections[index]],
+            self.addresses[index],
+            self.sizes[index],
+            SYMBOL_TYPES[self.types[index]],
+            SCOPES[self.scopes[index]],
+            DATA_KINDS[self.data[index]],
+            self.aligns[index],
+            tuple(flag for bit, flag in enumerate(FLAGS) if flags & (1 << bit)),
+        )
+
+    def _name_bytes(self, index: int) -> bytes:
+        offsets = self._name_offsets
+        return bytes(self._names[offsets[index] : offsets[index + 1]])
+
+    def name(self, index: int) -> str:
+        return self._name_bytes(index).decode("utf-8")
+
+    # Symbols with the given name (local symbols may share a name)
+    def find(self, name: str) -> List[Symbol]:
+        key = name.encode("utf-8")
+        order = self._name_order
+        lo, hi = 0, len(order)
+        while lo < hi:
+            mid = (lo + hi) // 2
+            if self._name_bytes(order[mid]) < key:
+                lo = mid + 1
+            else:
+                hi = mid
+        found = []
+        while lo < len(order) and self._name_bytes(order[lo]) == key:
+            found.append(self[order[lo]])
+            lo += 1
+        found.sort(key=lambda symbol: symbol.index)
+        return found
+
+    # Innermost sized symbol containing the address, or else a label at it
+    def at(self, address: int) -> Optional[Symbol]:
+        index = bisect.bisect_right(self.addresses, address) - 1
+        label: Optional[int] = None
+        while index >= 0 and self._max_ends[index] > address:
+            start = self.addresses[index]
+            if start + self.sizes[index] > address:
+                return self[index]
+            if start == address and label is None:
+                label = index
+            index -= 1
+        while label is None and index >= 0 and self.addresses[index] == address:
+            if self.sizes[index] == 0:
+                label = index
+            index -= 1
+        return None if label is None else self[label]
+
+    # Symbols starting in [start, end), in address order
+    def between(self, start: int, end: int) -> List[Symbol]:
+        lo = bisect.bisect_left(self.addresses, start)
+        hi = bisect.bisect_left(self.addresses, end)
+        return [self[i] for i in range(lo, hi)]
+
+
+def hash_bytes(data: bytes) -> bytes:
+    return hashlib.sha256(data).digest()
+
+
+def read_cache(cache_path: str, digest: bytes) -> Optional[SymbolTable]:
+    try:
+        with open(cache_path, "rb") as f:
+            data = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+    except (OSError, ValueError):
+        return None
+    if len(data) < CACHE_HEADER.size:
+        return None
+    magic, version, little, cached_digest = CACHE_HEADER.unpack_from(data)[:4]
+    if (
+        magic != CACHE_MAGIC
+        or version != CACHE_VERSION
+        or little != (sys.byteorder == "little")
+        or cached_digest != digest
+    ):
+        data.close()
+        return None
+    return SymbolTable(data)
+
+
+# Loads the symbols, from the cache if it matches the contents of the file.
+# Pass cache_path="" to always parse the file.
+def load_symbols(path: str, cache_path: Optional[str] = None) -> SymbolTable:
+    with open(path, "rb") as f:
+        contents = f.read()
+    digest = hash_bytes(contents)
+    if cache_path is None:
+        cache_path = default_cache_path(path)
+    if cache_path:
+        table = read_cache(cache_path, digest)
+        if table is not None:
+            return table
+
+    columns = parse_symbols(path, contents.decode("utf-8"))
+    data = build_cache(digest, columns)
+    if cache_path:
+        try:
+            os.makedirs(os.path.dirname(cache_path) or ".", exist_ok=True)
+            tmp_path = f"{cache_path}.{os.getpid()}.tmp"
+            with open(tmp_path, "wb") as f:
+                f.write(data)
+            os.replace(tmp_path, cache_path)
+        except OSError as e:
+            print(f"Failed to write {cache_path}: {e}", file=sys.stderr)
+    return SymbolTable(data)
+
+
+def parse_address(query: str) -> Optional[int]:
+    if re.fullmatch(r"(0x)?[0-9A-Fa-f]{8}", query):
+        return int(query, 16)
+    return None
+
+
+def print_stats(table: SymbolTable, elapsed: float) -> None:
+    print(f"{len(table)} symbols, loaded in {elapsed * 1000:.1f} ms")
+    counts: Dict[str, Tuple[int, int]] = {}
+    for index in range(len(table)):
+        section = table.section_names[table.sections[index]]
+        count, size = counts.get(section, (0, 0))
+        counts[section] = (count + 1, size + table.sizes[index])
+    for section, (count, size) in counts.items():
+        print(f"  {section:<12} {count:>6} symbols  {size:#10x} bytes")
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(
+        description="""Look up symbols by address or name"""
+    )
+    parser.add_argument(
+        "query",
+        nargs="*",
+        help="""address (8 hex digits, optionally 0x prefixed) or symbol name""",
+    )
+    parser.add_argument(
+        "-s",
+        "--symbols",
+        default=os.path.join("config", "GGVE78", "symbols.txt"),
+        help="""symbols file (default: config/GGVE78/symbols.txt)""",
+    )
+    parser.add_argument(
+        "--cache",
+        help="""index cache file (default: build/<version>/symbols.idx)""",
+    )
+    parser.add_argument(
+        "--no-cache", action="store_true", help="""don't read or write the cache"""
+    )
+    parser.add_argument(
+        "--stats", action="store_true", help="""print load time and section totals"""
+    )
+    parser.add_argument(
+        "-d",
+        "--demangle",
+        action="store_true",
+        help="""print demangled names after the symbols""",
+    )
+    args = parser.parse_args()
+
+    def describe(symbol: Symbol) -> str:
+        demangled = demangle(symbol.name) if args.demangle else None
+        return f"{symbol} // {demangled}" if demangled else str(symbol)
+
+    if not os.path.isfile(args.symbols):
+        sys.exit(f"{args.symbols} not found")
+    start = time.perf_counter()
+    table = load_symbols(args.symbols, "" if args.no_cache else args.cache)
+    if args.stats:
+        print_stats(table, time.perf_counter() - start)
+
+    missing = 0
+    for query in args.query:
+        address = parse_address(query)
+        if address is not None:
+            symbol = table.at(address)
+            if symbol is None:
+                print(f"0x{address:08X}: no symbol")
+                missing += 1
+            else:
+                offset = address - symbol.address
+                print(f"0x{address:08X}: {describe(symbol)} (+{offset:#x})")
+            continue
+        symbols = table.find(query)
+        if not symbols:
+            print(f"{query}: no symbol")
+            missing += 1
+        for symbol in symbols:
+            print(describe(symbol))
+    if missing:
+        sys.exit(1)
+
+
+if __name__ == "__main__":
+    main()
@@ -6,58 +6,105 @@
 #
 # Usage:
 #   python3 tools/transform_dep.py build/src/file.d build/src/file.d
+#   python3 tools/transform_dep.py build/src/file.d build/src/file.d \
+#     --keep-unchanged build/src/file.o
 #
 # If changes are made, please submit a PR to
 # https://github.com/encounter/dtk-template
 ###
 
 import argparse
+import hashlib
 import os
-from platform import uname
+import time
+from functools import lru_cache
+from typing import Optional
 
-wineprefix = os.path.join(os.environ["HOME"], ".wine")
+wineprefix = os.path.join(os.environ.get("HOME", ""), ".wine")
 if "WINEPREFIX" in os.environ:
     wineprefix = os.environ["WINEPREFIX"]
 winedevices = os.path.join(wineprefix, "dosdevices")
 
 
+@lru_cache(maxsize=None)
 def in_wsl() -> bool:
+    from platform import uname
+
     return "microsoft-standard" in uname().release
 
 
-def import_d_file(in_file: str) -> str:
-    out_text = ""
+# Resolves a drive letter through $WINEPREFIX/dosdevices, once per prefix and drive
+@lru_cache(maxsize=None)
+def drive_root(devices: str, drive: str) -> str:
+    return os.path.realpath(os.path.join(devices, drive + ":"))
+
+
+def transform_path(path: str, devices: Optional[str] = None) -> str:
+    # lowercase drive letter
+    drive = path[0].lower()
+    rest = path[2:].replace("\\", "/")
+    if drive == "z":
+        # shortcut for z:
+        return rest
+    elif in_wsl():
+        return os.path.join("/mnt", drive + rest)
+    else:
+        root = drive_root(devices or winedevices, drive)
+        return os.path.normpath(root + "/" + rest.lstrip("/"))
 
+
+def transform_d_text(text: str, devices: Optional[str] = None) -> str:
+    lines = text.splitlines(keepends=True)
+    if not lines:
+        return ""
+    out = []
+    first = lines[0]
+    if first.endswith(" \\\n"):
+        out.append(first[:-3].replace("\\", "/") + " \\\n")
+    else:
+        out.append(first.replace("\\", "/"))
+    for line in lines[1:]:
+        suffix = ""
+        if line.endswith(" \\\n"):
+            suffix = " \\"
+            path = line.lstrip()[:-3]
+        else:
+            path = line.strip()
+        if not path:
+            continue
+        out.append("\t" + transform_path(path, devices) + suffix + "\n")
+    return "".join(out)
+
+
+def import_d_file(in_file: str) -> str:
     with open(in_file) as file:
-        for idx, line in enumerate(file):
-            if idx == 0:
-                if line.endswith(" \\\n"):
-                    out_text += line[:-3].replace("\\", "/") + " \\\n"
-                else:
-                    out_text += line.replace("\\", "/")
-            else:
-                suffix = ""
-                if line.endswith(" \\\n"):
-                    suffix = " \\"
-                    path = line.lstrip()[:-3]
-                else:
-                    path = line.strip()
-                # lowercase drive letter
-                path = path[0].lower() + path[1:]
-                if path[0] == "z":
-                    # shortcut for z:
-                    path = path[2:].replace("\\", "/")
-                elif in_wsl():
-                    path = path[0:1] + path[2:]
-                    path = os.path.join("/mnt", path.replace("\\", "/"))
-                else:
-                    # use $WINEPREFIX/dosdevices to resolve path
-                    path = os.path.realpath(
-                        os.path.join(winedevices, path.replace("\\", "/"))
-                    )
-                out_text += "\t" + path + suffix + "\n"
-
-    return out_text
+        return transform_d_text(file.read())
+
+
+# Transforms a .d file in place, for use from compile wrappers
+def transform_d_file(path: str) -> None:
+    output = import_d_file(path)
+    with open(path, "w", encoding="UTF-8") as f:
+        f.write(output)
+
+
+# Puts an object's modification time back when it was rewritten with the same
+# contents, so that ninja's restat skips the link and everything after it.
+# The hash and mtime of the last distinct contents are kept in <object>.sha1.
+def keep_unchanged(path: str) -> None:
+    stamp_path = path + ".sha1"
+    with open(path, "rb") as f:
+        digest = hashlib.sha1(f.read()).hexdigest()
+    try:
+        with open(stamp_path, encoding="utf-8") as f:
+            old_digest, old_mtime = f.read().split()
+        if old_digest == digest:
+            os.utime(path, ns=(time.time_ns(), int(old_mtime)))
+            return
+    except (OSError, ValueError):
+        pass
+    with open(stamp_path, "w", encoding="utf-8") as f:
+        f.write(f"{digest} {os.stat(path).st_mtime_ns}\n")
 
 
 def main() -> None:
@@ -72,12 +119,19 @@ def main() -> None:
         "d_file_out",
         help="""Dependency file out""",
     )
+    parser.add_argument(
+        "--keep-unchanged",
+        metavar="OBJECT",
+        help="""Keep the modification time of OBJECT if its contents didn't change""",
+    )
     args = parser.parse_args()
 
     output = import_d_file(args.d_file)
 
     with open(args.d_file_out, "w", encoding="UTF-8") as f:
         f.write(output)
+    if args.keep_unchanged:
+        keep_unchanged(args.keep_unchanged)
 
 
 if __name__ == "__main__":